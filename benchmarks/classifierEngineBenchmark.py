@@ -0,0 +1,60 @@
+"""
+Compares the tiles per second of the classification engine against the functions of the classify module.
+Run from the root of the repository, as the model is loaded from the 'models' directory:
+
+    python benchmarks/classifierEngineBenchmark.py --tiles 512 --batch-size 32
+"""
+import argparse
+import time
+import os
+import sys
+import numpy as np
+import torch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from classificationScreening import classify
+from classificationScreening.engine import ClassifierEngine
+
+
+def tilesPerSecond(classifyBatch, tiles, batchSize, repeats):
+    """Runs classifyBatch over all tiles in batches, and returns the best tiles per second out of the repeats"""
+    bestTime = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for i in range(0, len(tiles), batchSize):
+            classifyBatch(tiles[i:i + batchSize])
+        bestTime = min(bestTime, time.perf_counter() - start)
+    return len(tiles) / bestTime
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the classification engine")
+    parser.add_argument("--tiles", type=int, default=512, help="The number of 256px tiles classified per repeat")
+    parser.add_argument("--batch-size", type=int, default=32, help="The number of tiles classified at once")
+    parser.add_argument("--threads", type=int, default=None, help="The number of intra-op threads of the engine")
+    parser.add_argument("--repeats", type=int, default=3, help="The number of times each path is timed")
+    args = parser.parse_args()
+
+    tiles = np.random.randint(0, 256, (args.tiles, 3, 256, 256), dtype=np.uint8)
+    model = classify.get_classifier()
+
+    # The path used before the engine, one tile at a time without inference mode or tracing
+    def singleTile(batch):
+        for tile in batch:
+            model(torch.from_numpy(tile).float().unsqueeze(0) / 255)
+
+    results = {
+        "classify.infer, batch of 1": tilesPerSecond(singleTile, tiles, args.batch_size, args.repeats),
+        f"classify.array_batch_infer, batch of {args.batch_size}": tilesPerSecond(classify.array_batch_infer, tiles, args.batch_size, args.repeats),
+    }
+    for compileMode in (None, "trace"):
+        engine = ClassifierEngine(compile_mode=compileMode, threads=args.threads, warmup_batch_size=args.batch_size)
+        results[f"ClassifierEngine({compileMode}), batch of {args.batch_size}"] = tilesPerSecond(engine.array_batch_infer, tiles, args.batch_size, args.repeats)
+
+    baseline = next(iter(results.values()))
+    for name, speed in results.items():
+        print(f"{name:<55} {speed:>10.1f} tiles/s {speed / baseline:>6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
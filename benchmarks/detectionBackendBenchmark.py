@@ -0,0 +1,89 @@
+"""
+Compares the ONNX Runtime and OpenVINO backends of the oriented bounding box model with the PyTorch backend, reporting
+the latency per 1024px crop and how many of the PyTorch boxes each backend reproduces. Run from the root of the
+repository, as the models are loaded from the 'models' directory:
+
+    python benchmarks/detectionBackendBenchmark.py --model-type m --crops run/crops --backends onnx openvino
+"""
+import argparse
+import time
+import os
+import sys
+import numpy as np
+from PIL import Image
+from shapely.geometry import Polygon
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from orientedBoundingBox.predictOBB import loadDetectionModel
+
+
+def loadCrops(cropDir, numCrops, cropSize):
+    """Loads the crops from cropDir, or makes random crops if no directory is given"""
+    if cropDir is None:
+        return [Image.fromarray(np.random.randint(0, 256, (cropSize, cropSize, 3), dtype=np.uint8)) for _ in range(numCrops)]
+    names = sorted(name for name in os.listdir(cropDir) if name.endswith((".png", ".jpg", ".jpeg")))[:numCrops]
+    return [Image.open(os.path.join(cropDir, name)).convert("RGB") for name in names]
+
+
+def detect(model, crops, predictionThreshold):
+    """Runs the model over every crop, returning the boxes and confidences of each crop and the mean latency"""
+    detections = []
+    start = time.perf_counter()
+    for crop in crops:
+        result = model(crop, conf=predictionThreshold, iou=0.01, verbose=False)[0].cpu()
+        detections.append((result.obb.xyxyxyxy.numpy(), result.obb.conf.numpy()))
+    return detections, (time.perf_counter() - start) / len(crops)
+
+
+def boxAgreement(referenceDetections, detections, iouThreshold):
+    """Matches every reference box to the best unmatched box of the same crop, and returns the share that matched and their mean confidence difference"""
+    matched, total, confidenceDifferences = 0, 0, []
+    for (referenceBoxes, referenceConf), (boxes, conf) in zip(referenceDetections, detections):
+        polygons = [Polygon(box) for box in boxes]
+        used = set()
+        for referenceBox, referenceConfidence in zip(referenceBoxes, referenceConf):
+            total += 1
+            referencePolygon = Polygon(referenceBox)
+            best, bestIou = None, iouThreshold
+            for j, polygon in enumerate(polygons):
+                if j in used:
+                    continue
+                union = referencePolygon.union(polygon).area
+                iou = referencePolygon.intersection(polygon).area / union if union > 0 else 0
+                if iou >= bestIou:
+                    best, bestIou = j, iou
+            if best is not None:
+                used.add(best)
+                matched += 1
+                confidenceDifferences.append(abs(float(referenceConfidence) - float(conf[best])))
+    agreement = matched / total if total else float("nan")
+    return agreement, float(np.mean(confidenceDifferences)) if confidenceDifferences else 0.0, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the detection backends against PyTorch")
+    parser.add_argument("--model-type", default="m", help="The yolo model type, 'n', 's' or 'm'")
+    parser.add_argument("--backends", nargs="+", default=["onnx", "openvino"], help="The backends compared with PyTorch")
+    parser.add_argument("--crops", default=None, help="A directory of 1024px crops, random crops are used if it is not given")
+    parser.add_argument("--num-crops", type=int, default=32, help="The maximum number of crops used")
+    parser.add_argument("--threshold", type=float, default=0.5, help="The prediction threshold")
+    parser.add_argument("--iou", type=float, default=0.5, help="The IoU needed for two boxes to be counted as the same box")
+    args = parser.parse_args()
+
+    crops = loadCrops(args.crops, args.num_crops, 1024)
+    results = {}
+    for backend in ["torch"] + args.backends:
+        model = loadDetectionModel(args.model_type, backend)
+        detect(model, crops[:1], args.threshold)  # warmup
+        results[backend] = detect(model, crops, args.threshold)
+
+    referenceDetections, referenceLatency = results["torch"]
+    print(f"{len(crops)} crops, yolo-{args.model_type}")
+    print(f"{'backend':<10} {'ms/crop':>9} {'speedup':>8} {'boxes matched':>14} {'mean |conf diff|':>17}")
+    for backend, (detections, latency) in results.items():
+        agreement, confidenceDifference, total = boxAgreement(referenceDetections, detections, args.iou)
+        print(f"{backend:<10} {latency * 1000:>9.1f} {referenceLatency / latency:>7.2f}x {agreement:>8.3f} of {total:<4} {confidenceDifference:>17.4f}")
+
+
+if __name__ == "__main__":
+    main()
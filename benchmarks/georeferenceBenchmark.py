@@ -0,0 +1,60 @@
+"""
+Compares georeferencing many bounding boxes with the array based georeferenceCorners against the per box loop of
+georefereceJGW and BNGtoLatLong it replaced, reporting the boxes per second of each and the largest difference
+between their coordinates:
+
+    python benchmarks/georeferenceBenchmark.py --num-boxes 10000
+"""
+import argparse
+import time
+import os
+import sys
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from georeference.georeference import georeferenceCorners, georefereceJGW, BNGtoLatLong, jgwGeotransform, jgwEPSG
+
+
+def perBoxLoop(pixelCorners, pixelSizeX, pixelSizeY, topLeftXGeo, topLeftYGeo):
+    """Georeferences each box on its own, as the prediction loop used to"""
+    latLongs = []
+    for box in pixelCorners:
+        (x1, y1), (x2, y2), (x3, y3), (x4, y4) = box.tolist()
+        listOfPoints = georefereceJGW(x1,y1,x2,y2,x3,y3,x4,y4,pixelSizeX,pixelSizeY,topLeftXGeo,topLeftYGeo)
+        latLongs.append(BNGtoLatLong(listOfPoints))
+    return np.asarray(latLongs)
+
+
+def timeIt(function, repeats):
+    """Returns the result of function and the best time of repeats calls"""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark array based georeferencing against the per box loop")
+    parser.add_argument("--num-boxes", type=int, default=10000, help="The number of boxes georeferenced")
+    parser.add_argument("--repeats", type=int, default=3, help="The number of timed runs, the best is reported")
+    args = parser.parse_args()
+
+    # Boxes inside a 1024px crop of a 25cm BNG sheet
+    rng = np.random.default_rng(0)
+    pixelCorners = rng.uniform(0, 1024, (args.num_boxes, 4, 2))
+    pixelSizeX, pixelSizeY, topLeftXGeo, topLeftYGeo = 0.25, -0.25, 530000.0, 180000.0
+
+    loopResult, loopTime = timeIt(lambda: perBoxLoop(pixelCorners, pixelSizeX, pixelSizeY, topLeftXGeo, topLeftYGeo), args.repeats)
+    geotransform = jgwGeotransform(pixelSizeX, pixelSizeY, topLeftXGeo, topLeftYGeo)
+    arrayResult, arrayTime = timeIt(lambda: georeferenceCorners(pixelCorners, geotransform, jgwEPSG), args.repeats)
+
+    print(f"{'method':<12}{'boxes/s':>14}{'speedup':>10}")
+    print(f"{'per box':<12}{args.num_boxes / loopTime:>14.0f}{1.0:>10.2f}")
+    print(f"{'array':<12}{args.num_boxes / arrayTime:>14.0f}{loopTime / arrayTime:>10.2f}")
+    print(f"Largest coordinate difference: {np.abs(loopResult - arrayResult).max():.3g} degrees")
+
+
+if __name__ == "__main__":
+    main()
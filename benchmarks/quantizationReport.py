@@ -0,0 +1,74 @@
+"""
+Compares the fp32 classifier with its INT8 variants on the CrosswalkDataset, reporting the recall at the
+production classification threshold next to the tiles per second of each model, so that any loss of recall
+from quantization is measured before it is used. Run from the root of the repository, after calibrating the
+static model with classificationScreening/quantize.py:
+
+    python benchmarks/quantizationReport.py --data classificationScreening/classification_data --threshold 0.35
+"""
+import argparse
+import time
+import os
+import sys
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from classificationScreening.utils import classUtils
+from classificationScreening.classify import data_path
+from classificationScreening.engine import ClassifierEngine
+
+
+def evaluate(engine, loader, threshold):
+    """Classifies the whole dataset, and returns the recall, precision and tiles per second of the engine"""
+    truePositives, falsePositives, falseNegatives, tiles = 0, 0, 0, 0
+    inferenceTime = 0
+    for images, labels in loader:
+        # The dataset gives the tiles as floats in the range [0, 1], which are whole multiples of 1 / 255
+        images = (images * 255).round().to(torch.uint8)
+        start = time.perf_counter()
+        probs = engine.infer(images)
+        inferenceTime += time.perf_counter() - start
+
+        predictions = probs[:, 0] > threshold
+        actual = labels[:, 0].numpy() == 1
+        truePositives += int(np.sum(predictions & actual))
+        falsePositives += int(np.sum(predictions & ~actual))
+        falseNegatives += int(np.sum(~predictions & actual))
+        tiles += len(images)
+
+    recall = truePositives / (truePositives + falseNegatives) if truePositives + falseNegatives else float("nan")
+    precision = truePositives / (truePositives + falsePositives) if truePositives + falsePositives else float("nan")
+    return recall, precision, tiles / inferenceTime
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the accuracy and speed of the quantized classifiers")
+    parser.add_argument("--data", default=data_path, help="The directory of the CrosswalkDataset")
+    parser.add_argument("--threshold", type=float, default=0.35, help="The classification threshold used in production")
+    parser.add_argument("--batch-size", type=int, default=32, help="The number of tiles classified at once")
+    parser.add_argument("--threads", type=int, default=None, help="The number of intra-op threads")
+    args = parser.parse_args()
+
+    dataset = classUtils.CrosswalkDataset(args.data)
+    loader = DataLoader(dataset, batch_size=args.batch_size, shuffle=False)
+
+    results = {}
+    for quantization in (None, "dynamic", "static"):
+        try:
+            engine = ClassifierEngine(quantization=quantization, threads=args.threads, warmup_batch_size=args.batch_size)
+        except FileNotFoundError as e:
+            print(f"Skipping {quantization}: {e}")
+            continue
+        results[quantization or "fp32"] = evaluate(engine, loader, args.threshold)
+
+    print(f"{len(dataset)} tiles, threshold {args.threshold}")
+    print(f"{'model':<10} {'recall':>8} {'precision':>10} {'tiles/s':>10} {'recall drop':>12} {'speedup':>8}")
+    baselineRecall, _, baselineSpeed = results["fp32"]
+    for name, (recall, precision, speed) in results.items():
+        print(f"{name:<10} {recall:>8.4f} {precision:>10.4f} {speed:>10.1f} {baselineRecall - recall:>12.4f} {speed / baselineSpeed:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
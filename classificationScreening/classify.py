@@ -3,7 +3,6 @@ import os
 import torch
 import torchvision
 import torchvision.models as models
-import matplotlib.pyplot as plt
 import numpy as np
 import random
 
@@ -11,6 +10,7 @@ import warnings
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 from classificationScreening.utils import classUtils
+from models import registry
 
 # Torchvision's models utils has a depreciation warning for the pretrained parameter in its instantiation but we don't use that
 warnings.filterwarnings(
@@ -20,24 +20,37 @@ warnings.filterwarnings(
 )
 
 mobileNet_path = "models/mn3_vs55.pth"
+quantized_mobileNet_path = "models/mn3_vs55_int8.pt"
 data_path = "classificationScreening/classification_data"
 
-classify = None
-transform = None
+transform = classUtils.vgg_transform
 
 
-def load_mobileNet_classifier(state_dict_path):
+def load_mobileNet_classifier(state_dict_path, quantization=None, quantized_path=quantized_mobileNet_path):
     """
     Initialises the weights of the Mobile Net v3 model architecture to the pre-trained weights
     stored in the model state dictionairy in the 'models' directory
     
     Args:
         state_dict_path (string): The path to the state dictionairy relative to the function call
+        quantization (string): None for the fp32 model, 'dynamic' to quantize the linear layers to INT8 when loading,
+            or 'static' to load the fully INT8 model produced by classificationScreening/quantize.py
+        quantized_path (string): The path to the statically quantized model, only used when quantization is 'static'
     
     Returns:
         model (MobileNetV3 object): An initialised mobilenet v3 model with the saved weights,
           in evaluation mode so the weights will not be changed
     """
+    if quantization not in (None, "dynamic", "static"):
+        raise ValueError(f"Unknown quantization {quantization}, expected None, 'dynamic' or 'static'")
+    if quantization == "static":
+        # Quantized kernels only run on the CPU
+        if not os.path.exists(quantized_path):
+            raise FileNotFoundError(f"{quantized_path} does not exist, run classificationScreening/quantize.py to calibrate it first")
+        model = torch.jit.load(quantized_path, map_location="cpu")
+        model.eval()
+        return model
+
     model = models.mobilenet_v3_small()
     model.classifier[3] = torch.nn.Linear(model.classifier[3].in_features, 2)
     device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
@@ -45,12 +58,24 @@ def load_mobileNet_classifier(state_dict_path):
     model.load_state_dict(state_dict)
 
     model.eval()
+    if quantization == "dynamic":
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
     return model
 
-classify = load_mobileNet_classifier(mobileNet_path)
-transform = classUtils.vgg_transform
+# The weights are only loaded the first time the classifier is used, so importing this module stays cheap
+registry.registerModel("mobileNet", lambda: load_mobileNet_classifier(mobileNet_path), weightsPath=mobileNet_path)
+
+def get_classifier():
+    """
+    Returns the system default classification model, loading it from the 'models' directory the first
+    time it is requested.
+
+    Returns:
+        model (MobileNetV3 object): The initialised mobilenet v3 model in evaluation mode
+    """
+    return registry.getModel("mobileNet")
 
-def infer(image, infer_model=classify, infer_transform=transform):
+def infer(image, infer_model=None, infer_transform=transform):
     """
     Applies a binary classification model to an input image array, generalising the inference
     process to be model-independent. 
@@ -58,7 +83,8 @@ def infer(image, infer_model=classify, infer_transform=transform):
     Args:
         image (numpy array): The input image(s) in the form of a numpy array of form
             [channels: [width: [height:]]] or [batch: [channels: [width: [height:]]]]
-        infer_model (pytorch model object): Any binary classification pytorch model object with a forward method
+        infer_model (pytorch model object): Any binary classification pytorch model object with a forward method,
+            the system default model is used if it is not given
         infer_transform (pytorch transform object): Any pre-processing required for the model to run
     
     Returns:
@@ -66,6 +92,8 @@ def infer(image, infer_model=classify, infer_transform=transform):
             where each member of the batch sums to 1.
 
     """
+    if infer_model is None:
+        infer_model = get_classifier()
     # If infer model and transform have not been initialised
     if infer_model is None or infer_transform is None:
         raise TypeError("Error: The inference classes have not been initialised properly.")
@@ -77,7 +105,9 @@ def infer(image, infer_model=classify, infer_transform=transform):
         image = image.unsqueeze(0)
 
     
-    pred = torch.sigmoid(infer_model(image))
+    # Inference mode skips the autograd bookkeeping, which is never needed here
+    with torch.inference_mode():
+        pred = torch.sigmoid(infer_model(image))
     probs = pred.detach().numpy()
 
     return probs
@@ -99,6 +129,23 @@ def PIL_infer(image, threshold=0.35):
     classification = prediction[0][0] > threshold
     return classification
 
+def array_batch_infer(images, threshold=0.35):
+    """
+    A wrapper function for the infer function that classifies a batch of uint8 image tiles which are already
+    stored as a single numpy array, without creating a PIL image or tensor per tile. Uses the system default model.
+
+    Args:
+        images (numpy array): The uint8 images in the form [batch: [channels: [height: [width:]]]]
+        threshold (float): The confidence threshold for positive classification
+
+    Returns:
+        classifications (boolean array): Whether each image is likely to be the target object, in the same order as images.
+    """
+    tensor_ims = torch.from_numpy(np.ascontiguousarray(images)).float() / 255
+    prediction = infer(tensor_ims)
+    classifications = prediction[:, 0] > threshold
+    return classifications
+
 # Expects a numpy image
 def infer_and_display(image, threshold, actual_label, onlyWrong=False):
     """
@@ -115,6 +162,8 @@ def infer_and_display(image, threshold, actual_label, onlyWrong=False):
         prediction (boolean array): The set of classifications made by the model, only returned if they were all correct
         probability (tensor array): The set of probabilities assigned to each class by the binary classification model
     """
+    import matplotlib.pyplot as plt
+
     probability = infer(image)
     prediction = probability > threshold
     is_correct = (actual_label[0] == 1) == prediction
@@ -0,0 +1,208 @@
+import sys
+import os
+import torch
+import torchvision
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from classificationScreening.classify import load_mobileNet_classifier, mobileNet_path, quantized_mobileNet_path
+from models import registry
+
+
+class NormalisedClassifier(torch.nn.Module):
+    """
+    Wraps a binary classification model so that it takes uint8 images directly, with the conversion to the [0, 1]
+    range and the sigmoid both part of the model. This lets tracing and compilation fuse them with the first and
+    last layers instead of running them as separate tensor operations.
+    """
+    def __init__(self, model):
+        """
+        Args:
+            model (pytorch model object): Any binary classification pytorch model object with a forward method
+        """
+        super().__init__()
+        self.model = model
+
+    def forward(self, images):
+        """
+        Args:
+            images (tensor): uint8 images of the form [batch: [channels: [height: [width:]]]]
+
+        Returns:
+            probs (tensor): The binary classification confidences in the range [0, 1]
+        """
+        return torch.sigmoid(self.model(images.float() / 255))
+
+
+class ClassifierEngine:
+    """
+    A CPU inference engine for the classification model, which can be used in place of the infer, PIL_infer and
+    array_batch_infer functions of the classify module. The model always runs in inference mode, takes uint8
+    input with the normalisation fused into it, and can optionally be traced or compiled, use a set number of
+    intra-op threads, the channels last memory layout and a warmup pass.
+    """
+    def __init__(self, state_dict_path=mobileNet_path, model=None, quantization=None, compile_mode="trace", threads=None, channels_last=True, warmup=True, tile_size=256, warmup_batch_size=32, cache_path=None):
+        """
+        Args:
+            state_dict_path (string): The path to the state dictionairy, only used if model is not given
+            model (pytorch model object): An already initialised binary classification model to wrap
+            quantization (string): The quantization passed to load_mobileNet_classifier, only used if model is not given
+            compile_mode (string): None to run the model eagerly, 'trace' to trace and freeze it with TorchScript,
+                or 'compile' to use torch.compile
+            threads (int): The number of intra-op threads used by torch, the torch default is kept if None.
+                This is a process wide setting.
+            channels_last (boolean): Whether to store the weights and inputs in the channels last memory layout
+            warmup (boolean): Whether to run a batch through the model straight away, so that the first real call is not slowed down
+            tile_size (int): The size of each side of the images used for tracing and warming up
+            warmup_batch_size (int): The batch size used for tracing and warming up
+            cache_path (string): Where the traced model is saved, so that later engines load it instead of tracing
+                the model again. Only used when compile_mode is 'trace' and model is not given. The cached model is
+                traced again if the weights are newer than it.
+        """
+        if compile_mode not in (None, "trace", "compile"):
+            raise ValueError(f"Unknown compile mode {compile_mode}, expected None, 'trace' or 'compile'")
+        if threads is not None:
+            torch.set_num_threads(threads)
+        self.channels_last = channels_last
+        self.memory_format = torch.channels_last if channels_last else torch.contiguous_format
+        self.compile_mode = compile_mode
+        example = self._prepare(torch.zeros((warmup_batch_size, 3, tile_size, tile_size), dtype=torch.uint8))
+
+        weights_path = quantized_mobileNet_path if quantization == "static" else state_dict_path
+        use_cache = cache_path is not None and model is None and compile_mode == "trace"
+        if use_cache and os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(weights_path):
+            try:
+                self.model = torch.jit.load(cache_path, map_location="cpu")
+                if warmup:
+                    self.infer(example)
+                return
+            except RuntimeError:
+                # Saved by a different version of torch, so it is traced again below
+                pass
+
+        if model is None:
+            model = load_mobileNet_classifier(state_dict_path, quantization=quantization)
+        normalised = NormalisedClassifier(model).eval().to(memory_format=self.memory_format)
+
+        with torch.no_grad():
+            if compile_mode == "trace":
+                normalised = torch.jit.freeze(torch.jit.trace(normalised, example))
+            elif compile_mode == "compile":
+                normalised = torch.compile(normalised)
+        self.model = normalised
+
+        if use_cache:
+            # Saved under a temporary name first, so that other processes tracing at the same time never load a partly written model
+            temporary_path = f"{cache_path}.{os.getpid()}.tmp"
+            try:
+                torch.jit.save(self.model, temporary_path)
+                os.replace(temporary_path, cache_path)
+            except OSError as e:
+                print(f"Could not save the traced classifier to {cache_path}: {e}")
+                if os.path.exists(temporary_path):
+                    os.remove(temporary_path)
+
+        if warmup:
+            self.infer(example)
+
+    def _prepare(self, images):
+        """
+        Turns the input into a batched uint8 tensor in the memory layout the model expects.
+
+        Args:
+            images (numpy array or tensor): The uint8 image(s) of the form [channels: [height: [width:]]] or
+                [batch: [channels: [height: [width:]]]]
+
+        Returns:
+            images (tensor): The batched uint8 images
+
+        Raises:
+            ValueError: If the images are not uint8, since the model scales them from the [0, 255] range itself.
+        """
+        if not torch.is_tensor(images):
+            images = torch.from_numpy(np.ascontiguousarray(images))
+        if images.dtype != torch.uint8:
+            raise ValueError(f"Expected uint8 images, but they are {images.dtype}")
+        if images.dim() <= 3:
+            images = images.unsqueeze(0)
+        return images.contiguous(memory_format=self.memory_format)
+
+    def infer(self, images):
+        """
+        Applies the classification model to a batch of images, in the same way as classify.infer.
+
+        Args:
+            images (numpy array or tensor): The uint8 image(s) of the form [channels: [height: [width:]]] or
+                [batch: [channels: [height: [width:]]]]
+
+        Returns:
+            probs (numpy array): A list of binary classifaction confidences in the range [0, 1]
+        """
+        with torch.inference_mode():
+            probs = self.model(self._prepare(images))
+        return probs.numpy()
+
+    __call__ = infer
+
+    def PIL_infer(self, image, threshold=0.35):
+        """
+        Classifies a single PIL image, in the same way as classify.PIL_infer.
+
+        Args:
+            image (PIL image): The image that will be classified in PIL format
+            threshold (float): The confidence threshold for positive classification
+
+        Returns:
+            classification (boolean): Whether the image is likely to be the target object.
+        """
+        prediction = self.infer(torchvision.transforms.functional.pil_to_tensor(image))
+        return prediction[0][0] > threshold
+
+    def array_batch_infer(self, images, threshold=0.35):
+        """
+        Classifies a batch of uint8 image tiles stored as a single numpy array, in the same way as classify.array_batch_infer.
+
+        Args:
+            images (numpy array): The uint8 images in the form [batch: [channels: [height: [width:]]]]
+            threshold (float): The confidence threshold for positive classification
+
+        Returns:
+            classifications (boolean array): Whether each image is likely to be the target object, in the same order as images.
+        """
+        prediction = self.infer(images)
+        return prediction[:, 0] > threshold
+
+
+def traced_cache_path(quantization=None, channels_last=True):
+    """
+    Gives the path the traced engine is saved to, which depends on everything that changes the traced graph.
+
+    Args:
+        quantization (string): None for the fp32 model, or 'dynamic' or 'static' for an INT8 model
+        channels_last (boolean): Whether the engine uses the channels last memory layout
+
+    Returns:
+        path (string): The path of the traced engine, next to the weights in the 'models' directory
+    """
+    root, _ = os.path.splitext(mobileNet_path)
+    suffix = f"-{quantization}" if quantization else ""
+    layout = "-cl" if channels_last else ""
+    return f"{root}{suffix}{layout}.traced.pt"
+
+registry.registerModel("mobileNetEngine", lambda: ClassifierEngine(cache_path=traced_cache_path()), weightsPath=mobileNet_path)
+registry.registerModel("mobileNetEngine-dynamic", lambda: ClassifierEngine(quantization="dynamic", cache_path=traced_cache_path("dynamic")), weightsPath=mobileNet_path)
+registry.registerModel("mobileNetEngine-static", lambda: ClassifierEngine(quantization="static", cache_path=traced_cache_path("static")), weightsPath=quantized_mobileNet_path)
+
+def get_classifier_engine(quantization=None):
+    """
+    Returns the system default classification engine, building it the first time it is requested.
+
+    Args:
+        quantization (string): None for the fp32 model, or 'dynamic' or 'static' for an INT8 model
+
+    Returns:
+        engine (ClassifierEngine): The traced engine wrapping the default mobilenet v3 model
+    """
+    if quantization is None:
+        return registry.getModel("mobileNetEngine")
+    return registry.getModel(f"mobileNetEngine-{quantization}")
@@ -0,0 +1,73 @@
+import sys
+import os
+import argparse
+import torch
+from torch.utils.data import DataLoader, Subset
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from classificationScreening.utils import classUtils
+from classificationScreening.classify import load_mobileNet_classifier, mobileNet_path, quantized_mobileNet_path, data_path
+
+
+def calibrate_static_quantization(model, dataset, num_samples=512, batch_size=32, backend="x86"):
+    """
+    Statically quantizes a classification model to INT8 with FX graph mode quantization, using images from the
+    dataset to calibrate the range of every activation. The images should be in the same [0, 1] range as the
+    images the model sees during inference.
+
+    Args:
+        model (pytorch model object): The fp32 classification model, in evaluation mode
+        dataset (CrosswalkDataset): The dataset the calibration images are drawn from
+        num_samples (int): The number of images used for calibration
+        batch_size (int): The number of images passed through the model at once during calibration
+        backend (string): The quantized backend the model will run on, 'x86' for servers or 'qnnpack' for ARM
+
+    Returns:
+        quantized_model (pytorch model object): The INT8 model, which only runs on the CPU
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+    torch.backends.quantized.engine = backend
+    samples = Subset(dataset, range(min(num_samples, len(dataset))))
+    loader = DataLoader(samples, batch_size=batch_size, shuffle=False)
+    example_images, _ = next(iter(loader))
+
+    prepared = prepare_fx(model.cpu().eval(), get_default_qconfig_mapping(backend), (example_images,))
+    with torch.no_grad():
+        for images, _ in loader:
+            prepared(images)
+    return convert_fx(prepared)
+
+
+def save_quantized_classifier(quantized_model, save_path=quantized_mobileNet_path, tile_size=256):
+    """
+    Traces the quantized model with TorchScript and saves it, so that load_mobileNet_classifier can load it
+    without having to calibrate it again.
+
+    Args:
+        quantized_model (pytorch model object): The INT8 model returned by calibrate_static_quantization
+        save_path (string): Where the traced model is saved
+        tile_size (int): The size of each side of the images used for tracing
+
+    Returns:
+        None
+    """
+    with torch.no_grad():
+        traced = torch.jit.trace(quantized_model, torch.rand(1, 3, tile_size, tile_size))
+    torch.jit.save(traced, save_path)
+    print(f"Quantized classifier saved to {save_path}")
+
+
+# Only to be run if you run this file directly, else import and recall according to your requirements.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate and save the statically quantized INT8 classifier")
+    parser.add_argument("--data", default=data_path, help="The directory of the CrosswalkDataset used for calibration")
+    parser.add_argument("--samples", type=int, default=512, help="The number of images used for calibration")
+    parser.add_argument("--backend", default="x86", help="The quantized backend, 'x86' or 'qnnpack'")
+    parser.add_argument("--output", default=quantized_mobileNet_path, help="Where the quantized model is saved")
+    args = parser.parse_args()
+
+    dataset = classUtils.CrosswalkDataset(args.data)
+    quantized = calibrate_static_quantization(load_mobileNet_classifier(mobileNet_path), dataset, num_samples=args.samples, backend=args.backend)
+    save_quantized_classifier(quantized, args.output)
@@ -1,11 +1,203 @@
+from collections import OrderedDict
+import threading
+
+import numpy as np
 from osgeo import osr
 
+# The number of coordinate transformations each thread keeps before the least recently used one is dropped
+transformerCacheSize = 16
+
+# OSR objects cannot safely be used by several threads at once, so every thread keeps its own transformations
+transformerCaches = threading.local()
+
+# The EPSG code of British National Grid, which every JGW image is georeferenced in
+jgwEPSG = 27700
+
+
+def transformerKey(sourceCRS, targetEPSG=4326):
+    """
+    Makes the key a coordinate transformation is cached under. WKT strings are used as they are, Python caches the
+    hash of a string, so a projection read once from an image is only hashed the first time it is looked up.
+
+    Args:
+        sourceCRS (int or str): The EPSG code or the WKT of the source coordinate reference system.
+        targetEPSG (int): The EPSG code of the target coordinate reference system.
+
+    Returns:
+        tuple: The key of the transformation.
+    """
+    if isinstance(sourceCRS, int):
+        return ("EPSG", sourceCRS, targetEPSG)
+    return ("WKT", sourceCRS, targetEPSG)
+
+
+def getTransformer(sourceCRS, targetEPSG=4326):
+    """
+    Returns a coordinate transformation from the source CRS to the target CRS, only creating it the first time it
+    is needed by the calling thread. Each thread keeps up to transformerCacheSize transformations, dropping the
+    least recently used one after that.
+
+    Args:
+        sourceCRS (int or str): The EPSG code or the WKT of the source coordinate reference system.
+        targetEPSG (int): The EPSG code of the target coordinate reference system, WGS84 by default.
+
+    Returns:
+        transform (osr.CoordinateTransformation): The transformation from the source CRS to the target CRS.
+    """
+    cache = getattr(transformerCaches, "cache", None)
+    if cache is None:
+        cache = transformerCaches.cache = OrderedDict()
+
+    key = transformerKey(sourceCRS, targetEPSG)
+    transform = cache.get(key)
+    if transform is not None:
+        cache.move_to_end(key)
+        return transform
+
+    source = osr.SpatialReference()
+    if isinstance(sourceCRS, int):
+        source.ImportFromEPSG(sourceCRS)
+    else:
+        source.ImportFromWkt(sourceCRS)
+    target = osr.SpatialReference()
+    target.ImportFromEPSG(targetEPSG)
+
+    transform = osr.CoordinateTransformation(source, target)
+    cache[key] = transform
+    if len(cache) > transformerCacheSize:
+        cache.popitem(last=False)
+    return transform
+
+
+def clearTransformerCache():
+    """Drops every coordinate transformation cached by the calling thread"""
+    transformerCaches.cache = OrderedDict()
+
+
+def jgwGeotransform(pixelSizeX, pixelSizeY, topLeftXGeo, topLeftYGeo):
+    """
+    Turns the georeferencing data of a JGW world file into a GDAL style geotransform, so that JGW and TIF images
+    can be georeferenced in the same way.
+
+    Args:
+        pixelSizeX (float): The real-world width of each pixel
+        pixelSizeY (float): The real-world height of each pixel
+        topLeftXGeo (float): The real-world x-coordinate of the top left pixel in the image
+        topLeftYGeo (float): The real-world y-coordinate of the top left pixel in the image
+
+    Returns:
+        tuple: The geotransform (topLeftX, pixelSizeX, rowRotation, topLeftY, columnRotation, pixelSizeY).
+    """
+    return (topLeftXGeo, pixelSizeX, 0.0, topLeftYGeo, 0.0, pixelSizeY)
+
+
+def readJGWGeotransform(jgwPath):
+    """
+    Reads a JGW world file into a GDAL style geotransform, including its rotation terms. As in cropImageJGW, the
+    coordinates on its last two lines are used as the top left corner of the image.
+
+    Args:
+        jgwPath (str): The path to the .jgw file.
+
+    Returns:
+        tuple: The geotransform (topLeftX, pixelSizeX, rowRotation, topLeftY, columnRotation, pixelSizeY).
+    """
+    with open(jgwPath) as jgwFile:
+        lines = [float(line.strip()) for line in jgwFile.readlines()[:6]]
+    return (lines[4], lines[0], lines[2], lines[5], lines[1], lines[3])
+
+
+def pixelToGeo(pixelCorners, geotransform):
+    """
+    Converts the pixel corners of many bounding boxes to real-world coordinates in the image's CRS at once, by
+    applying the affine geotransform as a single matrix multiplication.
+
+    Args:
+        pixelCorners (numpy array): The pixel corners of the boxes, of shape (N, 4, 2) with (x, y) in the last axis.
+        geotransform (tuple): The GDAL style geotransform of the image.
+
+    Returns:
+        numpy array: The real-world corners of the boxes, of shape (N, 4, 2).
+    """
+    pixelCorners = np.asarray(pixelCorners, dtype=np.float64)
+    affine = np.array([[geotransform[1], geotransform[2]],
+                       [geotransform[4], geotransform[5]]], dtype=np.float64)
+    origin = np.array([geotransform[0], geotransform[3]], dtype=np.float64)
+    return pixelCorners @ affine.T + origin
+
+
+def geoToLatLong(geoCorners, sourceCRS):
+    """
+    Converts real-world corners to latitude and longitude with a single batch transformation.
+
+    Args:
+        geoCorners (numpy array): The real-world corners of the boxes, of shape (N, 4, 2).
+        sourceCRS (int or str): The EPSG code or the WKT of the CRS the corners are in.
+
+    Returns:
+        numpy array: The (latitude, longitude) corners of the boxes, of shape (N, 4, 2).
+    """
+    geoCorners = np.asarray(geoCorners, dtype=np.float64)
+    if geoCorners.size == 0:
+        return np.empty(geoCorners.shape, dtype=np.float64)
+    transform = getTransformer(sourceCRS)
+    points = transform.TransformPoints(geoCorners.reshape(-1, 2).tolist())
+    return np.asarray(points, dtype=np.float64)[:, :2].reshape(geoCorners.shape)
+
+
+def georeferenceCorners(pixelCorners, geotransform, sourceCRS):
+    """
+    Georeferences the pixel corners of many bounding boxes in one call, converting them to latitude and longitude.
+
+    Args:
+        pixelCorners (numpy array): The pixel corners of the boxes, of shape (N, 4, 2) with (x, y) in the last axis.
+        geotransform (tuple): The GDAL style geotransform of the image.
+        sourceCRS (int or str): The EPSG code or the WKT of the image's CRS.
+
+    Returns:
+        numpy array: The (latitude, longitude) corners of the boxes, of shape (N, 4, 2).
+    """
+    return geoToLatLong(pixelToGeo(pixelCorners, geotransform), sourceCRS)
+
+
+def detectionsToLatLong(detections):
+    """
+    Converts the corners of every image in a DetectionSet that were kept in the image's CRS to latitude and longitude,
+    with one batch transformation per image. The corners are converted in place.
+
+    Args:
+        detections (DetectionSet): The detections, whose imageCRS gives the CRS of each image's corners.
+    """
+    for imageId, crs in enumerate(detections.imageCRS):
+        if crs is None:
+            continue
+        corners, _, _, _ = detections.imageView(imageId)
+        if len(corners):
+            corners[...] = geoToLatLong(corners, crs)
+        detections.imageCRS[imageId] = None
+
+
+def cornersToLists(corners):
+    """
+    Turns an (N, 4, 2) array of corners into the list of boxes used in the detection dictionaries, where each box
+    is a list of four coordinate tuples.
+
+    Args:
+        corners (numpy array): The corners of the boxes, of shape (N, 4, 2).
+
+    Returns:
+        list: A list of boxes, each a list of four (float, float) tuples.
+    """
+    return [[tuple(corner) for corner in box] for box in np.asarray(corners).tolist()]
+
+
 def georefereceJGW(x1,y1,x2,y2,x3,y3,x4,y4,pixelSizeX,pixelSizeY,topLeftXGeo,topLeftYGeo):
     """
     This function will receive all of the x y points from a bounding box, their respective pixel sizes, and the
     georeferencing data of the image's top left corner.
 
-    Using this information, it will calculate the coordinates of the four corners of the bounding box.
+    Using this information, it will calculate the coordinates of the four corners of the bounding box. It is a wrapper
+    around pixelToGeo for a single box.
 
     Args:
         x(i) (int): The x pixel location of the ith bounding box corner in the image.
@@ -18,15 +210,9 @@ def georefereceJGW(x1,y1,x2,y2,x3,y3,x4,y4,pixelSizeX,pixelSizeY,topLeftXGeo,top
     Returns:
         list: It is a list of coordinates for each corner of the box.
     """
-    x1 = topLeftXGeo + pixelSizeX * x1
-    y1 = topLeftYGeo + pixelSizeY * y1
-    x2 = topLeftXGeo + pixelSizeX * x2
-    y2 = topLeftYGeo + pixelSizeY * y2
-    x3 = topLeftXGeo + pixelSizeX * x3
-    y3 = topLeftYGeo + pixelSizeY * y3
-    x4 = topLeftXGeo + pixelSizeX * x4
-    y4 = topLeftYGeo + pixelSizeY * y4
-    return([(x1,y1),(x2,y2),(x3,y3),(x4,y4)])
+    pixelCorners = [[(x1, y1), (x2, y2), (x3, y3), (x4, y4)]]
+    geoCorners = pixelToGeo(pixelCorners, jgwGeotransform(pixelSizeX, pixelSizeY, topLeftXGeo, topLeftYGeo))
+    return cornersToLists(geoCorners)[0]
 
 
 def BNGtoLatLong(listOfPoints):
@@ -40,70 +226,37 @@ def BNGtoLatLong(listOfPoints):
     Returns:
         latLongList (list): It is a list of latitude and longitudes, representing the corners of a bounding box.
     """
-    bng = osr.SpatialReference()
-    bng.ImportFromEPSG(27700)
-    wgs84 = osr.SpatialReference()
-    wgs84.ImportFromEPSG(4326)
+    if not listOfPoints:
+        return []
+    latLongs = geoToLatLong(np.asarray(listOfPoints, dtype=np.float64)[np.newaxis], jgwEPSG)
+    return cornersToLists(latLongs)[0]
 
-    transform = osr.CoordinateTransformation(bng, wgs84)
-    latLongList = []
-    for xBNG, yBNG in listOfPoints:
-        lat, long, _ = transform.TransformPoint(xBNG, yBNG)
-        latLongList.append((lat, long))
-    return latLongList
 
 
-
-def georeferenceTIF(croppedTifImage, x1,y1,x2,y2,x3,y3,x4,y4):
+def georeferenceTIF(croppedTifImage, x1,y1,x2,y2,x3,y3,x4,y4, geotransform=None, projection=None):
     """
     This function takes a croppedTifImage, and the four corners of a bounding box. It will then use the data stored in the
-    TIF image to find the coordinates of the corners, and it is then converted to latitude and longitude.
+    TIF image to find the coordinates of the corners, and it is then converted to latitude and longitude. It is a wrapper
+    around georeferenceCorners for a single box.
 
     Args:
         croppedTifImage (tif object): It is a tif image which was already cropped and stored in memory.
         x(i) (int): The x pixel location of the ith bounding box corner in the image.
         y(i) (int): The y pixel location of the ith bounding box corner in the image.
+        geotransform (tuple): The geotransform of croppedTifImage, read from the image if it is not given.
+            Passing it avoids reading it again for every box in the same image.
+        projection (str): The WKT projection of croppedTifImage, read from the image if it is not given.
     
     Returns:
         outputList (list): It is a list of coordinates for each corner of the box.
     """
-    geotransform = croppedTifImage.GetGeoTransform()
+    if geotransform is None:
+        geotransform = croppedTifImage.GetGeoTransform()
     if not geotransform:
         raise ValueError(f"No geotransform found in the file: {croppedTifImage}")
-    projection = croppedTifImage.GetProjection()
-
-    # Convert pixel coordinates to real-world coordinates in the file's CRS
-    origin_x = geotransform[0]
-    origin_y = geotransform[3]
-    pixel_width = geotransform[1]
-    pixel_height = geotransform[5]
-
-    x1 = origin_x + x1 * pixel_width + y1 * geotransform[2]
-    y1 = origin_y + x1 * geotransform[4] + y1 * pixel_height
-    x2 = origin_x + x2 * pixel_width + y2 * geotransform[2]
-    y2 = origin_y + x2 * geotransform[4] + y2 * pixel_height
-    x3 = origin_x + x3 * pixel_width + y3 * geotransform[2]
-    y3 = origin_y + x3 * geotransform[4] + y3 * pixel_height
-    x4 = origin_x + x4 * pixel_width + y4 * geotransform[2]
-    y4 = origin_y + x4 * geotransform[4] + y4 * pixel_height
-
-    # Set up transformation to WGS84 (latitude/longitude)
-    source_crs = osr.SpatialReference()
-    source_crs.ImportFromWkt(projection)
-
-    target_crs = osr.SpatialReference()
-    target_crs.ImportFromEPSG(4326)  # WGS84 EPSG code
-
-    transform = osr.CoordinateTransformation(source_crs, target_crs)
-
-    outputList = []
-    lat1, lon1, _ = transform.TransformPoint(x1, y1)
-    lat2, lon2, _ = transform.TransformPoint(x2, y2)
-    lat3, lon3, _ = transform.TransformPoint(x3, y3)
-    lat4, lon4, _ = transform.TransformPoint(x4, y4)
-    outputList.append((lat1, lon1))
-    outputList.append((lat2, lon2))
-    outputList.append((lat3, lon3))
-    outputList.append((lat4, lon4))
-
-    return outputList
\ No newline at end of file
+    if projection is None:
+        projection = croppedTifImage.GetProjection()
+
+    pixelCorners = [[(x1, y1), (x2, y2), (x3, y3), (x4, y4)]]
+    outputList = cornersToLists(georeferenceCorners(pixelCorners, geotransform, projection))[0]
+    return outputList
@@ -1,135 +1,654 @@
 from PIL import Image
 from osgeo import gdal
 from tqdm import tqdm
+import numpy as np
+import functools
+import heapq
+import math
+import multiprocessing
+from multiprocessing import shared_memory
 import os
 import sys
+import threading
+import torch
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-from imageSegmentation.classificationSegmentation import classificationSegmentation
+from imageSegmentation.classificationSegmentation import classificationSegmentation, coarseClassification, reportCoarseToFine, getFilteringBounds, clampRowCol
+from imageSegmentation.tiling import loadImageArray, cropArray
+from imageSegmentation.rasterWindow import RasterWindow
+from imageSegmentation.regionOfInterest import imageRegionOfInterestMask
+from classificationScreening.engine import get_classifier_engine
 
-def boundBoxSegmentationJGW(classificationThreshold=0.35, extractDir = "run/extract", boundBoxChunkSize=1024, classificationChunkSize=256):
+jgwImageExtensions = ('.png', '.jpg', '.jpeg')
+tifImageExtensions = ('.tif',)
+# How the bounding box images are placed around the chunks of interest, with cropWindows, planWindows or planAdaptiveWindows
+windowPlannings = ("centred", "cover", "adaptive")
+# The sizes of the bounding box images planAdaptiveWindows chooses from
+adaptiveWindowSizes = (512, 768, 1024)
+
+def listInputImages(extractDir, extensions):
     """
-    This function will iterate through all of the .png, .jpg, and .jpeg images from the extract directory.
-    It will then call the classificationSegmentation function and receive all the chunks of interest for each image.
-    From these chunks of interest, it will resegment them into boxes with size boundBoxChunkSize, with the original
-    chunks in the center when possible.
+    Lists the input images in the extract directory, in the order they are segmented.
+
+    Args:
+        extractDir (str): The path to the directory where all of the input images are.
+        extensions (tuple): The file extensions of the input images, jgwImageExtensions or tifImageExtensions.
 
-    After resegmenting the image, it will calculate the new georeferencing data, including the new topLeftXGeo, 
-    and topLeftYGeo. It will then save this new segmented image, and all georeferencing data needed for this chunk in
-    imageAndDatas. Once all of the image has been processed, imageAndDatas is returned.
+    Returns:
+        list: The file names of the input images.
+    """
+    return [inputFileName for inputFileName in os.listdir(extractDir) if inputFileName.endswith(extensions)]
+
+def cropWindows(chunksOfInterest, width, height, boundBoxChunkSize=1024, classificationChunkSize=256):
+    """
+    Places a bounding box image around each chunk of interest, with the chunk in the center when possible. Windows
+    that would go past the right or bottom edge of the image are moved back inside it, and windows that end up in
+    the same place as an earlier one are removed.
+
+    Args:
+        chunksOfInterest (list): The row and column of each chunk of interest.
+        width (int): The width of the original image.
+        height (int): The height of the original image.
+        boundBoxChunkSize (int): The size of each side of the bounding box image.
+        classificationChunkSize (int): The size of each side of the classification image.
+
+    Returns:
+        windows (numpy array): The topX, topY, row and column of each bounding box image, with the shape (N, 4), in the order of chunksOfInterest.
+    """
+    chunks = np.asarray(chunksOfInterest, dtype=np.int64).reshape(-1, 2)
+    offset = (boundBoxChunkSize - classificationChunkSize) // 2
+    tops = np.maximum(chunks * classificationChunkSize - offset, 0)
+    topY = np.minimum(tops[:, 0], height - boundBoxChunkSize)
+    topX = np.minimum(tops[:, 1], width - boundBoxChunkSize)
+    # Keeps the first chunk of interest of each window
+    _, firstIndices = np.unique(np.stack([topX, topY], axis=1), axis=0, return_index=True)
+    keep = np.sort(firstIndices)
+    return np.stack([topX[keep], topY[keep], chunks[keep, 0], chunks[keep, 1]], axis=1).astype(np.int32)
+
+def planWindows(chunksOfInterest, width, height, boundBoxChunkSize=1024, classificationChunkSize=256, interiorMargin=None):
+    """
+    Covers the chunks of interest with as few bounding box images as it can, where cropWindows places one around each
+    of them, so a cluster of neighbouring chunks of interest is found in one or a few windows instead of in many that
+    overlap. The windows are placed on the grid of the chunks, and chosen with a greedy set cover, each time taking the
+    window which covers the most chunks of interest that are not covered yet. Every chunk of interest is kept at least
+    interiorMargin pixels inside the window covering it, unless the window was moved back inside the image.
+
+    Args:
+        chunksOfInterest (list): The row and column of each chunk of interest.
+        width (int): The width of the original image.
+        height (int): The height of the original image.
+        boundBoxChunkSize (int): The size of each side of the bounding box image.
+        classificationChunkSize (int): The size of each side of the classification image.
+        interiorMargin (int): The smallest distance in pixels between a chunk of interest and the edge of its window,
+            classificationChunkSize if None. With the margin of a chunk in the center of a window, each window only
+            covers one chunk of interest, which gives the same windows as cropWindows.
+
+    Returns:
+        windows (numpy array): The topX, topY, row and column of each bounding box image, with the shape (N, 4). The
+            row and column are those of the first chunk of interest the window covers, so that each window has its own,
+            and windows that overlap are close enough in row and column for removeDuplicateBoxesRC to compare them.
+    """
+    centredMargin = (boundBoxChunkSize - classificationChunkSize) // 2
+    margin = classificationChunkSize if interiorMargin is None else interiorMargin
+    margin = max(0, min(margin, centredMargin))
+    # The number of chunks along each side of the interior of a window, which is centred in the window
+    span = max(1, (boundBoxChunkSize - 2 * margin) // classificationChunkSize)
+    offset = (boundBoxChunkSize - span * classificationChunkSize) // 2
+
+    planned = coverChunks(chunksOfInterest, span)
+    windows = np.array([(anchorCol, anchorRow, row, col) for row, col, (anchorRow, anchorCol), _ in planned], dtype=np.int64).reshape(-1, 4)
+    tops = np.maximum(windows[:, :2] * classificationChunkSize - offset, 0)
+    topX = np.minimum(tops[:, 0], width - boundBoxChunkSize)
+    topY = np.minimum(tops[:, 1], height - boundBoxChunkSize)
+    # Windows moved to the same place at the edge of the image are kept once
+    _, firstIndices = np.unique(np.stack([topX, topY], axis=1), axis=0, return_index=True)
+    keep = np.sort(firstIndices)
+    return np.stack([topX[keep], topY[keep], windows[keep, 2], windows[keep, 3]], axis=1).astype(np.int32)
+
+def planAdaptiveWindows(chunksOfInterest, width, height, boundBoxChunkSize=1024, classificationChunkSize=256, contextMargin=None, windowSizes=adaptiveWindowSizes):
+    """
+    Covers the chunks of interest like planWindows, then shrinks each window to the smallest of windowSizes which
+    holds the chunks of interest it covers with contextMargin pixels around them, centred on them. An isolated chunk
+    of interest then only needs a small window, where planWindows and cropWindows give it a full boundBoxChunkSize one,
+    and the detection model runs over far fewer pixels for images with few, scattered chunks of interest.
+
+    Args:
+        chunksOfInterest (list): The row and column of each chunk of interest.
+        width (int): The width of the original image.
+        height (int): The height of the original image.
+        boundBoxChunkSize (int): The size of each side of the largest bounding box image.
+        classificationChunkSize (int): The size of each side of the classification image.
+        contextMargin (int): The smallest distance in pixels between a chunk of interest and the edge of its window,
+            half of classificationChunkSize if None.
+        windowSizes (tuple): The sizes the windows can have, sizes larger than boundBoxChunkSize are not used, and
+            boundBoxChunkSize can always be used.
+
+    Returns:
+        windows (numpy array): The topX, topY, row, column and size of each bounding box image, with the shape (N, 5).
+            The row and column are those of the first chunk of interest the window covers, as in planWindows.
+    """
+    margin = classificationChunkSize // 2 if contextMargin is None else contextMargin
+    margin = max(0, min(margin, (boundBoxChunkSize - classificationChunkSize) // 2))
+    sizes = sorted({size for size in windowSizes if size < boundBoxChunkSize} | {boundBoxChunkSize})
+    span = max(1, (boundBoxChunkSize - 2 * margin) // classificationChunkSize)
+
+    planned = []
+    for row, col, _, covered in coverChunks(chunksOfInterest, span):
+        rows = [coveredRow for coveredRow, _ in covered]
+        cols = [coveredCol for _, coveredCol in covered]
+        extent = max(max(rows) - min(rows), max(cols) - min(cols)) + 1
+        size = next((size for size in sizes if size >= extent * classificationChunkSize + 2 * margin), sizes[-1])
+        # The center of the chunks of interest, in pixels
+        centreX = (min(cols) + max(cols) + 1) * classificationChunkSize // 2
+        centreY = (min(rows) + max(rows) + 1) * classificationChunkSize // 2
+        planned.append((centreX - size // 2, centreY - size // 2, row, col, size))
+
+    windows = np.array(planned, dtype=np.int64).reshape(-1, 5)
+    sizeOfWindows = windows[:, 4]
+    topX = np.minimum(np.maximum(windows[:, 0], 0), width - sizeOfWindows)
+    topY = np.minimum(np.maximum(windows[:, 1], 0), height - sizeOfWindows)
+    # Windows moved to the same place at the edge of the image are kept once
+    _, firstIndices = np.unique(np.stack([topX, topY, sizeOfWindows], axis=1), axis=0, return_index=True)
+    keep = np.sort(firstIndices)
+    return np.stack([topX[keep], topY[keep], windows[keep, 2], windows[keep, 3], sizeOfWindows[keep]], axis=1).astype(np.int32)
+
+def windowSizes(windows, boundBoxChunkSize=1024):
+    """
+    Gives the size of each window, which is boundBoxChunkSize for windows from cropWindows and planWindows, and their
+    own size for windows from planAdaptiveWindows.
+
+    Args:
+        windows (numpy array): The windows, with the shape (N, 4), or (N, 5) if they have their own size.
+        boundBoxChunkSize (int): The size of each side of the bounding box image.
+
+    Returns:
+        numpy array: The size of each window, of shape (N,).
+    """
+    if windows.shape[1] > 4:
+        return windows[:, 4]
+    return np.full(len(windows), boundBoxChunkSize, dtype=windows.dtype)
+
+def coverChunks(chunksOfInterest, span):
+    """
+    Covers the chunks of interest with square windows of span by span chunks on the grid of the chunks, with a greedy
+    set cover which each time takes the window covering the most chunks of interest that are not covered yet.
+
+    Args:
+        chunksOfInterest (list): The row and column of each chunk of interest.
+        span (int): The number of chunks along each side of a window.
+
+    Returns:
+        list: The row and column of the first chunk of interest each window covers, the row and column of the chunk at
+            its top left, and the set of the chunks of interest it covers, in the order of chunksOfInterest.
+    """
+    chunks = np.asarray(chunksOfInterest, dtype=np.int64).reshape(-1, 2).tolist()
+    # The first position of each chunk of interest in chunksOfInterest
+    chunkOrder = {}
+    for row, col in chunks:
+        chunkOrder.setdefault((row, col), len(chunkOrder))
+    # Each window is named by the chunk at its top left, and covers the chunks of interest inside it
+    candidates = {}
+    for row, col in chunkOrder:
+        for dRow in range(span):
+            for dCol in range(span):
+                candidates.setdefault((row - dRow, col - dCol), set()).add((row, col))
+
+    # Lazy greedy set cover, a window's count is only updated when it reaches the top of the heap
+    heap = [(-len(covered), anchor) for anchor, covered in candidates.items()]
+    heapq.heapify(heap)
+    uncovered = set(chunkOrder)
+    planned = []
+    while uncovered:
+        negativeCount, anchor = heapq.heappop(heap)
+        covered = candidates[anchor] & uncovered
+        if len(covered) < -negativeCount:
+            if covered:
+                heapq.heappush(heap, (-len(covered), anchor))
+            continue
+        uncovered -= covered
+        row, col = min(covered, key=chunkOrder.get)
+        planned.append((chunkOrder[row, col], row, col, anchor, covered))
+    planned.sort(key=lambda window: window[0])
+    return [window[1:] for window in planned]
+
+def boundBoxSegmentationJGW(classificationThreshold=0.35, extractDir = "run/extract", boundBoxChunkSize=1024, classificationChunkSize=256, classificationQuantization=None, stream=False, processes=None, windowPlanning="centred", classificationPrescreen=False, classificationCoarseFactor=None, classificationRegionOfInterest=None):
+    """
+    This function segments every .png, .jpg, and .jpeg image from the extract directory with iterBoundBoxSegmentationJGW.
+    By default all of the segmented images are collected into a list. With stream, a generator is returned instead, which
+    makes each segmented image only when it is consumed, so that only one input image is kept in memory at a time.
+    With processes, the images are classified and cropped by a pool of worker processes with iterProcessPoolSegmentation.
 
     Args:
         classificationThreshold (float): The threshold for the classification model.
         extractDir (str): The path to the directory where all of the input images are.
         boundBoxChunkSize (int): The size of each side of the bounding box image.
         classificationChunkSize (int): The size of each side of the classification image.
+        classificationQuantization (str): None for the fp32 classification model, or 'dynamic' or 'static' for an INT8 model.
+        stream (bool): If true, a generator of the segmented images is returned instead of a list.
+        processes (int): The number of worker processes classifying the images, None to classify them in this process.
+        windowPlanning (str): 'centred' to place a bounding box image around each chunk of interest with cropWindows, 'cover' to cover them with as few as possible with planWindows, or 'adaptive' to also size each one to its chunks with planAdaptiveWindows.
+        classificationPrescreen (bool): If true, chunks that are obviously empty are skipped instead of being classified, see classificationSegmentation.
+        classificationCoarseFactor (int): If given, each image is first classified this many times smaller, and only the chunks under the parts of it of interest are decoded and classified in full, see classificationSegmentation.
+        classificationRegionOfInterest (str): If given, the path to a vector file of roads, and only the chunks near them are decoded and classified, see classificationSegmentation.
     
     Returns:
-        imageAndDatas (list): A list of the input image name, segmented image, georeferencing data, row, and column.
+        imageAndDatas (list or generator): The input image name, segmented image, georeferencing data, row, and column of each segmented image.
+    """
+    if windowPlanning not in windowPlannings:
+        raise ValueError(f"Unknown window planning {windowPlanning}, expected one of {windowPlannings}")
+    if processes:
+        imageAndDatas = iterProcessPoolSegmentation(shareSegmentedImagesJGW, cropSharedImageJGW, jgwImageExtensions, processes, classificationThreshold, extractDir, boundBoxChunkSize, classificationChunkSize, classificationQuantization, windowPlanning, classificationPrescreen, classificationCoarseFactor, classificationRegionOfInterest)
+    else:
+        imageAndDatas = iterBoundBoxSegmentationJGW(classificationThreshold, extractDir, boundBoxChunkSize, classificationChunkSize, classificationQuantization, windowPlanning, classificationPrescreen, classificationCoarseFactor, classificationRegionOfInterest)
+    return imageAndDatas if stream else list(imageAndDatas)
+
+
+def iterBoundBoxSegmentationJGW(classificationThreshold=0.35, extractDir = "run/extract", boundBoxChunkSize=1024, classificationChunkSize=256, classificationQuantization=None, windowPlanning="centred", classificationPrescreen=False, classificationCoarseFactor=None, classificationRegionOfInterest=None):
+    """
+    This function will iterate through all of the .png, .jpg, and .jpeg images from the extract directory, and
+    segment each of them with segmentImageJGW.
+
+    Args:
+        classificationThreshold (float): The threshold for the classification model.
+        extractDir (str): The path to the directory where all of the input images are.
+        boundBoxChunkSize (int): The size of each side of the bounding box image.
+        classificationChunkSize (int): The size of each side of the classification image.
+        classificationQuantization (str): None for the fp32 classification model, or 'dynamic' or 'static' for an INT8 model.
+        windowPlanning (str): 'centred' to place a bounding box image around each chunk of interest with cropWindows, 'cover' to cover them with as few as possible with planWindows, or 'adaptive' to also size each one to its chunks with planAdaptiveWindows.
+        classificationPrescreen (bool): If true, chunks that are obviously empty are skipped instead of being classified, see classificationSegmentation.
+        classificationCoarseFactor (int): If given, each image is first classified this many times smaller, and only the chunks under the parts of it of interest are decoded and classified in full, see classificationSegmentation.
+        classificationRegionOfInterest (str): If given, the path to a vector file of roads, and only the chunks near them are decoded and classified, see classificationSegmentation.
+    
+    Yields:
+        imageAndData (tuple): The input image name, segmented image, georeferencing data, row, and column.
     """
     with tqdm(total=(len(os.listdir(extractDir))//2), desc="Segmenting Images") as pbar:
-        imageAndDatas = []
-        chunkSeen = set()
         for inputFileName in os.listdir(extractDir):
-            if inputFileName.endswith(('.png', '.jpg', '.jpeg')):
-                try:
-                    imagePath = os.path.join(extractDir, inputFileName)
-                    originalImage = Image.open(imagePath)
-                    width, height = originalImage.size
-                    chunksOfInterest = classificationSegmentation(inputFileName=imagePath, classificationThreshold=classificationThreshold, classificationChunkSize=classificationChunkSize, boundBoxChunkSize=boundBoxChunkSize)
-                    #data for georeferencing
-                    baseName, _ = os.path.splitext(imagePath)
-                    jgwPath = baseName + ".jgw"
-                    with open(jgwPath) as jgwFile:
-                        lines = jgwFile.readlines()
-                    pixelSizeX = float(lines[0].strip())
-                    pixelSizeY = float(lines[3].strip())
-                    topLeftXGeo = float(lines[4].strip())
-                    topLeftYGeo = float(lines[5].strip())
-
-                    for row, col in chunksOfInterest:
-                        offset = (boundBoxChunkSize - classificationChunkSize) / 2
-                        topX = col * classificationChunkSize - offset if col * classificationChunkSize - offset > 0 else 0
-                        topY = row * classificationChunkSize - offset if row * classificationChunkSize - offset > 0 else 0
-
-                        if topX + boundBoxChunkSize > width:
-                            topX = width - boundBoxChunkSize
-                        if topY + boundBoxChunkSize > height:
-                            topY = height - boundBoxChunkSize
-
-                        box = (topX, topY, topX + boundBoxChunkSize, topY + boundBoxChunkSize)
-                        imageChunk = f"{inputFileName}{(topX, topY, boundBoxChunkSize)}"
-                        if imageChunk in chunkSeen:
-                            continue
-                        chunkSeen.add(imageChunk)
-                        cropped = originalImage.crop(box)
-
-                        topLeftXGeoInterest = topLeftXGeo + topX * pixelSizeX
-                        topLeftYGeoInterest = topLeftYGeo + topY * pixelSizeY
-                        imageAndDatas.append((inputFileName, cropped, pixelSizeX, pixelSizeY, topLeftXGeoInterest, topLeftYGeoInterest, row, col)) 
-                except Exception as e:
-                    print(f"Error opening {imagePath}: {e}")
+            if inputFileName.endswith(jgwImageExtensions):
+                yield from segmentImageJGW(inputFileName, classificationThreshold, extractDir, boundBoxChunkSize, classificationChunkSize, classificationQuantization, windowPlanning, classificationPrescreen, classificationCoarseFactor, classificationRegionOfInterest)
             pbar.update(1)
-        return imageAndDatas
 
 
-def boundBoxSegmentationTIF(classificationThreshold=0.35, extractDir = "run/extract", boundBoxChunkSize=1024, classificationChunkSize=256):
+def segmentImageJGW(inputFileName, classificationThreshold=0.35, extractDir = "run/extract", boundBoxChunkSize=1024, classificationChunkSize=256, classificationQuantization=None, windowPlanning="centred", classificationPrescreen=False, classificationCoarseFactor=None, classificationRegionOfInterest=None):
     """
-    This function will iterate through all of the .tif images from the extract directory.
-    It will then call the classificationSegmentation function and receive all the chunks of interest for each image.
-    From these chunks of interest, it will resegment them into boxes with size boundBoxChunkSize, with the original
-    chunks in the center when possible.
+    This function will classify one .png, .jpg, or .jpeg image from the extract directory and place the bounding box
+    images around its chunks of interest with segmentationWindows, then crop them with cropImageJGW. The image is
+    decoded a single time, and the same array is used for the classification and for the crops.
 
-    During the segmentation, we are also updating the georeferencing data for the new TIF file, keeping the TIF format.
+    With classificationCoarseFactor, the image is first classified at a lower resolution with coarseClassification,
+    and with classificationRegionOfInterest, only the chunks near roads are kept with imageRegionOfInterestMask. The
+    image is only decoded in full if some of its chunks are left to classify at full resolution.
 
     Args:
+        inputFileName (str): The name of the image in the extract directory.
         classificationThreshold (float): The threshold for the classification model.
         extractDir (str): The path to the directory where all of the input images are.
         boundBoxChunkSize (int): The size of each side of the bounding box image.
         classificationChunkSize (int): The size of each side of the classification image.
+        classificationQuantization (str): None for the fp32 classification model, or 'dynamic' or 'static' for an INT8 model.
+        windowPlanning (str): 'centred' to place a bounding box image around each chunk of interest with cropWindows, 'cover' to cover them with as few as possible with planWindows, or 'adaptive' to also size each one to its chunks with planAdaptiveWindows.
+        classificationPrescreen (bool): If true, chunks that are obviously empty are skipped instead of being classified, see classificationSegmentation.
+        classificationCoarseFactor (int): If given, each image is first classified this many times smaller, and only the chunks under the parts of it of interest are decoded and classified in full, see classificationSegmentation.
+        classificationRegionOfInterest (str): If given, the path to a vector file of roads, and only the chunks near them are decoded and classified, see classificationSegmentation.
+    
+    Yields:
+        imageAndData (tuple): The input image name, segmented image, georeferencing data, row, and column.
+    """
+    imagePath = os.path.join(extractDir, inputFileName)
+    tileMask = None
+    try:
+        if classificationCoarseFactor or classificationRegionOfInterest:
+            with Image.open(imagePath) as image:
+                width, height = image.size
+        if classificationRegionOfInterest:
+            tileMask = imageRegionOfInterestMask(imagePath, classificationRegionOfInterest, width, height, classificationChunkSize)
+        if classificationCoarseFactor and (tileMask is None or tileMask.any()):
+            counts = {"decodedPixels": 0}
+            coarseMask = coarseClassification(imagePath, width, height, classificationChunkSize, classificationCoarseFactor, quantization=classificationQuantization, counts=counts)
+            tileMask = coarseMask if tileMask is None else tileMask & coarseMask
+            # The whole image is decoded for the crops as well, unless the coarse pass found nothing
+            reportCoarseToFine(imagePath, width, height, tileMask, counts["decodedPixels"] + (width * height if tileMask.any() else 0))
+        if tileMask is not None and not tileMask.any():
+            return
+        imageArray = loadImageArray(imagePath)
+    except Exception as e:
+        print(f"Error opening {imagePath}: {e}")
+        return
+    # The region of interest and the coarse pass have already been applied, so only the chunks left are classified
+    _, windows = segmentationWindows(inputFileName, classificationThreshold, extractDir, boundBoxChunkSize, classificationChunkSize, classificationQuantization, imageArray, windowPlanning, classificationPrescreen, tileMask=tileMask)
+    yield from cropImageJGW(inputFileName, windows, extractDir, boundBoxChunkSize, imageArray)
+
+
+def cropImageJGW(inputFileName, windows, extractDir = "run/extract", boundBoxChunkSize=1024, imageArray=None):
+    """
+    Crops the bounding box images of one .png, .jpg, or .jpeg image from the extract directory, and calculates their new
+    georeferencing data, including the new topLeftXGeo, and topLeftYGeo, from the image's .jgw file. The input image is
+    closed once all of its segmented images have been consumed.
+
+    Args:
+        inputFileName (str): The name of the image in the extract directory.
+        windows (numpy array): The topX, topY, row and column of each bounding box image, and its size if it has its own, from cropWindows, planWindows or planAdaptiveWindows.
+        extractDir (str): The path to the directory where all of the input images are.
+        boundBoxChunkSize (int): The size of each side of the bounding box images without a size of their own.
+        imageArray (numpy array): The image already decoded with loadImageArray, if None the image is opened again.
+
+    Yields:
+        imageAndData (tuple): The input image name, segmented image, georeferencing data, row, and column.
+    """
+    imagePath = os.path.join(extractDir, inputFileName)
+    try:
+        #data for georeferencing
+        baseName, _ = os.path.splitext(imagePath)
+        jgwPath = baseName + ".jgw"
+        with open(jgwPath) as jgwFile:
+            lines = jgwFile.readlines()
+        pixelSizeX = float(lines[0].strip())
+        pixelSizeY = float(lines[3].strip())
+        topLeftXGeo = float(lines[4].strip())
+        topLeftYGeo = float(lines[5].strip())
+
+        if imageArray is None:
+            imageArray = loadImageArray(imagePath)
+
+        for (topX, topY, row, col), size in zip(windows[:, :4].tolist(), windowSizes(windows, boundBoxChunkSize)):
+            cropped = cropArray(imageArray, topX, topY, size)
+
+            topLeftXGeoInterest = topLeftXGeo + topX * pixelSizeX
+            topLeftYGeoInterest = topLeftYGeo + topY * pixelSizeY
+            yield (inputFileName, cropped, pixelSizeX, pixelSizeY, topLeftXGeoInterest, topLeftYGeoInterest, row, col)
+    except Exception as e:
+        print(f"Error opening {imagePath}: {e}")
+
+
+def shareSegmentedImagesJGW(inputFileName, classificationThreshold=0.35, extractDir = "run/extract", boundBoxChunkSize=1024, classificationChunkSize=256, classificationQuantization=None, windowPlanning="centred", classificationPrescreen=False, classificationCoarseFactor=None, classificationRegionOfInterest=None):
+    """
+    Segments one .png, .jpg, or .jpeg image with segmentImageJGW in a worker process, and copies the pixels of all of
+    its segmented images into one block of shared memory, so that the image is only decoded by the worker rather than
+    again by the process cropping it. The block is removed by cropSharedImageJGW once it has read the segmented images.
+
+    Args:
+        inputFileName (str): The name of the image in the extract directory.
+        classificationThreshold (float): The threshold for the classification model.
+        extractDir (str): The path to the directory where all of the input images are.
+        boundBoxChunkSize (int): The size of each side of the bounding box image.
+        classificationChunkSize (int): The size of each side of the classification image.
+        classificationQuantization (str): None for the fp32 classification model, or 'dynamic' or 'static' for an INT8 model.
+        windowPlanning (str): 'centred', 'cover' or 'adaptive', see segmentationWindows.
+        classificationPrescreen (bool): If true, chunks that are obviously empty are skipped instead of being classified, see classificationSegmentation.
+        classificationCoarseFactor (int): If given, each image is first classified this many times smaller, see classificationSegmentation.
+        classificationRegionOfInterest (str): If given, the path to a vector file of roads, see classificationSegmentation.
+
+    Returns:
+        tuple: The name of the image, and the name of the shared memory block with the shape and the rest of the data of
+            each segmented image, or None if the image has no segmented images.
+    """
+    imageAndDatas = list(segmentImageJGW(inputFileName, classificationThreshold, extractDir, boundBoxChunkSize, classificationChunkSize, classificationQuantization, windowPlanning, classificationPrescreen, classificationCoarseFactor, classificationRegionOfInterest))
+    if not imageAndDatas:
+        return inputFileName, None
+    croppedArrays = [np.asarray(imageAndData[1]) for imageAndData in imageAndDatas]
+    sharedCrops = shared_memory.SharedMemory(create=True, size=sum(croppedArray.nbytes for croppedArray in croppedArrays))
+    try:
+        offset = 0
+        for croppedArray in croppedArrays:
+            sharedCrops.buf[offset:offset + croppedArray.nbytes] = croppedArray.tobytes()
+            offset += croppedArray.nbytes
+    except Exception:
+        sharedCrops.close()
+        sharedCrops.unlink()
+        raise
+    sharedCrops.close()
+    datas = [(croppedArray.shape, imageAndData[:1] + imageAndData[2:]) for croppedArray, imageAndData in zip(croppedArrays, imageAndDatas)]
+    return inputFileName, (sharedCrops.name, datas)
+
+
+def cropSharedImageJGW(inputFileName, sharedCrops, extractDir = "run/extract", boundBoxChunkSize=1024):
+    """
+    Reads the segmented images of one .png, .jpg, or .jpeg image back from the shared memory block written by
+    shareSegmentedImagesJGW, then removes the block, even if not all of them are consumed.
+
+    Args:
+        inputFileName (str): The name of the image in the extract directory.
+        sharedCrops (tuple): The name of the shared memory block and the data of each segmented image, from
+            shareSegmentedImagesJGW, or None if the image has no segmented images.
+        extractDir (str): The path to the directory where all of the input images are, unused since the image is not read again.
+        boundBoxChunkSize (int): The size of each side of the bounding box image, unused since the images are already cropped.
+
+    Yields:
+        imageAndData (tuple): The input image name, segmented image, georeferencing data, row, and column.
+    """
+    if sharedCrops is None:
+        return
+    name, datas = sharedCrops
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        offset = 0
+        for shape, data in datas:
+            size = math.prod(shape)
+            # The pixels are copied out, so no view of the block is left when it is closed
+            cropped = Image.fromarray(np.frombuffer(block.buf, dtype=np.uint8, count=size, offset=offset).reshape(shape).copy())
+            offset += size
+            yield (data[0], cropped) + data[1:]
+    finally:
+        block.close()
+        block.unlink()
+
+
+def boundBoxSegmentationTIF(classificationThreshold=0.35, extractDir = "run/extract", boundBoxChunkSize=1024, classificationChunkSize=256, classificationQuantization=None, stream=False, processes=None, windowPlanning="centred", classificationPrescreen=False, classificationCoarseFactor=None, classificationRegionOfInterest=None):
+    """
+    This function segments every .tif image from the extract directory with iterBoundBoxSegmentationTIF. By default all of
+    the segmented images are collected into a list. With stream, a generator is returned instead, which makes each
+    segmented image only when it is consumed, so that only one input image is kept open at a time. With processes,
+    the images are classified by a pool of worker processes with iterProcessPoolSegmentation.
+
+    Args:
+        classificationThreshold (float): The threshold for the classification model.
+        extractDir (str): The path to the directory where all of the input images are.
+        boundBoxChunkSize (int): The size of each side of the bounding box image.
+        classificationChunkSize (int): The size of each side of the classification image.
+        classificationQuantization (str): None for the fp32 classification model, or 'dynamic' or 'static' for an INT8 model.
+        stream (bool): If true, a generator of the segmented images is returned instead of a list.
+        processes (int): The number of worker processes classifying the images, None to classify them in this process.
+        windowPlanning (str): 'centred' to place a bounding box image around each chunk of interest with cropWindows, 'cover' to cover them with as few as possible with planWindows, or 'adaptive' to also size each one to its chunks with planAdaptiveWindows.
+        classificationPrescreen (bool): If true, chunks that are obviously empty are skipped instead of being classified, see classificationSegmentation.
+        classificationCoarseFactor (int): If given, each image is first classified this many times smaller, and only the chunks under the parts of it of interest are decoded and classified in full, see classificationSegmentation.
+        classificationRegionOfInterest (str): If given, the path to a vector file of roads, and only the chunks near them are decoded and classified, see classificationSegmentation.
     Returns:
-        imageAndDatas (list): A list of the input image name, segmented TIF image, row, and column.
+        imageAndDatas (list or generator): The input image name, segmented TIF image, row, and column of each segmented image.
+    """
+    if windowPlanning not in windowPlannings:
+        raise ValueError(f"Unknown window planning {windowPlanning}, expected one of {windowPlannings}")
+    if processes:
+        imageAndDatas = iterProcessPoolSegmentation(segmentationWindows, cropImageTIF, tifImageExtensions, processes, classificationThreshold, extractDir, boundBoxChunkSize, classificationChunkSize, classificationQuantization, windowPlanning, classificationPrescreen, classificationCoarseFactor, classificationRegionOfInterest)
+    else:
+        imageAndDatas = iterBoundBoxSegmentationTIF(classificationThreshold, extractDir, boundBoxChunkSize, classificationChunkSize, classificationQuantization, windowPlanning, classificationPrescreen, classificationCoarseFactor, classificationRegionOfInterest)
+    return imageAndDatas if stream else list(imageAndDatas)
+
+
+def iterBoundBoxSegmentationTIF(classificationThreshold=0.35, extractDir = "run/extract", boundBoxChunkSize=1024, classificationChunkSize=256, classificationQuantization=None, windowPlanning="centred", classificationPrescreen=False, classificationCoarseFactor=None, classificationRegionOfInterest=None):
+    """
+    This function will iterate through all of the .tif images from the extract directory, and segment each of them
+    with segmentImageTIF.
+
+    Args:
+        classificationThreshold (float): The threshold for the classification model.
+        extractDir (str): The path to the directory where all of the input images are.
+        boundBoxChunkSize (int): The size of each side of the bounding box image.
+        classificationChunkSize (int): The size of each side of the classification image.
+        classificationQuantization (str): None for the fp32 classification model, or 'dynamic' or 'static' for an INT8 model.
+        windowPlanning (str): 'centred' to place a bounding box image around each chunk of interest with cropWindows, 'cover' to cover them with as few as possible with planWindows, or 'adaptive' to also size each one to its chunks with planAdaptiveWindows.
+        classificationPrescreen (bool): If true, chunks that are obviously empty are skipped instead of being classified, see classificationSegmentation.
+        classificationCoarseFactor (int): If given, each image is first classified this many times smaller, and only the chunks under the parts of it of interest are decoded and classified in full, see classificationSegmentation.
+        classificationRegionOfInterest (str): If given, the path to a vector file of roads, and only the chunks near them are decoded and classified, see classificationSegmentation.
+    Yields:
+        imageAndData (tuple): The input image name, segmented TIF image, row, and column.
     """
     with tqdm(total=(len(os.listdir(extractDir))), desc="Segmenting Images") as pbar:
-        imageAndDatas = []
-        chunkSeen = set()
         for inputFileName in os.listdir(extractDir):
-            if inputFileName.endswith(('.tif')):
-                try:
-                    imagePath = os.path.join(extractDir, inputFileName)
-                    dataset = gdal.Open(imagePath, gdal.GA_ReadOnly)
-                    if dataset is None:
-                        raise Exception(f"Failed to open {imagePath}")
-                    
-                    width = dataset.RasterXSize
-                    height = dataset.RasterYSize
-                    # Get the georeference data (this will be used to preserve georeferencing)
-                    geoTransform = dataset.GetGeoTransform()
-                    chunksOfInterest = classificationSegmentation(inputFileName=imagePath, classificationThreshold=classificationThreshold, classificationChunkSize=classificationChunkSize, boundBoxChunkSize=boundBoxChunkSize)
-                    for row, col in chunksOfInterest:
-                        offset = (boundBoxChunkSize - classificationChunkSize) / 2
-                        topX = col * classificationChunkSize - offset if col * classificationChunkSize - offset > 0 else 0
-                        topY = row * classificationChunkSize - offset if row * classificationChunkSize - offset > 0 else 0
-                        
-                        if topX + boundBoxChunkSize > width:
-                            topX = width - boundBoxChunkSize
-                        if topY + boundBoxChunkSize > height:
-                            topY = height - boundBoxChunkSize
-                        # Convert the pixel coordinates to georeferenced coordinates
-                        georeferencedTopX = geoTransform[0] + topX * geoTransform[1] + topY * geoTransform[2]
-                        georeferencedTopY = geoTransform[3] + topX * geoTransform[4] + topY * geoTransform[5]
-                        
-                        # Use GDAL to create the cropped image, preserving georeference
-                        imageChunk = f"{inputFileName}{(topX, topY, boundBoxChunkSize)}"
-                        if imageChunk in chunkSeen:
-                            continue
-                        chunkSeen.add(imageChunk)
-                        cropped = gdal.Translate("", dataset, srcWin=[topX, topY, boundBoxChunkSize, boundBoxChunkSize], 
-                                    projWin=[georeferencedTopX, georeferencedTopY, geoTransform[0] + (topX + boundBoxChunkSize) * geoTransform[1], geoTransform[3] + (topY + boundBoxChunkSize) * geoTransform[5]], 
-                                    format="MEM")
-                        baseName, _ = os.path.splitext(inputFileName)
-                        imageAndDatas.append((baseName, cropped, row, col))
-                except Exception as e:
-                    print(f"Error opening {imagePath}: {e}")
+            if inputFileName.endswith(tifImageExtensions):
+                yield from segmentImageTIF(inputFileName, classificationThreshold, extractDir, boundBoxChunkSize, classificationChunkSize, classificationQuantization, windowPlanning, classificationPrescreen, classificationCoarseFactor, classificationRegionOfInterest)
             pbar.update(1)
-        return imageAndDatas
+
+
+def segmentImageTIF(inputFileName, classificationThreshold=0.35, extractDir = "run/extract", boundBoxChunkSize=1024, classificationChunkSize=256, classificationQuantization=None, windowPlanning="centred", classificationPrescreen=False, classificationCoarseFactor=None, classificationRegionOfInterest=None):
+    """
+    This function will classify one .tif image from the extract directory and place the bounding box images around
+    its chunks of interest with segmentationWindows, then crop them with cropImageTIF.
+
+    Args:
+        inputFileName (str): The name of the image in the extract directory.
+        classificationThreshold (float): The threshold for the classification model.
+        extractDir (str): The path to the directory where all of the input images are.
+        boundBoxChunkSize (int): The size of each side of the bounding box image.
+        classificationChunkSize (int): The size of each side of the classification image.
+        classificationQuantization (str): None for the fp32 classification model, or 'dynamic' or 'static' for an INT8 model.
+        windowPlanning (str): 'centred' to place a bounding box image around each chunk of interest with cropWindows, 'cover' to cover them with as few as possible with planWindows, or 'adaptive' to also size each one to its chunks with planAdaptiveWindows.
+        classificationPrescreen (bool): If true, chunks that are obviously empty are skipped instead of being classified, see classificationSegmentation.
+        classificationCoarseFactor (int): If given, each image is first classified this many times smaller, and only the chunks under the parts of it of interest are decoded and classified in full, see classificationSegmentation.
+        classificationRegionOfInterest (str): If given, the path to a vector file of roads, and only the chunks near them are decoded and classified, see classificationSegmentation.
+    Yields:
+        imageAndData (tuple): The input image name, segmented TIF image, row, and column.
+    """
+    _, windows = segmentationWindows(inputFileName, classificationThreshold, extractDir, boundBoxChunkSize, classificationChunkSize, classificationQuantization, windowPlanning=windowPlanning, classificationPrescreen=classificationPrescreen, classificationCoarseFactor=classificationCoarseFactor, classificationRegionOfInterest=classificationRegionOfInterest)
+    yield from cropImageTIF(inputFileName, windows, extractDir, boundBoxChunkSize)
+
+
+def cropImageTIF(inputFileName, windows, extractDir = "run/extract", boundBoxChunkSize=1024):
+    """
+    Crops the bounding box images of one .tif image from the extract directory. Each segmented TIF image is a
+    RasterWindow with its own georeferencing data, which reads its pixels from the input image only when they are
+    needed, rather than a copy of them. The input image is closed once all of its segmented images have been dropped.
+
+    Args:
+        inputFileName (str): The name of the image in the extract directory.
+        windows (numpy array): The topX, topY, row and column of each bounding box image, and its size if it has its own, from cropWindows, planWindows or planAdaptiveWindows.
+        extractDir (str): The path to the directory where all of the input images are.
+        boundBoxChunkSize (int): The size of each side of the bounding box images without a size of their own.
+
+    Yields:
+        imageAndData (tuple): The input image name, segmented TIF image, row, and column.
+    """
+    imagePath = os.path.join(extractDir, inputFileName)
+    try:
+        dataset = gdal.Open(imagePath, gdal.GA_ReadOnly)
+        if dataset is None:
+            raise Exception(f"Failed to open {imagePath}")
+        # Get the georeference data (this will be used to preserve georeferencing)
+        geoTransform = dataset.GetGeoTransform()
+        projection = dataset.GetProjection()
+        lock = threading.Lock()
+        buffers = threading.local()
+        baseName, _ = os.path.splitext(inputFileName)
+        for (topX, topY, row, col), size in zip(windows[:, :4].tolist(), windowSizes(windows, boundBoxChunkSize)):
+            cropped = RasterWindow(dataset, topX, topY, size, geoTransform, projection, lock, buffers)
+            yield (baseName, cropped, row, col)
+    except Exception as e:
+        print(f"Error opening {imagePath}: {e}")
+
+
+def initSegmentationWorker(classificationQuantization=None):
+    """
+    Prepares a segmentation worker process. Each worker uses a single intra-op thread, since the workers already keep
+    every core busy, and loads its own classifier once instead of for every image.
+
+    Args:
+        classificationQuantization (str): None for the fp32 classification model, or 'dynamic' or 'static' for an INT8 model.
+    """
+    torch.set_num_threads(1)
+    get_classifier_engine(classificationQuantization)
+
+def segmentationWindows(inputFileName, classificationThreshold=0.35, extractDir = "run/extract", boundBoxChunkSize=1024, classificationChunkSize=256, classificationQuantization=None, imageArray=None, windowPlanning="centred", classificationPrescreen=False, classificationCoarseFactor=None, classificationRegionOfInterest=None, tileMask=None):
+    """
+    Classifies one input image and places the bounding box images around its chunks of interest. This is the part of
+    the segmentation of .tif images run by the worker processes, it only returns the windows so that no images have to
+    be sent back.
+
+    Args:
+        inputFileName (str): The name of the image in the extract directory.
+        classificationThreshold (float): The threshold for the classification model.
+        extractDir (str): The path to the directory where all of the input images are.
+        boundBoxChunkSize (int): The size of each side of the bounding box image.
+        classificationChunkSize (int): The size of each side of the classification image.
+        classificationQuantization (str): None for the fp32 classification model, or 'dynamic' or 'static' for an INT8 model.
+        imageArray (numpy array): The image already decoded with loadImageArray, None to read it from the file.
+        windowPlanning (str): 'centred' to place a bounding box image around each chunk of interest with cropWindows, 'cover' to cover them with as few as possible with planWindows, or 'adaptive' to also size each one to its chunks with planAdaptiveWindows.
+        classificationPrescreen (bool): If true, chunks that are obviously empty are skipped instead of being classified, see classificationSegmentation.
+        classificationCoarseFactor (int): If given, each image is first classified this many times smaller, and only the chunks under the parts of it of interest are decoded and classified in full, see classificationSegmentation.
+        classificationRegionOfInterest (str): If given, the path to a vector file of roads, and only the chunks near them are decoded and classified, see classificationSegmentation.
+        tileMask (numpy array): If given, only the chunks where it is True are classified, see classificationSegmentation.
+
+    Returns:
+        tuple: The name of the image and its windows from cropWindows, planWindows or planAdaptiveWindows, which are empty if the image could not be classified.
+    """
+    if windowPlanning not in windowPlannings:
+        raise ValueError(f"Unknown window planning {windowPlanning}, expected one of {windowPlannings}")
+    imagePath = os.path.join(extractDir, inputFileName)
+    try:
+        if imageArray is not None:
+            height, width = imageArray.shape[:2]
+        elif inputFileName.endswith(tifImageExtensions):
+            # Only the header is read, PIL cannot open every GeoTIFF
+            dataset = gdal.Open(imagePath, gdal.GA_ReadOnly)
+            if dataset is None:
+                raise Exception(f"Failed to open {imagePath}")
+            width, height = dataset.RasterXSize, dataset.RasterYSize
+            dataset = None
+        else:
+            with Image.open(imagePath) as image:
+                width, height = image.size
+        chunksOfInterest = classificationSegmentation(inputFileName=imagePath, classificationThreshold=classificationThreshold, classificationChunkSize=classificationChunkSize, boundBoxChunkSize=boundBoxChunkSize, quantization=classificationQuantization, imageArray=imageArray, prescreen=classificationPrescreen, tileMask=tileMask, coarseFactor=classificationCoarseFactor, regionOfInterest=classificationRegionOfInterest, clamp=False)
+        # The chunks at the edge of the image are moved inside it for the full size windows, and for the rows and
+        # columns the boxes are deduplicated by, but the adaptive windows are placed around where the chunks really are
+        filteringBounds = getFilteringBounds(width, height, classificationChunkSize, boundBoxChunkSize)
+        clampedChunks = [clampRowCol(row, col, *filteringBounds) for row, col in chunksOfInterest]
+        windows = cropWindows(clampedChunks, width, height, boundBoxChunkSize, classificationChunkSize)
+        if windowPlanning != "centred":
+            centredCount = len(windows)
+            if windowPlanning == "cover":
+                windows = planWindows(clampedChunks, width, height, boundBoxChunkSize, classificationChunkSize)
+            else:
+                windows = planAdaptiveWindows(chunksOfInterest, width, height, boundBoxChunkSize, classificationChunkSize)
+                windows[:, 2:4] = np.array([clampRowCol(row, col, *filteringBounds) for row, col in windows[:, 2:4].tolist()], dtype=np.int32).reshape(-1, 2)
+            pixelShare = np.square(windowSizes(windows, boundBoxChunkSize), dtype=np.float64).sum() / max(centredCount * boundBoxChunkSize ** 2, 1)
+            tqdm.write(f"{inputFileName}: {len(windows)} segmented images instead of {centredCount}, {centredCount - len(windows)} fewer detection calls over {pixelShare:.0%} of the pixels")
+        return inputFileName, windows
+    except Exception as e:
+        print(f"Error opening {imagePath}: {e}")
+        return inputFileName, np.empty((0, 4), dtype=np.int32)
+
+def iterProcessPoolSegmentation(segmentImage, cropImage, extensions, processes, classificationThreshold=0.35, extractDir = "run/extract", boundBoxChunkSize=1024, classificationChunkSize=256, classificationQuantization=None, windowPlanning="centred", classificationPrescreen=False, classificationCoarseFactor=None, classificationRegionOfInterest=None):
+    """
+    Segments the input images with a pool of worker processes, and this process then makes the segmented images from
+    what the workers return as it comes back, in the same order as listInputImages. For .tif images the workers
+    classify the images and return their windows as small arrays, with segmentationWindows, which cropImageTIF reads
+    from the input image lazily. A .png, .jpg, or .jpeg image has to be decoded in full to be cropped, so the workers
+    also crop it and return its segmented images in shared memory, with shareSegmentedImagesJGW, and every image is
+    only decoded once, by a worker.
+
+    The workers are started with spawn rather than fork, since PyTorch's thread pools cannot be used after a fork.
+
+    Args:
+        segmentImage (callable): The function run by the workers on each image, segmentationWindows or shareSegmentedImagesJGW.
+        cropImage (callable): The function making the segmented images from what the workers return, cropImageTIF or cropSharedImageJGW.
+        extensions (tuple): The file extensions of the input images, jgwImageExtensions or tifImageExtensions.
+        processes (int): The number of worker processes.
+        classificationThreshold (float): The threshold for the classification model.
+        extractDir (str): The path to the directory where all of the input images are.
+        boundBoxChunkSize (int): The size of each side of the bounding box image.
+        classificationChunkSize (int): The size of each side of the classification image.
+        classificationQuantization (str): None for the fp32 classification model, or 'dynamic' or 'static' for an INT8 model.
+        windowPlanning (str): 'centred' to place a bounding box image around each chunk of interest with cropWindows, 'cover' to cover them with as few as possible with planWindows, or 'adaptive' to also size each one to its chunks with planAdaptiveWindows.
+        classificationPrescreen (bool): If true, chunks that are obviously empty are skipped instead of being classified, see classificationSegmentation.
+        classificationCoarseFactor (int): If given, each image is first classified this many times smaller, and only the chunks under the parts of it of interest are decoded and classified in full, see classificationSegmentation.
+        classificationRegionOfInterest (str): If given, the path to a vector file of roads, and only the chunks near them are decoded and classified, see classificationSegmentation.
+
+    Yields:
+        imageAndData (tuple): The same segmented images and data as cropImage.
+    """
+    inputFileNames = listInputImages(extractDir, extensions)
+    segmentImageOf = functools.partial(segmentImage, classificationThreshold=classificationThreshold, extractDir=extractDir, boundBoxChunkSize=boundBoxChunkSize, classificationChunkSize=classificationChunkSize, classificationQuantization=classificationQuantization, windowPlanning=windowPlanning, classificationPrescreen=classificationPrescreen, classificationCoarseFactor=classificationCoarseFactor, classificationRegionOfInterest=classificationRegionOfInterest)
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes, initializer=initSegmentationWorker, initargs=(classificationQuantization,)) as pool:
+        with tqdm(total=len(inputFileNames), desc="Segmenting Images") as pbar:
+            for inputFileName, segmented in pool.imap(segmentImageOf, inputFileNames):
+                yield from cropImage(inputFileName, segmented, extractDir, boundBoxChunkSize)
+                pbar.update(1)
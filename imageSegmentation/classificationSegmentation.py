@@ -1,28 +1,36 @@
+from osgeo import gdal
 from PIL import Image
+from tqdm import tqdm
+import numpy as np
 import math
 import os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from classificationScreening.classify import PIL_infer
+from classificationScreening.engine import get_classifier_engine
+from imageSegmentation.tiling import loadImageArray, loadReducedImageArray, reduceArray, tileExtents, iterTileBatches, iterRasterTileBatches
+from imageSegmentation.tileScreening import iterScreenedTileBatches
+from imageSegmentation.rasterWindow import DownsampledRaster
+from imageSegmentation.regionOfInterest import imageRegionOfInterestMask
 
-def classificationSegmentation(inputFileName, classificationThreshold, classificationChunkSize, boundBoxChunkSize):
+# The threshold of the coarse pass of classificationSegmentation. It is lower than the usual threshold, since a crossing
+# is harder to see once downsampled, and a chunk missed by the coarse pass is never classified at full resolution.
+coarseClassificationThreshold = 0.1
+
+def getFilteringBounds(width, height, classificationChunkSize, boundBoxChunkSize):
     """
-    Divides the images into square chunks, and passes it into the classification model.
-    It will then keep track of the row and column where the classification model returns true, and return it.
+    Calculates the lowest and highest row and column that a chunk of interest can have, so that the bounding box chunk
+    centred on it stays inside of the image.
 
     Args:
-        inputFileName (str): The name of the file we are trying to open.
-        classificationThreshold (float): The threshold for the classification model.
+        width (int): The width of the original image.
+        height (int): The height of the original image.
         classificationChunkSize (int): The size of chunks we are breaking down the original image to.
-    
+        boundBoxChunkSize (int): The size of each side of the bounding box image.
+
     Returns:
-        listOfRowCol (list): A list of row and columns of interest.
+        tuple: The lower filtering bound, the upper width filtering bound and the upper height filtering bound.
     """
-
-    image = Image.open(inputFileName)
-    width, height = image.size
-
     if (boundBoxChunkSize / classificationChunkSize) % 2 == 1:
         lowerFilteringBound = (boundBoxChunkSize / classificationChunkSize) // 2
     else:
@@ -32,33 +40,224 @@ def classificationSegmentation(inputFileName, classificationThreshold, classific
         lowerFilteringBound = n // 2
     upperWidthFilteringBound = math.ceil(width / classificationChunkSize) - 1 - lowerFilteringBound
     upperHeightFilteringBound = math.ceil(height / classificationChunkSize) - 1 - lowerFilteringBound
+    return lowerFilteringBound, upperWidthFilteringBound, upperHeightFilteringBound
+
+
+def clampRowCol(row, col, lowerFilteringBound, upperWidthFilteringBound, upperHeightFilteringBound):
+    """
+    Clamps the row and column of a chunk of interest to the filtering bounds, so that the bounding box chunk built
+    around it does not go past the edges of the image.
+
+    Args:
+        row (int): The row of the chunk of interest.
+        col (int): The column of the chunk of interest.
+        lowerFilteringBound (int): The lowest row and column allowed.
+        upperWidthFilteringBound (int): The highest column allowed.
+        upperHeightFilteringBound (int): The highest row allowed.
+
+    Returns:
+        tuple: The clamped row and column.
+    """
+    if col >= upperWidthFilteringBound:
+        col = upperWidthFilteringBound
+    elif col <= lowerFilteringBound:
+        col = lowerFilteringBound
+    if row >= upperHeightFilteringBound:
+        row = upperHeightFilteringBound
+    elif row <= lowerFilteringBound:
+        row = lowerFilteringBound
+    return row, col
+
+
+def coarseToFineMask(coarseRowCols, width, height, classificationChunkSize, coarseFactor):
+    """
+    Finds the chunks of an image which are under any of the given chunks of its downsampled copy. Each chunk of the
+    copy covers coarseFactor by coarseFactor chunks of the image, or a few more where the chunks are shifted at the edges.
+
+    Args:
+        coarseRowCols (numpy array): The row and column of each chunk of the downsampled copy, with the shape (chunks, 2).
+        width (int): The width of the image.
+        height (int): The height of the image.
+        classificationChunkSize (int): The size of each side of a chunk, in the image and in its copy.
+        coarseFactor (int): How many times smaller the copy is in both directions, rounded down.
+
+    Returns:
+        tileMask (numpy array): A boolean array with a value for every row and column of chunks of the image, which is
+            True for the chunks under any of the given chunks.
+    """
+    rowStarts, rowEnds = tileExtents(height, classificationChunkSize)
+    colStarts, colEnds = tileExtents(width, classificationChunkSize)
+    coarseRowStarts, coarseRowEnds = tileExtents(max(1, height // coarseFactor), classificationChunkSize)
+    coarseColStarts, coarseColEnds = tileExtents(max(1, width // coarseFactor), classificationChunkSize)
+    coarseRows, coarseCols = np.asarray(coarseRowCols, dtype=np.int64).reshape(-1, 2).T
+    # Which chunks of the image each of the given chunks overlaps, along each side
+    rowHits = (rowStarts < coarseRowEnds[coarseRows, np.newaxis] * coarseFactor) & (rowEnds > coarseRowStarts[coarseRows, np.newaxis] * coarseFactor)
+    colHits = (colStarts < coarseColEnds[coarseCols, np.newaxis] * coarseFactor) & (colEnds > coarseColStarts[coarseCols, np.newaxis] * coarseFactor)
+    return (rowHits.T.astype(np.int32) @ colHits.astype(np.int32)) > 0
+
+
+def coarseClassification(inputFileName, width, height, classificationChunkSize, coarseFactor, coarseThreshold=coarseClassificationThreshold, batchSize=32, quantization=None, dataset=None, imageArray=None, counts=None):
+    """
+    Classifies a copy of the image which is coarseFactor times smaller in both directions, and finds the chunks of the
+    image under the chunks of the copy that score above coarseThreshold, which are the only ones worth classifying at
+    full resolution. The copy of a .tif image is read from its overviews through DownsampledRaster, and the copy of a
+    JPEG image is decoded at a lower resolution with loadReducedImageArray, so neither is decoded in full.
+
+    Args:
+        inputFileName (str): The name of the file we are trying to open.
+        width (int): The width of the image.
+        height (int): The height of the image.
+        classificationChunkSize (int): The size of chunks we are breaking down the image and its copy to.
+        coarseFactor (int): How many times smaller the copy is in both directions.
+        coarseThreshold (float): The threshold for the classification model on the chunks of the copy.
+        batchSize (int): The number of chunks passed to the classification model at once.
+        quantization (str): None for the fp32 classification model, or 'dynamic' or 'static' for an INT8 model.
+        dataset (gdal.Dataset): The open .tif image, None for any other image.
+        imageArray (numpy array): The image already decoded with loadImageArray, which the copy is reduced from.
+        counts (dict): If given, its 'decodedPixels' is increased by the number of pixels decoded to make the copy.
+
+    Returns:
+        tileMask (numpy array): A boolean array with a value for every row and column of chunks of the image, which is
+            True for the chunks worth classifying at full resolution.
+    """
+    decodedPixels = 0
+    if imageArray is not None:
+        tileBatches = iterTileBatches(reduceArray(imageArray, coarseFactor), classificationChunkSize, batchSize)
+    elif dataset is not None:
+        raster = DownsampledRaster(dataset, coarseFactor)
+        tileBatches = iterRasterTileBatches(raster, classificationChunkSize, batchSize)
+    else:
+        reducedArray, decodedPixels = loadReducedImageArray(inputFileName, coarseFactor)
+        tileBatches = iterTileBatches(reducedArray, classificationChunkSize, batchSize)
+
+    engine = get_classifier_engine(quantization)
+    coarseRowCols = [rowCols[engine.array_batch_infer(chunks, threshold=coarseThreshold)] for rowCols, chunks in tileBatches]
+    coarseRowCols = np.concatenate(coarseRowCols) if coarseRowCols else np.empty((0, 2), dtype=np.int64)
+
+    if counts is not None:
+        if dataset is not None and imageArray is None:
+            decodedPixels = raster.decodedPixels
+        counts["decodedPixels"] = counts.get("decodedPixels", 0) + decodedPixels
+    return coarseToFineMask(coarseRowCols, width, height, classificationChunkSize, coarseFactor)
+
+
+def reportCoarseToFine(inputFileName, width, height, tileMask, decodedPixels):
+    """
+    Reports how much of an image the coarse pass of coarseClassification saved from being decoded and classified at
+    full resolution.
+
+    Args:
+        inputFileName (str): The name of the image.
+        width (int): The width of the image.
+        height (int): The height of the image.
+        tileMask (numpy array): The chunks classified at full resolution, from coarseClassification.
+        decodedPixels (int): The number of pixels decoded for the coarse pass and the full resolution chunks together.
+    """
+    tqdm.write(f"{os.path.basename(inputFileName)}: {np.count_nonzero(tileMask)} of {tileMask.size} chunks classified at full resolution, "
+               f"{decodedPixels:,} of {width * height:,} pixels decoded ({decodedPixels / max(width * height, 1):.0%})")
+
+
+def classificationSegmentation(inputFileName, classificationThreshold, classificationChunkSize, boundBoxChunkSize, batchSize=32, quantization=None, imageArray=None, prescreen=False, prescreenThresholds=None, counts=None, tileMask=None, coarseFactor=None, coarseThreshold=coarseClassificationThreshold, regionOfInterest=None, clamp=True):
+    """
+    Divides the images into square chunks, and passes it into the classification model.
+    It will then keep track of the row and column where the classification model returns true, and return it.
+
+    The image is decoded once into a numpy array, and the chunks are read from it as a strided view. They are
+    gathered into batches of batchSize and classified together, the result of each batch is then mapped back to
+    the row and column of the chunk it came from. A .tif image is never decoded as a whole, its chunks are read
+    through GDAL in windows that follow the raster's internal tiling, so that rasters of any size can be classified.
+
+    With coarseFactor, the image is first classified at a lower resolution with coarseClassification, and only the
+    chunks under the parts of it that score above the lower coarseThreshold are decoded and classified at full
+    resolution. Nothing else of a .tif image is read, and an image without any such chunks is never decoded in full.
+
+    With regionOfInterest, such as a road network, only the chunks near its features are decoded and classified,
+    see imageRegionOfInterestMask. The image is georeferenced by its own geotransform if it is a .tif image, or by
+    its .jgw file otherwise.
+
+    Args:
+        inputFileName (str): The name of the file we are trying to open.
+        classificationThreshold (float): The threshold for the classification model.
+        classificationChunkSize (int): The size of chunks we are breaking down the original image to.
+        boundBoxChunkSize (int): The size of each side of the bounding box image.
+        batchSize (int): The number of chunks passed to the classification model at once.
+        quantization (str): None for the fp32 classification model, or 'dynamic' or 'static' for an INT8 model.
+        imageArray (numpy array): The image already decoded with loadImageArray, so that it is not decoded again.
+        prescreen (bool): If true, chunks that are obviously empty, such as nodata, water or blank paper, are skipped
+            with iterScreenedTileBatches instead of being classified, and the number skipped is reported.
+        prescreenThresholds (dict): The thresholds of the pre-screen, any left out use their value from tileScreening.prescreenThresholds.
+        counts (dict): If given, its 'tiles', 'skipped', 'classified' and 'positive' are increased by the number of
+            chunks of the image, skipped by the pre-screen, classified, and found to be of interest, and its
+            'decodedPixels' by the number of pixels decoded here.
+        tileMask (numpy array): If given, a boolean array with a value for every row and column of chunks, and only the
+            chunks where it is True are decoded and classified.
+        coarseFactor (int): If given, how many times smaller in both directions the image is classified first, and the
+            number of pixels decoded is reported.
+        coarseThreshold (float): The threshold for the classification model on the chunks of the smaller image.
+        regionOfInterest (str): If given, the path to a vector file, such as a GeoPackage, Shapefile or GeoJSON file of
+            roads, and only the chunks near its features are decoded and classified.
+        clamp (bool): If true, each row and column is moved inside the filtering bounds with clampRowCol, so that the
+            bounding box image centred on it stays inside the image. If false, they are returned where the chunks are.
+    
+    Returns:
+        listOfRowCol (list): A list of row and columns of interest.
+    """
+
+    imageCounts = {"tiles": 0, "skipped": 0, "classified": 0, "positive": 0, "decodedPixels": 0}
+    dataset = None
+    if imageArray is not None:
+        height, width = imageArray.shape[:2]
+    elif inputFileName.endswith(".tif"):
+        dataset = gdal.Open(inputFileName, gdal.GA_ReadOnly)
+        if dataset is None:
+            raise Exception(f"Failed to open {inputFileName}")
+        width, height = dataset.RasterXSize, dataset.RasterYSize
+    else:
+        # Only the header is read, the pixels are decoded below if any chunks are classified
+        with Image.open(inputFileName) as image:
+            width, height = image.size
+
+    if regionOfInterest:
+        regionMask = imageRegionOfInterestMask(inputFileName, regionOfInterest, width, height, classificationChunkSize, dataset)
+        tileMask = regionMask if tileMask is None else tileMask & regionMask
+
+    if coarseFactor and (tileMask is None or tileMask.any()):
+        coarseMask = coarseClassification(inputFileName, width, height, classificationChunkSize, coarseFactor, coarseThreshold, batchSize, quantization, dataset, imageArray, imageCounts)
+        tileMask = coarseMask if tileMask is None else tileMask & coarseMask
+
+    if imageArray is not None:
+        tileBatches = iterTileBatches(imageArray, classificationChunkSize, batchSize, tileMask)
+    elif dataset is not None:
+        tileBatches = iterRasterTileBatches(dataset, classificationChunkSize, batchSize, tileMask=tileMask, counts=imageCounts)
+    elif tileMask is not None and not tileMask.any():
+        tileBatches = []
+    else:
+        imageArray = loadImageArray(inputFileName)
+        imageCounts["decodedPixels"] += width * height
+        tileBatches = iterTileBatches(imageArray, classificationChunkSize, batchSize, tileMask)
+
+    if prescreen:
+        tileBatches = iterScreenedTileBatches(tileBatches, batchSize, prescreenThresholds, imageCounts)
+
+    engine = get_classifier_engine(quantization)
+    filteringBounds = getFilteringBounds(width, height, classificationChunkSize, boundBoxChunkSize)
     listOfRowCol = []
-    # row and col represents the coordinates for the top left point of the new cropped image
-    for row in range(0, height, classificationChunkSize):
-        for col in range(0, width, classificationChunkSize):
-            xDifference = 0
-            yDifference = 0
-            if col + classificationChunkSize > width:
-                xDifference = col + classificationChunkSize - width
-            if row + classificationChunkSize > height:
-                yDifference = row + classificationChunkSize - height
-            box = (col - xDifference, row - yDifference, col - xDifference + classificationChunkSize, row - yDifference + classificationChunkSize)
-            cropped = image.crop(box)
-            containsCrossing = PIL_infer(cropped, threshold=classificationThreshold)
-            if containsCrossing:
-                rowToAdd = row // classificationChunkSize
-                colToAdd = col // classificationChunkSize
-
-                if colToAdd >= upperWidthFilteringBound:
-                    colToAdd = upperWidthFilteringBound
-                elif colToAdd <= lowerFilteringBound:
-                    colToAdd = lowerFilteringBound
-                if rowToAdd >= upperHeightFilteringBound:
-                    rowToAdd = upperHeightFilteringBound
-                elif rowToAdd <= lowerFilteringBound:
-                    rowToAdd = lowerFilteringBound
-                listOfRowCol.append((rowToAdd, colToAdd))
+    # row and col represents the position of each chunk in the grid of chunks
+    for rowCols, chunks in tileBatches:
+        containsCrossing = engine.array_batch_infer(chunks, threshold=classificationThreshold)
+        imageCounts["classified"] += len(rowCols)
+        imageCounts["positive"] += int(np.count_nonzero(containsCrossing))
+        for row, col in rowCols[containsCrossing].tolist():
+            listOfRowCol.append(clampRowCol(row, col, *filteringBounds) if clamp else (row, col))
 
+    if prescreen:
+        tqdm.write(f"{os.path.basename(inputFileName)}: {imageCounts['skipped']} of {imageCounts['tiles']} chunks skipped by the pre-screen, "
+                   f"{imageCounts['positive']} of the {imageCounts['classified']} classified chunks are of interest")
+    if coarseFactor:
+        reportCoarseToFine(inputFileName, width, height, tileMask, imageCounts["decodedPixels"])
+    if counts is not None:
+        for key, value in imageCounts.items():
+            counts[key] = counts.get(key, 0) + value
     return listOfRowCol
 
 
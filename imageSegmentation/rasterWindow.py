@@ -0,0 +1,159 @@
+from osgeo import gdal
+import numpy as np
+import threading
+
+
+class RasterWindow:
+    """
+    A segmented TIF image, kept as a square window of the input raster rather than as a copy of its pixels. It has
+    the parts of a GDAL dataset used after the segmentation, which are GetGeoTransform, GetProjection, RasterXSize,
+    RasterYSize and ReadAsArray, so it is used in the same way as a cropped dataset, but the pixels are only read
+    from the input raster when they are needed, and straight into the array given to ReadAsArray.
+
+    Every window of the same raster shares its dataset, which stays open until the last of them is dropped, a lock,
+    since a GDAL dataset cannot be read from several threads at once, and the buffers used by readIntoBuffer.
+    """
+    def __init__(self, dataset, xOffset, yOffset, size, geoTransform, projection, lock=None, buffers=None):
+        """
+        Args:
+            dataset (gdal.Dataset): The open input raster.
+            xOffset (int): The column of the left edge of the window in the raster, which can be negative.
+            yOffset (int): The row of the top edge of the window in the raster, which can be negative.
+            size (int): The size of each side of the window.
+            geoTransform (tuple): The geotransform of the input raster.
+            projection (str): The WKT projection of the input raster.
+            lock (threading.Lock): The lock shared by every window of the raster, a new one is made if not given.
+            buffers (threading.local): The buffers shared by every window of the raster, new ones are made if not given.
+        """
+        self.dataset = dataset
+        self.xOffset = xOffset
+        self.yOffset = yOffset
+        self.RasterXSize = size
+        self.RasterYSize = size
+        self.RasterCount = dataset.RasterCount
+        # The window starts at its own top left corner, with the same pixel size and rotation as the raster
+        self.geoTransform = (geoTransform[0] + xOffset * geoTransform[1] + yOffset * geoTransform[2], geoTransform[1], geoTransform[2],
+                             geoTransform[3] + xOffset * geoTransform[4] + yOffset * geoTransform[5], geoTransform[4], geoTransform[5])
+        self.projection = projection
+        self.lock = threading.Lock() if lock is None else lock
+        self.buffers = threading.local() if buffers is None else buffers
+
+    def GetGeoTransform(self):
+        return self.geoTransform
+
+    def GetProjection(self):
+        return self.projection
+
+    def ReadAsArray(self, buf_obj=None):
+        """
+        Reads the pixels of the window, with any part of it that is outside of the raster filled with zeros, as
+        gdal.Translate does.
+
+        Args:
+            buf_obj (numpy array): An array to read the pixels into, with the shape (bands, size, size), or (size, size)
+                for a single band, and the data type of the raster. It can be reused for every window of the raster.
+
+        Returns:
+            numpy array: The pixels, in buf_obj if it was given.
+        """
+        width, height = self.dataset.RasterXSize, self.dataset.RasterYSize
+        left, top = max(self.xOffset, 0), max(self.yOffset, 0)
+        right, bottom = min(self.xOffset + self.RasterXSize, width), min(self.yOffset + self.RasterYSize, height)
+        inside = left == self.xOffset and top == self.yOffset and right - left == self.RasterXSize and bottom - top == self.RasterYSize
+
+        with self.lock:
+            if inside:
+                return self.dataset.ReadAsArray(self.xOffset, self.yOffset, self.RasterXSize, self.RasterYSize, buf_obj=buf_obj)
+            part = self.dataset.ReadAsArray(left, top, right - left, bottom - top)
+        if buf_obj is None:
+            buf_obj = np.zeros(part.shape[:-2] + (self.RasterYSize, self.RasterXSize), dtype=part.dtype)
+        else:
+            buf_obj[...] = 0
+        buf_obj[..., top - self.yOffset:bottom - self.yOffset, left - self.xOffset:right - self.xOffset] = part
+        return buf_obj
+
+    def readIntoBuffer(self):
+        """
+        Reads the pixels of the window into a buffer shared by every window of the same size of the raster read on the
+        same thread, so only the first read of each size allocates an array. The pixels are overwritten by the next
+        read of the same size on the thread, so they must be copied or used before then.
+
+        Returns:
+            numpy array: The pixels, with the shape (bands, size, size), or (size, size) for a single band.
+        """
+        if not hasattr(self.buffers, "bySize"):
+            self.buffers.bySize = {}
+        # A buffer of another shape would be resampled into by GDAL, so windows of each size have their own
+        shape = (self.RasterYSize, self.RasterXSize) if self.RasterCount == 1 else (self.RasterCount, self.RasterYSize, self.RasterXSize)
+        buffer = self.buffers.bySize.get(shape)
+        buffer = self.ReadAsArray(buf_obj=buffer)
+        self.buffers.bySize[shape] = buffer
+        return buffer
+
+    def __repr__(self):
+        return f"RasterWindow({self.dataset.GetDescription()}, {self.xOffset}, {self.yOffset}, {self.RasterXSize})"
+
+
+class DownsampledRaster:
+    """
+    A GDAL raster read at a lower resolution, factor times smaller in both directions, rounded down. It has the parts
+    of a GDAL dataset used by iterRasterTileBatches, and each read asks GDAL for a window of the full raster in a
+    smaller buffer. GDAL reads such a window from the raster's internal overviews when it has them, so only the
+    overview is decoded rather than every full resolution block under the window. Each pixel of the buffer is the
+    average of the pixels under it, as it is for loadReducedImageArray and reduceArray, rather than a single one of
+    them, so that thin features like the stripes of a crossing are not dropped from rasters without overviews.
+    """
+    def __init__(self, dataset, factor):
+        """
+        Args:
+            dataset (gdal.Dataset): The open input raster.
+            factor (int): How many times smaller the raster is read in both directions.
+        """
+        self.dataset = dataset
+        self.factor = factor
+        self.RasterXSize = max(1, dataset.RasterXSize // factor)
+        self.RasterYSize = max(1, dataset.RasterYSize // factor)
+        self.RasterCount = dataset.RasterCount
+        # GDAL reads from the smallest overview which still has at least as many pixels as the buffer
+        band = dataset.GetRasterBand(1)
+        self.source = band
+        for i in range(band.GetOverviewCount()):
+            overview = band.GetOverview(i)
+            if self.RasterXSize <= overview.XSize < self.source.XSize and overview.YSize >= self.RasterYSize:
+                self.source = overview
+        # The number of pixels decoded by the reads so far, at the resolution of the overview they came from
+        self.decodedPixels = 0
+
+    def GetRasterBand(self, index):
+        return self
+
+    def GetBlockSize(self):
+        """The block size of the overview that is read, in pixels of the downsampled raster"""
+        blockWidth, blockHeight = self.source.GetBlockSize()
+        return (max(1, blockWidth * self.RasterXSize // self.source.XSize),
+                max(1, blockHeight * self.RasterYSize // self.source.YSize))
+
+    def ReadAsArray(self, xoff=0, yoff=0, xsize=None, ysize=None):
+        """
+        Reads a window of the downsampled raster.
+
+        Args:
+            xoff (int): The column of the left edge of the window, in pixels of the downsampled raster.
+            yoff (int): The row of the top edge of the window.
+            xsize (int): The width of the window, the whole width if not given.
+            ysize (int): The height of the window, the whole height if not given.
+
+        Returns:
+            numpy array: The pixels, with the shape (bands, ysize, xsize), or (ysize, xsize) for a single band.
+        """
+        xsize = self.RasterXSize if xsize is None else xsize
+        ysize = self.RasterYSize if ysize is None else ysize
+        width, height = self.dataset.RasterXSize, self.dataset.RasterYSize
+        fullXSize = min(xsize * self.factor, width - xoff * self.factor)
+        fullYSize = min(ysize * self.factor, height - yoff * self.factor)
+        self.decodedPixels += round(fullXSize * fullYSize * self.source.XSize * self.source.YSize / (width * height))
+        return self.dataset.ReadAsArray(xoff * self.factor, yoff * self.factor, fullXSize, fullYSize, buf_xsize=xsize, buf_ysize=ysize,
+                                        resample_alg=gdal.GRIORA_Average)
+
+    def __repr__(self):
+        return f"DownsampledRaster({self.dataset.GetDescription()}, {self.factor})"
@@ -0,0 +1,138 @@
+from osgeo import gdal, ogr, osr
+from tqdm import tqdm
+import math
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from georeference.georeference import readJGWGeotransform, jgwEPSG
+from imageSegmentation.tiling import cellsToTileMask
+
+# How far around each road the region of interest reaches, in metres, so that crossings at the side of the road and
+# roads drawn as centrelines are still inside it
+regionOfInterestBuffer = 20.0
+# The number of metres in a degree of latitude, used to buffer roads around images in a geographic CRS
+metresPerDegree = 111320.0
+
+
+def spatialReference(crs):
+    """
+    Makes a spatial reference which keeps coordinates in (x, y) order, as they are in the vector files and geotransforms.
+
+    Args:
+        crs (int or str): The EPSG code or the WKT of the coordinate reference system.
+
+    Returns:
+        osr.SpatialReference: The spatial reference.
+    """
+    reference = osr.SpatialReference()
+    if isinstance(crs, int):
+        reference.ImportFromEPSG(crs)
+    else:
+        reference.ImportFromWkt(crs)
+    reference.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    return reference
+
+
+def regionOfInterestMask(vectorPath, geotransform, crs, width, height, classificationChunkSize, bufferDistance=regionOfInterestBuffer):
+    """
+    Finds the chunks of an image which are near any of the features of a vector file, such as a road network. Only the
+    features around the image are read, through the layer's spatial index where it has one. They are reprojected to the
+    image's CRS, buffered by bufferDistance, and burned with GDAL into a grid of one pixel per chunk with ALL_TOUCHED,
+    so that a chunk is in the mask if any part of it touches a buffered feature.
+
+    Args:
+        vectorPath (str): The path to a vector file OGR can open, such as a GeoPackage, Shapefile or GeoJSON file.
+        geotransform (tuple): The GDAL style geotransform of the image.
+        crs (int or str): The EPSG code or the WKT of the image's CRS.
+        width (int): The width of the image.
+        height (int): The height of the image.
+        classificationChunkSize (int): The size of each side of a chunk.
+        bufferDistance (float): How far around each feature the region reaches, in metres.
+
+    Returns:
+        tileMask (numpy array): A boolean array with a value for every row and column of chunks, which is True for the
+            chunks near any feature.
+    """
+    vectorDataset = ogr.Open(vectorPath)
+    if vectorDataset is None:
+        raise Exception(f"Failed to open {vectorPath}")
+    imageReference = spatialReference(crs)
+    if imageReference.IsGeographic():
+        bufferDistance /= metresPerDegree
+
+    cols = max(1, math.ceil(width / classificationChunkSize))
+    rows = max(1, math.ceil(height / classificationChunkSize))
+    # Each pixel of the grid covers one chunk, starting at the top left corner of the image
+    grid = gdal.GetDriverByName("MEM").Create("", cols, rows, 1, gdal.GDT_Byte)
+    grid.SetGeoTransform((geotransform[0], geotransform[1] * classificationChunkSize, geotransform[2] * classificationChunkSize,
+                          geotransform[3], geotransform[4] * classificationChunkSize, geotransform[5] * classificationChunkSize))
+    grid.SetProjection(imageReference.ExportToWkt())
+
+    # The outline of the grid, widened by the buffer, which limits the features read
+    extent = ogr.Geometry(ogr.wkbLinearRing)
+    for x, y in [(0, 0), (cols, 0), (cols, rows), (0, rows), (0, 0)]:
+        x, y = x * classificationChunkSize, y * classificationChunkSize
+        extent.AddPoint_2D(geotransform[0] + x * geotransform[1] + y * geotransform[2], geotransform[3] + x * geotransform[4] + y * geotransform[5])
+    imageExtent = ogr.Geometry(ogr.wkbPolygon)
+    imageExtent.AddGeometry(extent)
+    imageExtent = imageExtent.Buffer(bufferDistance)
+
+    buffered = ogr.GetDriverByName("Memory").CreateDataSource("")
+    bufferedLayer = buffered.CreateLayer("regionOfInterest", imageReference, ogr.wkbUnknown)
+    for layerIndex in range(vectorDataset.GetLayerCount()):
+        layer = vectorDataset.GetLayerByIndex(layerIndex)
+        layerReference = layer.GetSpatialRef()
+        toImage = None
+        layerExtent = imageExtent.Clone()
+        if layerReference is not None and not layerReference.IsSame(imageReference):
+            layerReference = layerReference.Clone()
+            layerReference.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+            toImage = osr.CoordinateTransformation(layerReference, imageReference)
+            layerExtent.Transform(osr.CoordinateTransformation(imageReference, layerReference))
+        layer.SetSpatialFilter(layerExtent)
+        for feature in layer:
+            geometry = feature.GetGeometryRef()
+            if geometry is None or geometry.IsEmpty():
+                continue
+            geometry = geometry.Clone()
+            if toImage is not None:
+                geometry.Transform(toImage)
+            bufferedFeature = ogr.Feature(bufferedLayer.GetLayerDefn())
+            bufferedFeature.SetGeometry(geometry.Buffer(bufferDistance))
+            bufferedLayer.CreateFeature(bufferedFeature)
+        layer.SetSpatialFilter(None)
+
+    gdal.RasterizeLayer(grid, [1], bufferedLayer, burn_values=[1], options=["ALL_TOUCHED=TRUE"])
+    return cellsToTileMask(grid.ReadAsArray() > 0, width, height, classificationChunkSize)
+
+
+def imageRegionOfInterestMask(inputFileName, vectorPath, width, height, classificationChunkSize, dataset=None):
+    """
+    Finds the chunks of an input image inside the region of interest with regionOfInterestMask, and reports how many
+    of them there are. A .tif image is georeferenced by its own geotransform and projection, and any other image by
+    its .jgw file in British National Grid.
+
+    Args:
+        inputFileName (str): The path to the image.
+        vectorPath (str): The path to the vector file of the region of interest.
+        width (int): The width of the image.
+        height (int): The height of the image.
+        classificationChunkSize (int): The size of each side of a chunk.
+        dataset (gdal.Dataset): The open .tif image, it is opened here if not given.
+
+    Returns:
+        tileMask (numpy array): A boolean array with a value for every row and column of chunks, which is True for the
+            chunks inside the region of interest.
+    """
+    if inputFileName.endswith(".tif"):
+        if dataset is None:
+            dataset = gdal.Open(inputFileName, gdal.GA_ReadOnly)
+            if dataset is None:
+                raise Exception(f"Failed to open {inputFileName}")
+        geotransform, crs = dataset.GetGeoTransform(), dataset.GetProjection()
+    else:
+        geotransform, crs = readJGWGeotransform(os.path.splitext(inputFileName)[0] + ".jgw"), jgwEPSG
+    tileMask = regionOfInterestMask(vectorPath, geotransform, crs, width, height, classificationChunkSize)
+    tqdm.write(f"{os.path.basename(inputFileName)}: {int(tileMask.sum())} of {tileMask.size} chunks inside the region of interest")
+    return tileMask
@@ -0,0 +1,92 @@
+import numpy as np
+
+# The default thresholds of screenTiles, they are loose enough that only tiles with nothing in them are skipped
+prescreenThresholds = {
+    # Tiles whose brightness varies less than this, such as solid water or blank paper, are skipped
+    "minStd": 2.0,
+    # Tiles with fewer edges than this share of their pixels, such as the inside of a field, are skipped
+    "minEdgeDensity": 0.002,
+    # Tiles with more nodata pixels than this share of their pixels, such as the border of a sheet, are skipped
+    "maxNodataFraction": 0.99,
+    # The difference in brightness between two neighbouring pixels which counts as an edge
+    "edgeThreshold": 16,
+}
+
+
+def tileStatistics(tiles, edgeThreshold=16):
+    """
+    Calculates cheap statistics of every tile of a batch at once, which are enough to tell that a tile is empty without
+    running the classification model on it.
+
+    Args:
+        tiles (numpy array): The tiles in uint8, with the shape (batch, channels, chunkSize, chunkSize).
+        edgeThreshold (int): The difference in brightness between two neighbouring pixels which counts as an edge.
+
+    Returns:
+        tuple: The standard deviation of the brightness, the share of pixels with an edge to the right or below, and the
+            share of nodata pixels, which are black or white in every channel, of each tile, each with the shape (batch,).
+    """
+    grey = tiles.mean(axis=1, dtype=np.float32)
+    std = grey.std(axis=(1, 2))
+    edgesX = np.count_nonzero(np.abs(np.diff(grey, axis=2)) > edgeThreshold, axis=(1, 2))
+    edgesY = np.count_nonzero(np.abs(np.diff(grey, axis=1)) > edgeThreshold, axis=(1, 2))
+    edgeDensity = (edgesX + edgesY) / (2 * grey.shape[1] * grey.shape[2])
+    nodata = np.all(tiles == 0, axis=1) | np.all(tiles == 255, axis=1)
+    nodataFraction = nodata.mean(axis=(1, 2))
+    return std, edgeDensity, nodataFraction
+
+
+def screenTiles(tiles, minStd=2.0, minEdgeDensity=0.002, maxNodataFraction=0.99, edgeThreshold=16):
+    """
+    Finds the tiles of a batch which are worth classifying. A tile is skipped if it is almost all nodata, if it is
+    almost the same brightness everywhere, or if it has almost no edges, since a crossing has strong stripes.
+
+    Args:
+        tiles (numpy array): The tiles in uint8, with the shape (batch, channels, chunkSize, chunkSize).
+        minStd (float): Tiles with a lower standard deviation of their brightness are skipped.
+        minEdgeDensity (float): Tiles with a lower share of edge pixels are skipped.
+        maxNodataFraction (float): Tiles with a higher share of nodata pixels are skipped.
+        edgeThreshold (int): The difference in brightness between two neighbouring pixels which counts as an edge.
+
+    Returns:
+        numpy array: A boolean array which is True for every tile that should be classified.
+    """
+    std, edgeDensity, nodataFraction = tileStatistics(tiles, edgeThreshold)
+    return (std >= minStd) & (edgeDensity >= minEdgeDensity) & (nodataFraction <= maxNodataFraction)
+
+
+def iterScreenedTileBatches(tileBatches, batchSize, thresholds=None, counts=None):
+    """
+    Removes the tiles that screenTiles skips from batches of tiles, and joins the tiles that are left back into full
+    batches of batchSize, so that the classification model still gets full batches.
+
+    Args:
+        tileBatches (iterable): The (rowCols, tiles) batches from iterTileBatches or iterRasterTileBatches.
+        batchSize (int): The maximum number of tiles in each batch.
+        thresholds (dict): The thresholds of screenTiles, any left out use their value from prescreenThresholds.
+        counts (dict): If given, its 'tiles' and 'skipped' are increased by the number of tiles screened and skipped.
+
+    Yields:
+        (rowCols, tiles): The row and column, and the pixels, of the tiles which are worth classifying.
+    """
+    thresholds = {**prescreenThresholds, **(thresholds or {})}
+    if counts is not None:
+        counts.setdefault("tiles", 0)
+        counts.setdefault("skipped", 0)
+    pendingRowCols, pendingTiles, pendingCount = [], [], 0
+    for rowCols, tiles in tileBatches:
+        isKept = screenTiles(tiles, **thresholds)
+        if counts is not None:
+            counts["tiles"] += len(isKept)
+            counts["skipped"] += len(isKept) - int(np.count_nonzero(isKept))
+        if not isKept.any():
+            continue
+        pendingRowCols.append(rowCols[isKept])
+        pendingTiles.append(tiles[isKept])
+        pendingCount += len(pendingRowCols[-1])
+        while pendingCount >= batchSize:
+            rowCols, tiles = np.concatenate(pendingRowCols), np.concatenate(pendingTiles)
+            yield rowCols[:batchSize], tiles[:batchSize]
+            pendingRowCols, pendingTiles, pendingCount = [rowCols[batchSize:]], [tiles[batchSize:]], len(rowCols) - batchSize
+    if pendingCount:
+        yield np.concatenate(pendingRowCols), np.concatenate(pendingTiles)
@@ -0,0 +1,345 @@
+from PIL import Image
+import numpy as np
+
+
+def loadImageArray(inputFileName):
+    """
+    Decodes an image a single time into a uint8 numpy array with three channels, so that every tile can be read
+    from it without creating any more PIL objects.
+
+    Args:
+        inputFileName (str): The name of the file we are trying to open.
+
+    Returns:
+        imageArray (numpy array): The decoded image, with the shape (height, width, 3).
+    """
+    with Image.open(inputFileName) as image:
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        return np.asarray(image, dtype=np.uint8)
+
+
+def loadReducedImageArray(inputFileName, factor):
+    """
+    Decodes an image at a lower resolution, into a uint8 numpy array with three channels which is factor times smaller
+    in both directions, rounded down. JPEG images are decoded straight at a lower resolution with PIL's draft, which
+    skips most of the work of decoding them, other images are decoded in full and then reduced.
+
+    Args:
+        inputFileName (str): The name of the file we are trying to open.
+        factor (int): How many times smaller the image is in both directions.
+
+    Returns:
+        tuple: The reduced image, with the shape (height // factor, width // factor, 3), and the number of pixels decoded to make it.
+    """
+    with Image.open(inputFileName) as image:
+        width, height = image.size
+        reducedWidth, reducedHeight = max(1, width // factor), max(1, height // factor)
+        # Only does anything for JPEG images, where it picks the smallest scale at least as large as the reduced image
+        image.draft("RGB", (reducedWidth, reducedHeight))
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        decodedPixels = image.width * image.height
+        # The box leaves out the last few pixels which do not make up a whole reduced pixel
+        scaleX, scaleY = image.width / width, image.height / height
+        box = (0, 0, reducedWidth * factor * scaleX, reducedHeight * factor * scaleY)
+        image = image.resize((reducedWidth, reducedHeight), Image.BILINEAR, box=box)
+        return np.asarray(image, dtype=np.uint8), decodedPixels
+
+
+def reduceArray(imageArray, factor):
+    """
+    Shrinks a decoded image factor times in both directions, rounded down, by averaging each factor by factor block of
+    pixels.
+
+    Args:
+        imageArray (numpy array): The image, with the shape (height, width, channels).
+        factor (int): How many times smaller the image is made in both directions.
+
+    Returns:
+        imageArray (numpy array): The reduced image in uint8, with the shape (height // factor, width // factor, channels).
+    """
+    height, width = imageArray.shape[:2]
+    reducedHeight, reducedWidth = max(1, height // factor), max(1, width // factor)
+    if height < factor or width < factor:
+        return np.asarray(Image.fromarray(np.ascontiguousarray(imageArray)).resize((reducedWidth, reducedHeight), Image.BILINEAR), dtype=np.uint8)
+    # Splitting both axes in two is a view, so only the reduced image is allocated
+    blocks = imageArray[:reducedHeight * factor, :reducedWidth * factor].reshape(reducedHeight, factor, reducedWidth, factor, -1)
+    return np.round(blocks.mean(axis=(1, 3), dtype=np.float32)).astype(np.uint8)
+
+
+def cropArray(imageArray, left, top, size):
+    """
+    Crops a square from a decoded image in the same way as cropping it with PIL, where any part of the box that is
+    outside of the image is filled with zeros.
+
+    Args:
+        imageArray (numpy array): The image, with the shape (height, width, channels).
+        left (int): The column of the left edge of the box.
+        top (int): The row of the top edge of the box.
+        size (int): The size of each side of the box.
+
+    Returns:
+        image (PIL image): The cropped image.
+    """
+    height, width = imageArray.shape[:2]
+    if left >= 0 and top >= 0 and left + size <= width and top + size <= height:
+        return Image.fromarray(np.ascontiguousarray(imageArray[top:top + size, left:left + size]))
+    crop = np.zeros((size, size) + imageArray.shape[2:], dtype=imageArray.dtype)
+    cropTop, cropLeft = max(top, 0), max(left, 0)
+    cropBottom, cropRight = min(top + size, height), min(left + size, width)
+    if cropBottom > cropTop and cropRight > cropLeft:
+        crop[cropTop - top:cropBottom - top, cropLeft - left:cropRight - left] = imageArray[cropTop:cropBottom, cropLeft:cropRight]
+    return Image.fromarray(crop)
+
+
+def tileOrigins(length, chunkSize):
+    """
+    Calculates the pixel where each tile starts along one side of an image. Tiles are placed every chunkSize
+    pixels, and the last tile is shifted back so that it ends on the edge of the image, in the same way as the
+    xDifference and yDifference were used when cropping with PIL.
+
+    Args:
+        length (int): The width or height of the image.
+        chunkSize (int): The size of each side of a tile.
+
+    Returns:
+        origins (numpy array): The starting pixel of each tile.
+    """
+    origins = np.arange(0, length, chunkSize)
+    return np.minimum(origins, length - chunkSize)
+
+
+def tileExtents(length, chunkSize):
+    """
+    Calculates the first and last pixel covered by each tile along one side of an image, where an image smaller than
+    a tile is padded on its top and left sides, so its only tile starts before the image.
+
+    Args:
+        length (int): The width or height of the image.
+        chunkSize (int): The size of each side of a tile.
+
+    Returns:
+        tuple: The first pixel of each tile, and the pixel after the last one.
+    """
+    starts = tileOrigins(max(length, chunkSize), chunkSize) - max(chunkSize - length, 0)
+    return starts, starts + chunkSize
+
+
+def cellsToTileMask(cells, width, height, chunkSize):
+    """
+    Turns a mask of a regular grid of chunkSize cells, starting at the top left corner of an image, into a mask of its
+    tiles. Every tile lines up with a cell except the shifted last row and column, which straddle two cells, so they
+    are True if either of the cells is.
+
+    Args:
+        cells (numpy array): A boolean array with a value for every chunkSize by chunkSize cell of the image, rounded up.
+        width (int): The width of the image.
+        height (int): The height of the image.
+        chunkSize (int): The size of each side of a tile and of a cell.
+
+    Returns:
+        tileMask (numpy array): A boolean array with a value for every row and column of tiles.
+    """
+    def overlaps(length, numOfCells):
+        starts, ends = tileExtents(length, chunkSize)
+        firstCells = np.clip(np.maximum(starts, 0) // chunkSize, 0, numOfCells - 1)
+        lastCells = np.clip((ends - 1) // chunkSize, 0, numOfCells - 1)
+        cellIndices = np.arange(numOfCells)
+        return ((cellIndices >= firstCells[:, np.newaxis]) & (cellIndices <= lastCells[:, np.newaxis])).astype(np.int32)
+
+    rowOverlaps, colOverlaps = overlaps(height, cells.shape[0]), overlaps(width, cells.shape[1])
+    return (rowOverlaps @ cells.astype(np.int32) @ colOverlaps.T) > 0
+
+
+def padToChunk(imageArray, chunkSize):
+    """
+    Pads an image which is smaller than a single tile on its top and left sides with zeros, which is what PIL did
+    when cropping a box that starts before the edge of the image. Images which are already large enough are
+    returned without copying.
+
+    Args:
+        imageArray (numpy array): The image, with the shape (height, width, channels).
+        chunkSize (int): The size of each side of a tile.
+
+    Returns:
+        imageArray (numpy array): The image, at least chunkSize pixels in both directions.
+    """
+    height, width = imageArray.shape[:2]
+    padY = max(chunkSize - height, 0)
+    padX = max(chunkSize - width, 0)
+    if padX == 0 and padY == 0:
+        return imageArray
+    return np.pad(imageArray, ((padY, 0), (padX, 0), (0, 0)))
+
+
+def tileView(imageArray, chunkSize):
+    """
+    Exposes every chunkSize by chunkSize window of the image as a strided view, without copying any pixels.
+    Indexing the view with the tile origins gives the tiles in the channel first layout used by the models.
+
+    Args:
+        imageArray (numpy array): The image, with the shape (height, width, channels), at least chunkSize in both directions.
+        chunkSize (int): The size of each side of a tile.
+
+    Returns:
+        windows (numpy array): A view with the shape (height - chunkSize + 1, width - chunkSize + 1, channels, chunkSize, chunkSize).
+    """
+    return np.lib.stride_tricks.sliding_window_view(imageArray, (chunkSize, chunkSize), axis=(0, 1))
+
+
+def iterTileBatches(imageArray, chunkSize, batchSize, tileMask=None):
+    """
+    Splits the image into tiles, including the shifted last row and column, and yields them in batches. Only the
+    tiles of the current batch are copied out of the image, straight into one contiguous array.
+
+    Args:
+        imageArray (numpy array): The image, with the shape (height, width, channels).
+        chunkSize (int): The size of each side of a tile.
+        batchSize (int): The maximum number of tiles in each batch.
+        tileMask (numpy array): If given, a boolean array with a value for every row and column of tiles, and only the
+            tiles where it is True are yielded.
+
+    Yields:
+        (rowCols, tiles):
+            rowCols (numpy array): The row and column of each tile in the batch, with the shape (batch, 2).
+            tiles (numpy array): The tiles in uint8, with the shape (batch, channels, chunkSize, chunkSize).
+    """
+    height, width = imageArray.shape[:2]
+    windows = tileView(padToChunk(imageArray, chunkSize), chunkSize)
+    rowOrigins = tileOrigins(max(height, chunkSize), chunkSize)
+    colOrigins = tileOrigins(max(width, chunkSize), chunkSize)
+
+    rows, cols = np.meshgrid(np.arange(len(rowOrigins)), np.arange(len(colOrigins)), indexing="ij")
+    rowCols = np.stack([rows.ravel(), cols.ravel()], axis=1)
+    if tileMask is not None:
+        rowCols = rowCols[tileMask[rowCols[:, 0], rowCols[:, 1]]]
+    for start in range(0, len(rowCols), batchSize):
+        batchRowCols = rowCols[start:start + batchSize]
+        tiles = windows[rowOrigins[batchRowCols[:, 0]], colOrigins[batchRowCols[:, 1]]]
+        yield batchRowCols, tiles
+
+
+def rasterToRGB(bands):
+    """
+    Turns the bands read from a raster into a three channel uint8 image. Single band rasters are repeated into all
+    three channels, and any bands after the third, such as alpha, are dropped. Only 8 bit rasters are accepted, since
+    the classification model is trained on 8 bit images, and the values of any other type would have to be scaled
+    to them in a way that depends on the sensor.
+
+    Args:
+        bands (numpy array): The raster, with the shape (bands, height, width), or (height, width) for a single band.
+
+    Returns:
+        imageArray (numpy array): The image, with the shape (height, width, 3), as a view of bands when possible.
+
+    Raises:
+        ValueError: If the raster is not 8 bit.
+    """
+    if bands.dtype != np.uint8:
+        raise ValueError(f"Expected an 8 bit raster, but its pixels are {bands.dtype}")
+    if bands.ndim == 2:
+        bands = bands[np.newaxis]
+    if len(bands) < 3:
+        bands = np.repeat(bands[:1], 3, axis=0)
+    return np.moveaxis(bands[:3], 0, -1)
+
+
+def rasterWindowSpans(numOfTiles, chunkSize, blockSize, maxTiles):
+    """
+    Splits the tiles along one side of a raster into consecutive spans which are each read in a single window. Each
+    span starts on a multiple of the raster's block size when the blocks line up with the tiles, so that every block
+    is only decoded by one window.
+
+    Args:
+        numOfTiles (int): The number of tiles along the side of the raster.
+        chunkSize (int): The size of each side of a tile.
+        blockSize (int): The size of the raster's internal blocks along the side.
+        maxTiles (int): The largest number of tiles in a span.
+
+    Returns:
+        spans (list): The first tile and the tile after the last one of each span.
+    """
+    tilesPerBlock = max(1, blockSize // chunkSize)
+    if tilesPerBlock <= maxTiles:
+        # Whole blocks per window, so no block is split between two windows
+        maxTiles -= maxTiles % tilesPerBlock
+    maxTiles = max(1, maxTiles)
+    return [(start, min(start + maxTiles, numOfTiles)) for start in range(0, numOfTiles, maxTiles)]
+
+
+def iterRasterTileBatches(dataset, chunkSize, batchSize, maxWindowPixels=4096 * 4096, tileMask=None, counts=None):
+    """
+    Splits a GDAL raster into tiles like iterTileBatches, without ever decoding the whole raster. The raster is read
+    in windows of at most maxWindowPixels pixels, which follow its internal tiling from GetBlockSize, and the tiles
+    are cut from each window in turn. The memory used stays the same no matter how large the raster is.
+
+    With a tileMask, each window is shrunk to the tiles in it which are True, and windows without any are not read
+    at all, so the parts of the raster without any of those tiles are never decoded.
+
+    Args:
+        dataset (gdal.Dataset): The open raster.
+        chunkSize (int): The size of each side of a tile.
+        batchSize (int): The maximum number of tiles in each batch.
+        maxWindowPixels (int): The largest number of pixels read at once.
+        tileMask (numpy array): If given, a boolean array with a value for every row and column of tiles, and only the
+            tiles where it is True are read and yielded.
+        counts (dict): If given, its 'decodedPixels' is increased by the number of pixels read from the raster.
+
+    Yields:
+        (rowCols, tiles):
+            rowCols (numpy array): The row and column of each tile in the batch, with the shape (batch, 2).
+            tiles (numpy array): The tiles in uint8, with the shape (batch, channels, chunkSize, chunkSize).
+    """
+    width, height = dataset.RasterXSize, dataset.RasterYSize
+    if counts is not None:
+        counts.setdefault("decodedPixels", 0)
+    if tileMask is not None and not tileMask.any():
+        return
+    if width <= chunkSize or height <= chunkSize:
+        # Smaller than a tile in one direction, so it is padded like a decoded image
+        if counts is not None:
+            counts["decodedPixels"] += width * height
+        yield from iterTileBatches(rasterToRGB(dataset.ReadAsArray()), chunkSize, batchSize, tileMask)
+        return
+
+    rowOrigins = tileOrigins(height, chunkSize)
+    colOrigins = tileOrigins(width, chunkSize)
+    blockWidth, blockHeight = dataset.GetRasterBand(1).GetBlockSize()
+    # Full width strips when they fit, otherwise the columns are split into windows as well
+    maxTiles = max(1, maxWindowPixels // (chunkSize * chunkSize))
+    colSpans = rasterWindowSpans(len(colOrigins), chunkSize, blockWidth, maxTiles)
+    maxTilesPerColumn = max(1, maxTiles // max(end - start for start, end in colSpans))
+    rowSpans = rasterWindowSpans(len(rowOrigins), chunkSize, blockHeight, maxTilesPerColumn)
+
+    pendingRowCols, pendingTiles, pendingCount = [], [], 0
+    for spanRowStart, spanRowEnd in rowSpans:
+        for spanColStart, spanColEnd in colSpans:
+            rowStart, rowEnd, colStart, colEnd = spanRowStart, spanRowEnd, spanColStart, spanColEnd
+            windowMask = None
+            if tileMask is not None:
+                windowMask = tileMask[rowStart:rowEnd, colStart:colEnd]
+                rows, cols = np.flatnonzero(windowMask.any(axis=1)), np.flatnonzero(windowMask.any(axis=0))
+                if len(rows) == 0:
+                    continue
+                # Only the tiles from the first to the last one which is True are read
+                windowMask = windowMask[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+                rowStart, rowEnd = spanRowStart + rows[0], spanRowStart + rows[-1] + 1
+                colStart, colEnd = spanColStart + cols[0], spanColStart + cols[-1] + 1
+            top, bottom = rowOrigins[rowStart], rowOrigins[rowEnd - 1] + chunkSize
+            left, right = colOrigins[colStart], colOrigins[colEnd - 1] + chunkSize
+            window = rasterToRGB(dataset.ReadAsArray(int(left), int(top), int(right - left), int(bottom - top)))
+            if counts is not None:
+                counts["decodedPixels"] += int((right - left) * (bottom - top))
+            # The last tile of a window at the edge is shifted back inside it, in the same way as in the whole raster
+            for rowCols, tiles in iterTileBatches(window, chunkSize, batchSize, windowMask):
+                # The tiles are copies, so the window is freed once its tiles are taken
+                pendingRowCols.append(rowCols + (rowStart, colStart))
+                pendingTiles.append(tiles)
+                pendingCount += len(rowCols)
+                while pendingCount >= batchSize:
+                    rowCols, tiles = np.concatenate(pendingRowCols), np.concatenate(pendingTiles)
+                    yield rowCols[:batchSize], tiles[:batchSize]
+                    pendingRowCols, pendingTiles, pendingCount = [rowCols[batchSize:]], [tiles[batchSize:]], len(rowCols) - batchSize
+    if pendingCount:
+        yield np.concatenate(pendingRowCols), np.concatenate(pendingTiles)
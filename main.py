@@ -1,9 +1,8 @@
-from imageSegmentation.boundBoxSegmentation import boundBoxSegmentationJGW, boundBoxSegmentationTIF
-from orientedBoundingBox.predictOBB import predictionJGW, predictionTIF
 from utils.extract import extractFiles
 from utils.saveToOutput import saveToOutput
 from datetime import datetime
 from PIL import Image
+import functools
 import os
 import time
 import sys
@@ -15,6 +14,7 @@ Image.MAX_IMAGE_PIXELS = None
 
 boundBoxChunkSize = 1024
 classificationChunkSize = 256
+detectionBatchSize = 8
 
 
 def create_dir(run_dir):
@@ -31,16 +31,27 @@ def create_dir(run_dir):
 
 
 
-def execute(uploadDir = "input", inputType = "0", classificationThreshold = 0.35, predictionThreshold = 0.5, saveLabeledImage = False, outputType = "0", yoloModelType = "m"):
+def execute(uploadDir = "input", inputType = "0", classificationThreshold = 0.35, predictionThreshold = 0.5, saveLabeledImage = False, outputType = "0", yoloModelType = "m", classificationQuantization = None, yoloBackend = "torch", dedupeSpace = "latlong", pipelined = False, pipelineWorkers = None, segmentationProcesses = None, windowPlanning = "centred", classificationPrescreen = False, classificationCoarseFactor = None, classificationRegionOfInterest = None):
+    # torch, ultralytics and GDAL are only imported once a job runs, so that importing main stays fast
+    from imageSegmentation.boundBoxSegmentation import boundBoxSegmentationJGW, boundBoxSegmentationTIF, segmentImageJGW, segmentImageTIF, listInputImages, jgwImageExtensions, tifImageExtensions
+    from orientedBoundingBox.predictOBB import predictionJGW, predictionTIF, pipelinedPrediction
+    # Adaptive windows have different sizes, which the prediction batches and runs at their own image size
+    adaptiveCrops = windowPlanning == "adaptive"
+
     if inputType == "0":
         start_time = time.time()
         outputFolder = create_dir("run/output")
         extractDir = create_dir("run/extract")
         # Extract files if needed
         extractFiles(inputType, uploadDir, extractDir)
-        # Run segmentation and prediction
-        croppedImagesAndData = boundBoxSegmentationJGW(classificationThreshold, extractDir, boundBoxChunkSize, classificationChunkSize)
-        imageDetections = predictionJGW(imageAndDatas=croppedImagesAndData, predictionThreshold=predictionThreshold, saveLabeledImage=saveLabeledImage, outputFolder=outputFolder, modelType=yoloModelType)
+        if pipelined:
+            # Run segmentation and prediction at the same time, on different images
+            segmentImage = functools.partial(segmentImageJGW, classificationThreshold=classificationThreshold, extractDir=extractDir, boundBoxChunkSize=boundBoxChunkSize, classificationChunkSize=classificationChunkSize, classificationQuantization=classificationQuantization, windowPlanning=windowPlanning, classificationPrescreen=classificationPrescreen, classificationCoarseFactor=classificationCoarseFactor, classificationRegionOfInterest=classificationRegionOfInterest)
+            imageDetections = pipelinedPrediction(inputFileNames=listInputImages(extractDir, jgwImageExtensions), segmentImage=segmentImage, inputType=inputType, predictionThreshold=predictionThreshold, saveLabeledImage=saveLabeledImage, outputFolder=outputFolder, modelType=yoloModelType, backend=yoloBackend, batchSize=detectionBatchSize, returnDetectionSet=True, dedupeSpace=dedupeSpace, workers=pipelineWorkers, adaptiveCrops=adaptiveCrops)
+        else:
+            # Run segmentation and prediction, the segmented images are streamed into the prediction as they are made
+            croppedImagesAndData = boundBoxSegmentationJGW(classificationThreshold, extractDir, boundBoxChunkSize, classificationChunkSize, classificationQuantization, stream=True, processes=segmentationProcesses, windowPlanning=windowPlanning, classificationPrescreen=classificationPrescreen, classificationCoarseFactor=classificationCoarseFactor, classificationRegionOfInterest=classificationRegionOfInterest)
+            imageDetections = predictionJGW(imageAndDatas=croppedImagesAndData, predictionThreshold=predictionThreshold, saveLabeledImage=saveLabeledImage, outputFolder=outputFolder, modelType=yoloModelType, backend=yoloBackend, batchSize=detectionBatchSize, returnDetectionSet=True, dedupeSpace=dedupeSpace, adaptiveCrops=adaptiveCrops)
         
         saveToOutput(outputType=outputType, outputFolder=outputFolder, imageDetections=imageDetections)
         print(f"Output saved to {outputFolder} as {outputType}.")
@@ -52,9 +63,14 @@ def execute(uploadDir = "input", inputType = "0", classificationThreshold = 0.35
         extractDir = create_dir("run/extract")
         # Extract files if needed
         extractFiles(inputType, uploadDir, extractDir)
-        # Run segmentation and prediction
-        croppedImagesAndData = boundBoxSegmentationTIF(classificationThreshold, extractDir, boundBoxChunkSize, classificationChunkSize)
-        imageDetections = predictionTIF(imageAndDatas=croppedImagesAndData, predictionThreshold=predictionThreshold, saveLabeledImage=saveLabeledImage, outputFolder=outputFolder, modelType=yoloModelType)
+        if pipelined:
+            # Run segmentation and prediction at the same time, on different images
+            segmentImage = functools.partial(segmentImageTIF, classificationThreshold=classificationThreshold, extractDir=extractDir, boundBoxChunkSize=boundBoxChunkSize, classificationChunkSize=classificationChunkSize, classificationQuantization=classificationQuantization, windowPlanning=windowPlanning, classificationPrescreen=classificationPrescreen, classificationCoarseFactor=classificationCoarseFactor, classificationRegionOfInterest=classificationRegionOfInterest)
+            imageDetections = pipelinedPrediction(inputFileNames=listInputImages(extractDir, tifImageExtensions), segmentImage=segmentImage, inputType=inputType, predictionThreshold=predictionThreshold, saveLabeledImage=saveLabeledImage, outputFolder=outputFolder, modelType=yoloModelType, backend=yoloBackend, batchSize=detectionBatchSize, returnDetectionSet=True, dedupeSpace=dedupeSpace, workers=pipelineWorkers, adaptiveCrops=adaptiveCrops)
+        else:
+            # Run segmentation and prediction, the segmented images are streamed into the prediction as they are made
+            croppedImagesAndData = boundBoxSegmentationTIF(classificationThreshold, extractDir, boundBoxChunkSize, classificationChunkSize, classificationQuantization, stream=True, processes=segmentationProcesses, windowPlanning=windowPlanning, classificationPrescreen=classificationPrescreen, classificationCoarseFactor=classificationCoarseFactor, classificationRegionOfInterest=classificationRegionOfInterest)
+            imageDetections = predictionTIF(imageAndDatas=croppedImagesAndData, predictionThreshold=predictionThreshold, saveLabeledImage=saveLabeledImage, outputFolder=outputFolder, modelType=yoloModelType, backend=yoloBackend, batchSize=detectionBatchSize, returnDetectionSet=True, dedupeSpace=dedupeSpace, adaptiveCrops=adaptiveCrops)
         
         saveToOutput(outputType=outputType, outputFolder=outputFolder, imageDetections=imageDetections)
         print(f"Output saved to {outputFolder} as {outputType}.")
@@ -0,0 +1,276 @@
+from collections import OrderedDict
+import os
+import threading
+
+# By default the cache keeps models until they use more than 4 GiB between them
+defaultMemoryLimit = 4 * 1024 ** 3
+
+
+def weightsBytes(weightsPath):
+    """
+    Gives the size of a model's weights on disk.
+
+    Args:
+        weightsPath (str): The path to a weights file, or to a directory of them such as an OpenVINO export.
+
+    Returns:
+        int: The number of bytes, 0 if the path does not exist.
+    """
+    if os.path.isdir(weightsPath):
+        return sum(os.path.getsize(os.path.join(root, fileName)) for root, _, fileNames in os.walk(weightsPath) for fileName in fileNames)
+    if os.path.isfile(weightsPath):
+        return os.path.getsize(weightsPath)
+    return 0
+
+
+def estimateModelBytes(model, weightsPath=None):
+    """
+    Estimates how much memory a model uses from the size of its parameters and buffers. Wrappers such as the
+    ultralytics YOLO class and the ClassifierEngine are looked through to the torch module they hold. Models without
+    any torch parameters, such as the frozen TorchScript module of the ClassifierEngine, whose weights are constants,
+    and YOLO models run through ONNX Runtime or OpenVINO, are estimated from the size of weightsPath on disk instead.
+
+    Args:
+        model (object): The loaded model.
+        weightsPath (str): The path to the weights the model was loaded from, if it was loaded from a file.
+
+    Returns:
+        int: The estimated number of bytes, 0 if it cannot be estimated.
+    """
+    modelBytes = 0
+    for _ in range(3):
+        if hasattr(model, "parameters") and hasattr(model, "buffers"):
+            try:
+                tensors = list(model.parameters()) + list(model.buffers())
+                modelBytes = sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+            except (TypeError, RuntimeError, AttributeError):
+                modelBytes = 0
+            break
+        model = getattr(model, "model", None)
+        if model is None:
+            break
+    if modelBytes == 0 and weightsPath is not None:
+        modelBytes = weightsBytes(weightsPath)
+    return modelBytes
+
+
+class ModelCache:
+    """
+    A process wide, thread safe cache of loaded models. Each model is stored under a key made from its model type,
+    the path to its weights and the time the weights were last modified, so changing the weights on disk loads
+    them again. The least recently used models are evicted once the models use more memory than the limit.
+    """
+    def __init__(self, memoryLimit=defaultMemoryLimit):
+        """
+        Args:
+            memoryLimit (int): The number of bytes the cached models may use before the least recently used ones are
+                evicted, None for no limit. The most recently used model is always kept.
+        """
+        self.memoryLimit = memoryLimit
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # One lock per key, so that two threads asking for the same model only load it once, while other models can still be loaded
+        self.loadLocks = {}
+
+    def get(self, key, loader):
+        """
+        Returns the model stored under key, loading it with loader if it is not cached yet.
+
+        Args:
+            key (tuple): The key of the model, as made by cacheKey, the weights path in it is used to estimate the size
+                of models without torch parameters.
+            loader (function): A function without arguments which loads and returns the model.
+
+        Returns:
+            model (object): The loaded model.
+        """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key][0]
+            loadLock = self.loadLocks.setdefault(key, threading.Lock())
+
+        with loadLock:
+            with self.lock:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    return self.entries[key][0]
+            model = loader()
+            modelBytes = estimateModelBytes(model, key[1])
+            with self.lock:
+                self.entries[key] = (model, modelBytes)
+                self.loadLocks.pop(key, None)
+                self.enforceMemoryLimit()
+        return model
+
+    def enforceMemoryLimit(self):
+        """Evicts the least recently used models until the cache is within its memory limit, the lock must be held"""
+        if self.memoryLimit is None:
+            return
+        while len(self.entries) > 1 and sum(modelBytes for _, modelBytes in self.entries.values()) > self.memoryLimit:
+            self.entries.popitem(last=False)
+
+    def setMemoryLimit(self, memoryLimit):
+        """
+        Changes the memory limit, evicting models straight away if they are over the new limit.
+
+        Args:
+            memoryLimit (int): The number of bytes the cached models may use, None for no limit.
+        """
+        with self.lock:
+            self.memoryLimit = memoryLimit
+            self.enforceMemoryLimit()
+
+    def evict(self, key):
+        """
+        Removes the model stored under key from the cache.
+
+        Args:
+            key (tuple): The key of the model.
+
+        Returns:
+            bool: True if a model was removed, otherwise False.
+        """
+        with self.lock:
+            return self.entries.pop(key, None) is not None
+
+    def evictModelType(self, modelType):
+        """
+        Removes every version of a model type from the cache, whatever weights they were loaded from.
+
+        Args:
+            modelType (str): The model type used in the keys.
+
+        Returns:
+            int: The number of models removed.
+        """
+        with self.lock:
+            keys = [key for key in self.entries if key[0] == modelType]
+            for key in keys:
+                del self.entries[key]
+            return len(keys)
+
+    def clear(self):
+        """Removes every model from the cache"""
+        with self.lock:
+            self.entries.clear()
+
+    def memoryUsage(self):
+        """
+        Returns:
+            int: The estimated number of bytes used by the cached models.
+        """
+        with self.lock:
+            return sum(modelBytes for _, modelBytes in self.entries.values())
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def keys(self):
+        """
+        Returns:
+            list: The keys of the cached models, from the least to the most recently used.
+        """
+        with self.lock:
+            return list(self.entries)
+
+
+modelCache = ModelCache()
+
+
+def cacheKey(modelType, weightsPath=None):
+    """
+    Makes the key a model is cached under.
+
+    Args:
+        modelType (str): The type of the model, for example 'yolo-m-torch' or 'mobileNet'.
+        weightsPath (str): The path to the weights the model is loaded from, if it is loaded from a file.
+
+    Returns:
+        tuple: The model type, the weights path and the time the weights were last modified.
+    """
+    modifiedTime = None
+    if weightsPath is not None and os.path.exists(weightsPath):
+        modifiedTime = os.path.getmtime(weightsPath)
+    return (modelType, weightsPath, modifiedTime)
+
+
+def getCachedModel(modelType, weightsPath, loader):
+    """
+    Returns a model from the process wide cache, loading it if needed. Versions of the same model type that were
+    loaded from older weights are evicted, as they will not be used again.
+
+    Args:
+        modelType (str): The type of the model.
+        weightsPath (str): The path to the weights the model is loaded from.
+        loader (function): A function without arguments which loads and returns the model.
+
+    Returns:
+        model (object): The loaded model.
+    """
+    key = cacheKey(modelType, weightsPath)
+    for cachedKey in modelCache.keys():
+        if cachedKey[0] == modelType and cachedKey != key:
+            modelCache.evict(cachedKey)
+    return modelCache.get(key, loader)
+
+
+# The registry only stores how to build each model, the models themselves are loaded the first time they are used
+modelLoaders = {}
+
+
+def registerModel(name, loader, weightsPath=None):
+    """
+    Registers how a model is loaded, without loading it. Registering a name again replaces its loader and unloads
+    the model that was previously loaded under that name.
+
+    Args:
+        name (str): The name the model will be retrieved with.
+        loader (function): A function without arguments which loads and returns the model.
+        weightsPath (str): The path to the weights the model is loaded from, so that it is loaded again if they change.
+    """
+    modelLoaders[name] = (loader, weightsPath)
+    modelCache.evictModelType(name)
+
+
+def getModel(name):
+    """
+    Returns the model registered under name, loading it on the first call and reusing it afterwards.
+
+    Args:
+        name (str): The name the model was registered with.
+
+    Returns:
+        model (object): The loaded model.
+
+    Raises:
+        KeyError: If no model has been registered under name.
+    """
+    if name not in modelLoaders:
+        raise KeyError(f"No model has been registered as {name}")
+    loader, weightsPath = modelLoaders[name]
+    return getCachedModel(name, weightsPath, loader)
+
+
+def isModelLoaded(name):
+    """
+    Checks if the model registered under name has already been loaded.
+
+    Args:
+        name (str): The name the model was registered with.
+
+    Returns:
+        bool: True if the model is loaded, otherwise False.
+    """
+    return any(key[0] == name for key in modelCache.keys())
+
+
+def unloadModel(name):
+    """
+    Drops the loaded model registered under name, so that the next call to getModel loads it again.
+
+    Args:
+        name (str): The name the model was registered with.
+    """
+    modelCache.evictModelType(name)
@@ -2,135 +2,528 @@ from ultralytics import YOLO
 import numpy as np
 from PIL import Image
 from tqdm import tqdm
+import itertools
 import os
 import sys
+import threading
 import traceback
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
-from georeference.georeference import georeferenceTIF, georefereceJGW, BNGtoLatLong
-from utils.filterOutput import removeDuplicateBoxesRC, combineChunksToBaseName
+from georeference.georeference import pixelToGeo, geoToLatLong, jgwGeotransform, detectionsToLatLong, jgwEPSG
+from utils.filterOutput import removeDuplicateDetections, combineChunksToBaseName
+from utils.detectionSet import DetectionSet
+from models.registry import getCachedModel
+from utils.pipeline import Stage, runPipeline
+from imageSegmentation.rasterWindow import RasterWindow
 
-def predictionJGW(imageAndDatas, predictionThreshold=0.25, saveLabeledImage=False, outputFolder="run/output", modelType="n", boundBoxChunkSize=1024, classificationChunkSize=256):
+detectionBackends = ("torch", "onnx", "openvino")
+dedupeSpaces = ("latlong", "projected")
+# The number of threads of each stage of pipelinedPrediction, the model itself always runs on one
+pipelineWorkers = {"segmentation": 2, "preparation": 1, "georeference": 1}
+
+def exportedModelPath(modelPath, backend):
+    """
+    Gives the path that ultralytics exports a model to for a backend, which is next to the original .pt file.
+
+    Args:
+        modelPath (str): The path to the .pt model.
+        backend (str): The backend the model is exported for, 'torch', 'onnx' or 'openvino'.
+
+    Returns:
+        str: The path to the exported model, the .pt path itself for the 'torch' backend.
+    """
+    root, _ = os.path.splitext(modelPath)
+    if backend == "onnx":
+        return root + ".onnx"
+    if backend == "openvino":
+        return root + "_openvino_model"
+    return modelPath
+
+def loadFusedModel(modelPath):
+    """
+    Loads a .pt model with its convolution and batch normalisation layers already fused. The first time, the model is
+    fused and saved next to the .pt file, so later loads skip the fusion. It is fused again if the .pt file is changed.
+
+    Args:
+        modelPath (str): The path to the .pt model.
+
+    Returns:
+        model (YOLO): The loaded, fused model.
+    """
+    root, _ = os.path.splitext(modelPath)
+    fusedPath = root + ".fused.pt"
+    if os.path.exists(fusedPath) and os.path.getmtime(fusedPath) >= os.path.getmtime(modelPath):
+        return YOLO(fusedPath, task="obb")
+
+    model = YOLO(modelPath)
+    model.fuse()
+    try:
+        import torch
+        torch.save({**(model.ckpt or {}), "model": model.model, "ema": None}, fusedPath)
+    except OSError as e:
+        print(f"Could not save the fused model to {fusedPath}: {e}")
+    return model
+
+def loadDetectionModel(modelType="n", backend="torch"):
+    """
+    Loads the oriented bounding box model for a backend. For the 'onnx' and 'openvino' backends, the .pt model is
+    exported the first time it is needed and the exported model is cached next to it, it is only exported again
+    if the .pt file is changed. Every backend returns the same ultralytics results, so the rest of the prediction
+    does not depend on which backend is used.
+
+    Loaded models are kept in the process wide model cache, so later calls, including those from other calls to
+    execute, reuse them instead of loading them again.
+
+    Args:
+        modelType (str): The type of model used.
+        backend (str): 'torch' to run the model through PyTorch, 'onnx' to run it through ONNX Runtime, or 'openvino' to run it through OpenVINO.
+
+    Returns:
+        model (YOLO): The loaded model.
+    """
+    if backend not in detectionBackends:
+        raise ValueError(f"Unknown detection backend {backend}, expected one of {detectionBackends}")
+    modelPath = f"models/yolo-{modelType}.pt"
+
+    def loader():
+        if backend == "torch":
+            if os.path.exists(modelPath):
+                return loadFusedModel(modelPath)
+            return YOLO(modelPath)
+
+        exportPath = exportedModelPath(modelPath, backend)
+        if not os.path.exists(exportPath) or os.path.getmtime(exportPath) < os.path.getmtime(modelPath):
+            # Dynamic axes let the exported model take any batch size and image size
+            exportPath = YOLO(modelPath).export(format=backend, dynamic=True)
+        return YOLO(exportPath, task="obb")
+
+    return getCachedModel(f"yolo-{modelType}-{backend}", modelPath, loader)
+
+# Cached models are shared between calls to execute, and ultralytics models cannot run on several threads at once
+detectionLock = threading.Lock()
+
+def batchItems(items, batchSize):
+    """
+    Groups the items of any iterable into lists of at most batchSize items, keeping their order.
+
+    Args:
+        items (iterable): The items to group.
+        batchSize (int): The maximum number of items in each batch.
+
+    Yields:
+        batch (list): The next batchSize items.
+    """
+    iterator = iter(items)
+    while True:
+        batch = list(itertools.islice(iterator, batchSize))
+        if not batch:
+            return
+        yield batch
+
+def moveLabeledImages(outputFolder, batchLength, numOfSavedImages):
+    """
+    Ultralytics names the labeled images of a batch image0.jpg, image1.jpg and so on, so they would be overwritten by
+    the next batch. This moves them from the batch folder into the run folder, numbered by a running count instead.
+
+    Args:
+        outputFolder (str): This directs where the model saved the output to.
+        batchLength (int): The number of images in the batch.
+        numOfSavedImages (int): The number given to the next saved image.
+
+    Returns:
+        numOfSavedImages (int): The number given to the next saved image, after this batch.
+    """
+    os.makedirs(outputFolder+"/labeledImages/run", exist_ok=True)
+    for i in range(batchLength):
+        batchImagePath = outputFolder+f"/labeledImages/batch/image{i}.jpg"
+        if os.path.exists(batchImagePath):
+            os.replace(batchImagePath, outputFolder+f"/labeledImages/run/image{numOfSavedImages}.jpg")
+            numOfSavedImages += 1
+    return numOfSavedImages
+
+def batchItemsBySize(items, batchSize, sizeOf):
+    """
+    Groups the items of any iterable into lists of at most batchSize items of the same size, so that each list can be
+    run by the model at one image size. A list is given as soon as it is full, and the lists that are not full are given
+    once the items run out, so at most batchSize - 1 items of each size are held back.
+
+    Args:
+        items (iterable): The items to group.
+        batchSize (int): The maximum number of items in each batch.
+        sizeOf (callable): Gives the size of an item.
+
+    Yields:
+        batch (list): Up to batchSize items of the same size, in the order they came in.
+    """
+    buckets = {}
+    for item in items:
+        size = sizeOf(item)
+        bucket = buckets.setdefault(size, [])
+        bucket.append(item)
+        if len(bucket) == batchSize:
+            yield buckets.pop(size)
+    yield from buckets.values()
+
+def detectionImageSize(model, cropSize, boundBoxChunkSize=1024):
+    """
+    Gives the image size the model runs segmented images of cropSize at. The model would otherwise scale every image
+    up to the size it runs full boundBoxChunkSize images at, so a small image would cost as much as a full one.
+
+    Args:
+        model (YOLO): The loaded model.
+        cropSize (int): The size of each side of the segmented images.
+        boundBoxChunkSize (int): The size of each side of a full bounding box image.
+
+    Returns:
+        int: The imgsz to run the model at, a multiple of its largest stride, or None for full size segmented images.
+    """
+    if cropSize == boundBoxChunkSize:
+        return None
+    imgsz = model.overrides.get("imgsz") or 640
+    if not isinstance(imgsz, int):
+        imgsz = max(imgsz)
+    return max(32, round(imgsz * cropSize / boundBoxChunkSize / 32) * 32)
+
+def detectBatch(model, images, predictionThreshold, iou, saveLabeledImage, outputFolder, numOfSavedImages, imgsz=None):
+    """
+    Runs the model over one batch of segmented images, holding detectionLock so that only one batch is in the model
+    at a time.
+
+    Args:
+        model (YOLO): The loaded model.
+        images (list): The segmented images as PIL images.
+        predictionThreshold (float): The confidence threshold for the bounding box model.
+        iou (float): The IoU threshold of the model's non-maximum suppression.
+        saveLabeledImage (bool): If true, the images with bounding boxes will be saved.
+        outputFolder (str): This directs where the model should save the output to.
+        numOfSavedImages (int): The number given to the next saved image.
+        imgsz (int): The image size the model runs at, None for its own.
+
+    Returns:
+        tuple: The result of each image on the CPU, and the number given to the next saved image after this batch.
+    """
+    sizeArgs = {} if imgsz is None else {"imgsz": imgsz}
+    with detectionLock:
+        results = model(images, save=saveLabeledImage, conf=predictionThreshold, iou=iou, 
+                    project=outputFolder+"/labeledImages", name="batch", exist_ok=True, verbose=False, **sizeArgs)
+        if saveLabeledImage:
+            numOfSavedImages = moveLabeledImages(outputFolder, len(images), numOfSavedImages)
+    return [result.cpu() for result in results], numOfSavedImages
+
+def cropSizeJGW(imageAndData):
+    """Gives the size of each side of a segmented JGW image"""
+    return imageAndData[1].size[0]
+
+def cropSizeTIF(imageAndData):
+    """Gives the size of each side of a segmented TIF image"""
+    return imageAndData[1].RasterXSize
+
+def detectionImageJGW(imageAndData):
+    """Gives the PIL image passed to the model for a segmented JGW image, which already is one"""
+    return imageAndData[1]
+
+def detectionImageTIF(imageAndData):
+    """Reads a segmented TIF image into the PIL image passed to the model"""
+    croppedImage = imageAndData[1]
+    if isinstance(croppedImage, RasterWindow):
+        # The PIL image is a copy, so the same buffer can be read into for the next segmented image
+        croppedImageArray = croppedImage.readIntoBuffer()
+    else:
+        croppedImageArray = croppedImage.ReadAsArray()
+    if croppedImageArray.ndim == 3:
+        croppedImageArray = np.moveaxis(croppedImageArray, 0, -1)
+    elif isinstance(croppedImage, RasterWindow):
+        # PIL copies bands that are not in its own order, but it can share a single band with the buffer
+        croppedImageArray = croppedImageArray.copy()
+    return Image.fromarray(croppedImageArray)
+
+def georeferenceResultJGW(imageAndData, result, dedupeSpace="latlong"):
+    """
+    Georeferences all of the boxes the model found in one segmented JGW image at once, JGW images are always in BNG.
+
+    Args:
+        imageAndData (tuple): The input image name, segmented image, georeferencing data, row, and column.
+        result (Results): The result of the model for the segmented image.
+        dedupeSpace (str): 'latlong' to convert the boxes to latitude and longitude, or 'projected' to keep them in BNG.
+
+    Returns:
+        tuple: The arguments of DetectionSet.add for the boxes, which are the image name, row, column, corners,
+            confidences and the CRS of the corners.
+    """
+    baseName, _, pixelSizeX, pixelSizeY, topLeftXGeo, topLeftYGeo, row, col = imageAndData
+    geotransform = jgwGeotransform(pixelSizeX, pixelSizeY, topLeftXGeo, topLeftYGeo)
+    geoCorners = pixelToGeo(result.obb.xyxyxyxy.numpy(), geotransform)
+    if dedupeSpace == "projected":
+        return baseName, row, col, geoCorners, result.obb.conf.numpy(), jgwEPSG
+    return baseName, row, col, geoToLatLong(geoCorners, jgwEPSG), result.obb.conf.numpy(), None
+
+def georeferenceResultTIF(imageAndData, result, dedupeSpace="latlong"):
+    """
+    Georeferences all of the boxes the model found in one segmented TIF image at once, every box in the crop shares
+    its georeferencing data, so it is only read once.
+
+    Args:
+        imageAndData (tuple): The input image name, segmented TIF image, row, and column.
+        result (Results): The result of the model for the segmented image.
+        dedupeSpace (str): 'latlong' to convert the boxes to latitude and longitude, or 'projected' to keep them in the image's CRS.
+
+    Returns:
+        tuple: The arguments of DetectionSet.add for the boxes, which are the image name, row, column, corners,
+            confidences and the CRS of the corners.
+    """
+    baseName, croppedImage, row, col = imageAndData
+    geotransform = croppedImage.GetGeoTransform()
+    if not geotransform:
+        raise ValueError(f"No geotransform found in the file: {croppedImage}")
+    geoCorners = pixelToGeo(result.obb.xyxyxyxy.numpy(), geotransform)
+    if dedupeSpace == "projected":
+        return baseName, row, col, geoCorners, result.obb.conf.numpy(), croppedImage.GetProjection()
+    return baseName, row, col, geoToLatLong(geoCorners, croppedImage.GetProjection()), result.obb.conf.numpy(), None
+
+def filterDetections(detections, boundBoxChunkSize=1024, classificationChunkSize=256, returnDetectionSet=False):
+    """
+    Removes the duplicate boxes from the detections, then converts the boxes that are kept to latitude and longitude.
+
+    Args:
+        detections (DetectionSet): The detections of every segmented image.
+        boundBoxChunkSize (int): The size of each side of the bounding box image.
+        classificationChunkSize (int): The size of each side of the classification image.
+        returnDetectionSet (bool): If true, the filtered DetectionSet is returned instead of a dictionary.
+
+    Returns:
+        imageDetections (dict): A dictionary where the basename of an image is the key, and the key stores a list of boxes in latitude and longitude, and their respective confidence
+    """
+    removeDuplicateDetections(detections, boundBoxChunkSize=boundBoxChunkSize, classificationChunkSize=classificationChunkSize)
+    # Only the boxes that survived the filter are converted to latitude and longitude
+    detectionsToLatLong(detections)
+    if returnDetectionSet:
+        return detections
+    imageDetections = combineChunksToBaseName(imageDetectionsRowCol=detections.toRowColDict())
+    return imageDetections
+
+def predictionJGW(imageAndDatas, predictionThreshold=0.25, saveLabeledImage=False, outputFolder="run/output", modelType="n", boundBoxChunkSize=1024, classificationChunkSize=256, backend="torch", batchSize=8, returnDetectionSet=False, dedupeSpace="latlong", adaptiveCrops=False):
     """
     This function will take all of the segmented image and their georeferencing data from imageAndDatas, where the model then 
     processes the image and  creates a list of bounding boxes. It then takes each bounding box, georeferences it, and then 
-    stores it in the dictionary imageDetectionsRowCol, where the key stores the basename, row, and column which this bounding 
+    stores it in a DetectionSet, along with the basename, row, and column which this bounding 
     box came from. After looping through all of the items, it is then filtered to reduce duplications. This filter also 
     removes the row and column data, storing all of the bounding boxes from one image with the image name as the key.
 
+    The segmented images are passed to the model in batches of batchSize, and each result is matched back to the
+    basename, row, and column of the segmented image it came from.
+
     Args:
-        imageAndDatas (list): A list of the input image name, segmented image, georeferencing data, row, and column.
+        imageAndDatas (iterable): The input image name, segmented image, georeferencing data, row, and column of each segmented image,
+            either as a list or as a stream such as the generator from boundBoxSegmentationJGW with stream.
         predictionThreshold (float): The confidence threshold for the bounding box model.
         saveLabeledImage (bool): If true, the images with bounding boxes will be saved.
         outputFolder (str): This directs where the model should save the output to.
         modelType (str): The type of model used.
         boundBoxChunkSize (int): The size of each side of the bounding box image.
         classificationChunkSize (int): The size of each side of the classification image.
+        backend (str): The runtime used for the model, 'torch', 'onnx' or 'openvino'.
+        batchSize (int): The number of segmented images passed to the model at once.
+        returnDetectionSet (bool): If true, the filtered DetectionSet is returned instead of a dictionary.
+        dedupeSpace (str): 'latlong' to remove duplicates after converting every box to latitude and longitude, or 'projected'
+            to remove them in the image's CRS, where the IoU is measured in metres, and only convert the boxes that are kept.
+        adaptiveCrops (bool): If true, the segmented images can have different sizes, such as those planned by
+            planAdaptiveWindows. They are batched by size, and each batch is run at an image size scaled to its segmented images.
     
     Returns:
         imageDetections (dict): A dictionary where the basename of an image is the key, and the key stores a list of boxes in latitude and longitude, and their respective confidence
     """
-    modelPath = f"models/yolo-{modelType}.pt"
-    model = YOLO(modelPath)  # load an official model
-    # Dictionary to store all detections and their confidence grouped by original image
-    imageDetectionsRowCol = {}
+    if dedupeSpace not in dedupeSpaces:
+        raise ValueError(f"Unknown dedupe space {dedupeSpace}, expected one of {dedupeSpaces}")
+    model = loadDetectionModel(modelType, backend)
+    # Stores all detections and their confidence, along with the image, row, and column they came from
+    detections = DetectionSet()
     numOfSavedImages = 1
     # First, process all images and group detections
-    with tqdm(total=(len(imageAndDatas)), desc="Creating Oriented Bounding Box") as pbar:
-        for baseName, croppedImage, pixelSizeX, pixelSizeY, topLeftXGeo, topLeftYGeo, row, col in imageAndDatas:
+    # Generators from a streamed segmentation have no length, so the progress bar only counts them
+    with tqdm(total=(len(imageAndDatas) if hasattr(imageAndDatas, "__len__") else None), desc="Creating Oriented Bounding Box") as pbar:
+        batches = batchItemsBySize(imageAndDatas, batchSize, cropSizeJGW) if adaptiveCrops else batchItems(imageAndDatas, batchSize)
+        for batch in batches:
             try:
-                allPointsList = []
-                allConfidenceList = []
-                results = model(croppedImage, save=saveLabeledImage, conf=predictionThreshold, iou=0.01, 
-                            project=outputFolder+"/labeledImages", name="run", exist_ok=True, verbose=False)
-                if saveLabeledImage and os.path.exists(outputFolder+"/labeledImages/run/image0.jpg"):
-                    os.rename(outputFolder+"/labeledImages/run/image0.jpg", outputFolder+f"/labeledImages/run/image{numOfSavedImages}.jpg")
-                    numOfSavedImages += 1
-                for result in results:
-                    result = result.cpu()
-                    for confidence in result.obb.conf:
-                        allConfidenceList.append(confidence.item())
-                    for boxes in result.obb.xyxyxyxy:
-                        x1, y1 = boxes[0].tolist()
-                        x2, y2 = boxes[1].tolist()
-                        x3, y3 = boxes[2].tolist()
-                        x4, y4 = boxes[3].tolist()
-                        listOfPoints = georefereceJGW(x1,y1,x2,y2,x3,y3,x4,y4,pixelSizeX,pixelSizeY,topLeftXGeo,topLeftYGeo)
-                        latLongList = BNGtoLatLong(listOfPoints)
-                        allPointsList.append(latLongList)
-                if allPointsList:
-                    baseNameWithRowCol = f"{baseName}__r{row}__c{col}"
-                    imageDetectionsRowCol[baseNameWithRowCol] = [allPointsList,allConfidenceList]
+                croppedImages = [detectionImageJGW(imageAndData) for imageAndData in batch]
+                imgsz = detectionImageSize(model, cropSizeJGW(batch[0]), boundBoxChunkSize) if adaptiveCrops else None
+                results, numOfSavedImages = detectBatch(model, croppedImages, predictionThreshold, 0.01, saveLabeledImage, outputFolder, numOfSavedImages, imgsz)
             except Exception as e:
-                print(f"Error processing {croppedImage}: {e}")
+                print(f"Error processing {[baseName for baseName, *_ in batch]}: {e}")
                 print(traceback.format_exc())
-            pbar.update(1)
+                pbar.update(len(batch))
+                continue
+
+            for imageAndData, result in zip(batch, results):
+                try:
+                    baseName, row, col, corners, conf, crs = georeferenceResultJGW(imageAndData, result, dedupeSpace)
+                    detections.add(baseName, row, col, corners, conf, crs=crs)
+                except Exception as e:
+                    print(f"Error processing {imageAndData[1]}: {e}")
+                    print(traceback.format_exc())
+                pbar.update(1)
         
-    removeDuplicateBoxesRC(imageDetectionsRowCol=imageDetectionsRowCol, boundBoxChunkSize=boundBoxChunkSize, classificationChunkSize=classificationChunkSize)
-    imageDetections = combineChunksToBaseName(imageDetectionsRowCol=imageDetectionsRowCol)
-    return imageDetections
+    return filterDetections(detections, boundBoxChunkSize, classificationChunkSize, returnDetectionSet)
 
 # This version of predictionTIF has filtering
-def predictionTIF(imageAndDatas, predictionThreshold=0.25, saveLabeledImage=False, outputFolder="run/output", modelType="n", boundBoxChunkSize=1024, classificationChunkSize=256):
+def predictionTIF(imageAndDatas, predictionThreshold=0.25, saveLabeledImage=False, outputFolder="run/output", modelType="n", boundBoxChunkSize=1024, classificationChunkSize=256, backend="torch", batchSize=8, returnDetectionSet=False, dedupeSpace="latlong", adaptiveCrops=False):
     """
     This function will take all of the segmented image and their georeferencing data from imageAndDatas, where the model then 
     processes the image and  creates a list of bounding boxes. It then takes each bounding box, georeferences it, and then 
-    stores it in the dictionary imageDetectionsRowCol, where the key stores the basename, row, and column which this bounding 
+    stores it in a DetectionSet, along with the basename, row, and column which this bounding 
     box came from. After looping through all of the items, it is then filtered to reduce duplications. This filter also 
     removes the row and column data, storing all of the bounding boxes from one image with the image name as the key.
 
+    The segmented images are passed to the model in batches of batchSize, and each result is matched back to the
+    basename, row, and column of the segmented image it came from.
+
     Args:
-        imageAndDatas (list): A list of the input image name, segmented tif image, row, and column.
+        imageAndDatas (iterable): The input image name, segmented tif image, row, and column of each segmented image,
+            either as a list or as a stream such as the generator from boundBoxSegmentationTIF with stream.
         predictionThreshold (float): The confidence threshold for the bounding box model.
         saveLabeledImage (bool): If true, the images with bounding boxes will be saved.
         outputFolder (str): This directs where the model should save the output to.
         modelType (str): The type of model used.
         boundBoxChunkSize (int): The size of each side of the bounding box image.
         classificationChunkSize (int): The size of each side of the classification image.
+        backend (str): The runtime used for the model, 'torch', 'onnx' or 'openvino'.
+        batchSize (int): The number of segmented images passed to the model at once.
+        returnDetectionSet (bool): If true, the filtered DetectionSet is returned instead of a dictionary.
+        dedupeSpace (str): 'latlong' to remove duplicates after converting every box to latitude and longitude, or 'projected'
+            to remove them in the image's CRS, where the IoU is measured in metres, and only convert the boxes that are kept.
+        adaptiveCrops (bool): If true, the segmented images can have different sizes, such as those planned by
+            planAdaptiveWindows. They are batched by size, and each batch is run at an image size scaled to its segmented images.
     
     Returns:
         imageDetections (dict): A dictionary where the basename of an image is the key, and the key stores a list of boxes in latitude and longitude, and their respective confidence.
     """
-    modelPath = f"models/yolo-{modelType}.pt"
-    model = YOLO(modelPath)  # load an official model
-    # Dictionary to store all detections and their confidence grouped by image, row, and column
-    imageDetectionsRowCol = {}
+    if dedupeSpace not in dedupeSpaces:
+        raise ValueError(f"Unknown dedupe space {dedupeSpace}, expected one of {dedupeSpaces}")
+    model = loadDetectionModel(modelType, backend)
+    # Stores all detections and their confidence, along with the image, row, and column they came from
+    detections = DetectionSet()
     numOfSavedImages = 1
     # First, process all images and group detections
-    with tqdm(total=(len(imageAndDatas)), desc="Creating Oriented Bounding Box") as pbar:
-        for baseName, croppedImage, row, col in imageAndDatas:
+    # Generators from a streamed segmentation have no length, so the progress bar only counts them
+    with tqdm(total=(len(imageAndDatas) if hasattr(imageAndDatas, "__len__") else None), desc="Creating Oriented Bounding Box") as pbar:
+        batches = batchItemsBySize(imageAndDatas, batchSize, cropSizeTIF) if adaptiveCrops else batchItems(imageAndDatas, batchSize)
+        for batch in batches:
             try:
-                allPointsList = []
-                allConfidenceList = []
-                croppedImageArray = croppedImage.ReadAsArray()
-                if croppedImageArray.ndim == 3:
-                    croppedImageArray = np.moveaxis(croppedImageArray, 0, -1)
-                PILImage = Image.fromarray(croppedImageArray)
-                results = model(PILImage, save=saveLabeledImage, conf=predictionThreshold, iou=0.9, 
-                              project=outputFolder+"/labeledImages", name="run", exist_ok=True, verbose=False)
-                
-                if saveLabeledImage and os.path.exists(outputFolder+"/labeledImages/run/image0.jpg"):
-                    os.rename(outputFolder+"/labeledImages/run/image0.jpg", outputFolder+f"/labeledImages/run/image{numOfSavedImages}.jpg")
-                    numOfSavedImages += 1
-                for result in results:
-                    result = result.cpu()
-                    for confidence in result.obb.conf:
-                        allConfidenceList.append(confidence.item())
-                    for boxes in result.obb.xyxyxyxy:
-                        x1, y1 = boxes[0].tolist()
-                        x2, y2 = boxes[1].tolist()
-                        x3, y3 = boxes[2].tolist()
-                        x4, y4 = boxes[3].tolist()
-                        longLatList = georeferenceTIF(croppedImage,x1,y1,x2,y2,x3,y3,x4,y4)
-                        allPointsList.append(longLatList)
-                if allPointsList:
-                    baseNameWithRowCol = f"{baseName}__r{row}__c{col}"
-                    imageDetectionsRowCol[baseNameWithRowCol] = [allPointsList,allConfidenceList]
-                    
+                PILImages = [detectionImageTIF(imageAndData) for imageAndData in batch]
+                imgsz = detectionImageSize(model, cropSizeTIF(batch[0]), boundBoxChunkSize) if adaptiveCrops else None
+                results, numOfSavedImages = detectBatch(model, PILImages, predictionThreshold, 0.9, saveLabeledImage, outputFolder, numOfSavedImages, imgsz)
             except Exception as e:
-                print(f"Error processing {baseName}: {e}")
+                print(f"Error processing {[baseName for baseName, *_ in batch]}: {e}")
                 print(traceback.format_exc())
+                pbar.update(len(batch))
+                continue
+
+            for imageAndData, result in zip(batch, results):
+                try:
+                    baseName, row, col, corners, conf, crs = georeferenceResultTIF(imageAndData, result, dedupeSpace)
+                    detections.add(baseName, row, col, corners, conf, crs=crs)
+                except Exception as e:
+                    print(f"Error processing {imageAndData[0]}: {e}")
+                    print(traceback.format_exc())
+                pbar.update(1)
+    return filterDetections(detections, boundBoxChunkSize, classificationChunkSize, returnDetectionSet)
+
+
+def pipelinedPrediction(inputFileNames, segmentImage, inputType="0", predictionThreshold=0.25, saveLabeledImage=False, outputFolder="run/output", modelType="n", boundBoxChunkSize=1024, classificationChunkSize=256, backend="torch", batchSize=8, returnDetectionSet=False, dedupeSpace="latlong", workers=None, adaptiveCrops=False):
+    """
+    Segments the input images and predicts the bounding boxes of their segmented images like predictionJGW and
+    predictionTIF, but with each step running at the same time on different images, so that the classification model
+    works on the next input images while the bounding box model works on the segmented images of the last ones.
+
+    The steps are run by runPipeline as four stages, which are connected by bounded queues:
+        segmentation: Classifies and segments one input image with segmentImage, all of its segmented images are made
+            before they are passed on, so each segmentation worker holds up to one input image in memory.
+        preparation: Turns each segmented image into the PIL image given to the model.
+        detection: Runs the model over batches of batchSize segmented images. The model cannot run on several threads
+            at once, so this stage always has one worker.
+        georeference: Georeferences the boxes of each segmented image.
+    The detections are added in the same order as predictionJGW and predictionTIF would add them, so the output is the same.
+
+    Args:
+        inputFileNames (list): The names of the input images in the extract directory.
+        segmentImage (callable): Takes the name of an input image and yields its segmented images, such as segmentImageJGW
+            or segmentImageTIF with the rest of their arguments already given.
+        inputType (str): "0" for .jpg/.jgw images, "1" for .tif images.
+        predictionThreshold (float): The confidence threshold for the bounding box model.
+        saveLabeledImage (bool): If true, the images with bounding boxes will be saved.
+        outputFolder (str): This directs where the model should save the output to.
+        modelType (str): The type of model used.
+        boundBoxChunkSize (int): The size of each side of the bounding box image.
+        classificationChunkSize (int): The size of each side of the classification image.
+        backend (str): The runtime used for the model, 'torch', 'onnx' or 'openvino'.
+        batchSize (int): The number of segmented images passed to the model at once.
+        returnDetectionSet (bool): If true, the filtered DetectionSet is returned instead of a dictionary.
+        dedupeSpace (str): 'latlong' to remove duplicates after converting every box to latitude and longitude, or 'projected'
+            to remove them in the image's CRS, where the IoU is measured in metres, and only convert the boxes that are kept.
+        workers (dict): The number of threads of the 'segmentation', 'preparation' and 'georeference' stages, any stage
+            left out uses its number from pipelineWorkers.
+        adaptiveCrops (bool): If true, the segmented images can have different sizes, such as those planned by
+            planAdaptiveWindows. Each batch is split by size, and each part is run at an image size scaled to its segmented images.
+
+    Returns:
+        imageDetections (dict): A dictionary where the basename of an image is the key, and the key stores a list of boxes in latitude and longitude, and their respective confidence
+    """
+    if dedupeSpace not in dedupeSpaces:
+        raise ValueError(f"Unknown dedupe space {dedupeSpace}, expected one of {dedupeSpaces}")
+    if inputType == "0":
+        detectionImage, georeferenceResult, cropSize, iou = detectionImageJGW, georeferenceResultJGW, cropSizeJGW, 0.01
+    elif inputType == "1":
+        detectionImage, georeferenceResult, cropSize, iou = detectionImageTIF, georeferenceResultTIF, cropSizeTIF, 0.9
+    else:
+        raise ValueError(f"Unknown input type {inputType}, expected '0' or '1'")
+    workers = {**pipelineWorkers, **(workers or {})}
+    model = loadDetectionModel(modelType, backend)
+    numOfSavedImages = 1
+
+    def prepare(imageAndData):
+        try:
+            return [(imageAndData, detectionImage(imageAndData))]
+        except Exception as e:
+            print(f"Error processing {imageAndData[0]}: {e}")
+            print(traceback.format_exc())
+            return []
+
+    def detect(batch):
+        nonlocal numOfSavedImages
+        # The pipeline batches the segmented images in order, so a batch of different sizes is run one size at a time
+        sizes = [cropSize(imageAndData) for imageAndData, _ in batch] if adaptiveCrops else [None] * len(batch)
+        results = [None] * len(batch)
+        try:
+            for size in dict.fromkeys(sizes):
+                indices = [i for i, itemSize in enumerate(sizes) if itemSize == size]
+                imgsz = None if size is None else detectionImageSize(model, size, boundBoxChunkSize)
+                sizeResults, numOfSavedImages = detectBatch(model, [batch[i][1] for i in indices], predictionThreshold, iou, saveLabeledImage, outputFolder, numOfSavedImages, imgsz)
+                for i, result in zip(indices, sizeResults):
+                    results[i] = result
+        except Exception as e:
+            print(f"Error processing {[imageAndData[0] for imageAndData, _ in batch]}: {e}")
+            print(traceback.format_exc())
+            return []
+        return [(imageAndData, result) for (imageAndData, _), result in zip(batch, results)]
+
+    def georeference(imageAndDataAndResult):
+        imageAndData, result = imageAndDataAndResult
+        try:
+            return [georeferenceResult(imageAndData, result, dedupeSpace)]
+        except Exception as e:
+            print(f"Error processing {imageAndData[0]}: {e}")
+            print(traceback.format_exc())
+            return []
+
+    stages = [
+        Stage("segmentation", segmentImage, workers=workers["segmentation"], queueSize=workers["segmentation"]),
+        Stage("preparation", prepare, workers=workers["preparation"]),
+        # Each item is a whole batch, so only a couple are queued
+        Stage("detection", detect, batchSize=batchSize, queueSize=2),
+        Stage("georeference", georeference, workers=workers["georeference"]),
+    ]
+    detections = DetectionSet()
+    with tqdm(desc="Creating Oriented Bounding Box") as pbar:
+        for baseName, row, col, corners, conf, crs in runPipeline(inputFileNames, stages):
+            detections.add(baseName, row, col, corners, conf, crs=crs)
             pbar.update(1)
-    removeDuplicateBoxesRC(imageDetectionsRowCol=imageDetectionsRowCol, boundBoxChunkSize=boundBoxChunkSize, classificationChunkSize=classificationChunkSize)
-    imageDetections = combineChunksToBaseName(imageDetectionsRowCol=imageDetectionsRowCol)
-    return imageDetections
\ No newline at end of file
+    return filterDetections(detections, boundBoxChunkSize, classificationChunkSize, returnDetectionSet)
@@ -1,13 +1,39 @@
 import unittest
-from PIL import Image
+from unittest.mock import patch
+from PIL import Image, ImageFile
+import numpy as np
 import os
+import shutil
 import sys
-from osgeo import gdal
+import tempfile
 
 # Import the functions to be tested
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
-from imageSegmentation.boundBoxSegmentation import boundBoxSegmentationJGW, boundBoxSegmentationTIF
+from imageSegmentation.boundBoxSegmentation import boundBoxSegmentationJGW, boundBoxSegmentationTIF, cropWindows, planWindows, planAdaptiveWindows, segmentationWindows, windowSizes, shareSegmentedImagesJGW, cropSharedImageJGW
+from imageSegmentation.classificationSegmentation import clampRowCol, getFilteringBounds
+from imageSegmentation.rasterWindow import RasterWindow
+
+def residentMemory():
+    """Returns the resident memory of this process in bytes"""
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+def makeJGWInput(extractDir, numOfImages, size):
+    """Saves numOfImages copies of a random size x size image with its world file into extractDir"""
+    imagePath = os.path.join(extractDir, "image0.jpg")
+    Image.fromarray(np.random.default_rng(0).integers(0, 256, (size, size, 3), dtype=np.uint8)).save(imagePath)
+    with open(os.path.join(extractDir, "image0.jgw"), "w") as jgwFile:
+        jgwFile.write("0.25\n0\n0\n-0.25\n530000\n180000\n")
+    for i in range(1, numOfImages):
+        shutil.copy(imagePath, os.path.join(extractDir, f"image{i}.jpg"))
+        shutil.copy(os.path.join(extractDir, "image0.jgw"), os.path.join(extractDir, f"image{i}.jgw"))
+
+def insideMargin(chunkTop, windowTop, imageSize, margin=256, chunkSize=256, windowSize=1024):
+    """Checks that a chunk is at least margin pixels inside a window along one axis, or at the edge of the image"""
+    topMargin = margin if windowTop > 0 else 0
+    bottomMargin = margin if windowTop + windowSize < imageSize else 0
+    return chunkTop - windowTop >= topMargin and windowTop + windowSize - (chunkTop + chunkSize) >= bottomMargin
 
 class TestBoundBoxSegmentation(unittest.TestCase):
    
@@ -30,9 +56,220 @@ class TestBoundBoxSegmentation(unittest.TestCase):
 
         for item in result:
             self.assertEqual(item[0], testImageFileName)  # Verify the filename
-            self.assertIsInstance(item[1], gdal.Dataset)  # Verify the cropped dataset
+            self.assertIsInstance(item[1], RasterWindow)  # Verify the segmented window
             self.assertEqual(item[1].RasterXSize, 1024)  # Verify the width of the cropped dataset
             self.assertEqual(item[1].RasterYSize, 1024)  # Verify the height of the cropped dataset
 
+    @patch('imageSegmentation.boundBoxSegmentation.classificationSegmentation')
+    def test_boundBoxSegmentationJGW_stream_matches_list(self, mock_classification):
+        mock_classification.return_value = [(1, 1), (1, 5), (5, 6), (5, 7)]
+        with tempfile.TemporaryDirectory() as extractDir:
+            makeJGWInput(extractDir, 2, 2048)
+            listed = boundBoxSegmentationJGW(extractDir=extractDir)
+            streamed = boundBoxSegmentationJGW(extractDir=extractDir, stream=True)
+
+            self.assertIsInstance(listed, list)
+            self.assertNotIsInstance(streamed, list)
+            streamed = list(streamed)
+
+        self.assertEqual(len(streamed), 6)  # (5, 6) and (5, 7) are both moved to the right edge, giving the same segmented image
+        for streamedItem, listedItem in zip(streamed, listed):
+            self.assertEqual(streamedItem[0], listedItem[0])
+            self.assertEqual(streamedItem[2:], listedItem[2:])
+            self.assertEqual(streamedItem[1].tobytes(), listedItem[1].tobytes())
+
+    @unittest.skipUnless(os.path.exists("/proc/self/statm"), "The resident memory is read from /proc")
+    # Nine 1024px segmented images of interest in every 3072px image. A plain function is used, since a mock would
+    # keep every decoded image it is given in its call arguments
+    @patch('imageSegmentation.boundBoxSegmentation.classificationSegmentation', new=lambda **kwargs: [(row, col) for row in (1, 5, 9) for col in (1, 5, 9)])
+    def test_boundBoxSegmentationJGW_stream_bounded_memory(self):
+        numOfImages, size = 12, 3072
+        with tempfile.TemporaryDirectory() as extractDir:
+            makeJGWInput(extractDir, numOfImages, size)
+
+            baseline = residentMemory()
+            peak = baseline
+            numOfCrops = 0
+            for imageAndData in boundBoxSegmentationJGW(extractDir=extractDir, stream=True):
+                # Each segmented image is dropped once it is consumed, as the prediction does
+                numOfCrops += 1
+                peak = max(peak, residentMemory())
+            del imageAndData
+
+        self.assertEqual(numOfCrops, numOfImages * 9)
+        # Keeping every segmented image would need 12 * 9 * 3 MB, streaming only needs about one decoded input image
+        self.assertLess(peak - baseline, 3 * size * size * 3)
+
+    def test_cropWindows(self):
+        # (1, 1) starts past the top left corner, (2, 6) goes past the right edge of a 1792px wide image, where (2, 5) already is
+        windows = cropWindows([(1, 1), (2, 5), (2, 6), (4, 1)], width=1792, height=2048)
+
+        np.testing.assert_array_equal(windows, [[0, 0, 1, 1], [768, 128, 2, 5], [0, 640, 4, 1]])
+        self.assertEqual(windows.dtype, np.int32)
+        self.assertEqual(cropWindows([], width=1024, height=1024).shape, (0, 4))
+
+    def test_planWindows_covers_a_cluster_with_fewer_windows(self):
+        # A 3 x 3 cluster of chunks of interest, which cropWindows gives 9 windows for
+        chunksOfInterest = [(row, col) for row in range(3, 6) for col in range(3, 6)]
+        windows = planWindows(chunksOfInterest, width=4000, height=4000)
+
+        self.assertEqual(len(cropWindows(chunksOfInterest, width=4000, height=4000)), 9)
+        self.assertEqual(len(windows), 4)
+        self.assertEqual(windows.dtype, np.int32)
+        # Each window has the row and column of its own chunk of interest
+        self.assertEqual(len({(row, col) for _, _, row, col in windows.tolist()}), len(windows))
+        self.assertTrue({(row, col) for _, _, row, col in windows.tolist()} <= set(chunksOfInterest))
+
+    def test_planWindows_keeps_chunks_inside_the_margin(self):
+        rng = np.random.default_rng(0)
+        for _ in range(20):
+            chunksOfInterest = rng.integers(0, 16, (rng.integers(1, 40), 2)).tolist()
+            windows = planWindows(chunksOfInterest, width=4096, height=4096)
+
+            for row, col in chunksOfInterest:
+                # At least 256px from each edge of a window, except for the edges of the image
+                self.assertTrue(any(insideMargin(row * 256, topY, 4096) and insideMargin(col * 256, topX, 4096) for topX, topY, _, _ in windows.tolist()))
+            self.assertLessEqual(len(windows), len(cropWindows(chunksOfInterest, width=4096, height=4096)))
+
+    def test_planWindows_with_the_centred_margin_matches_cropWindows(self):
+        rng = np.random.default_rng(1)
+        for _ in range(20):
+            chunksOfInterest = rng.integers(0, 16, (rng.integers(1, 40), 2)).tolist()
+            np.testing.assert_array_equal(planWindows(chunksOfInterest, width=4000, height=3000, interiorMargin=384),
+                                          cropWindows(chunksOfInterest, width=4000, height=3000))
+
+    def test_planAdaptiveWindows_sizes_windows_to_their_chunks(self):
+        # An isolated chunk, two neighbouring chunks, and a 3 x 3 cluster
+        chunksOfInterest = [(2, 2), (2, 8), (2, 9)] + [(row, col) for row in range(8, 11) for col in range(3, 6)]
+        windows = planAdaptiveWindows(chunksOfInterest, width=4096, height=4096)
+
+        np.testing.assert_array_equal(windows, [[384, 384, 2, 2, 512], [1920, 256, 2, 8, 768], [640, 1920, 8, 3, 1024]])
+        # At the edge of the image the window is moved back inside it
+        np.testing.assert_array_equal(planAdaptiveWindows([(0, 15)], width=4000, height=4000), [[3488, 0, 0, 15, 512]])
+
+    @patch('imageSegmentation.boundBoxSegmentation.classificationSegmentation')
+    def test_segmentationWindows_keep_chunks_at_the_edge_inside(self, mock_classification):
+        # Like classificationSegmentation, the chunks are clamped unless asked not to be
+        def classify(chunks, width, height):
+            bounds = getFilteringBounds(width, height, 256, 1024)
+            return lambda clamp=True, **kwargs: [clampRowCol(row, col, *bounds) for row, col in chunks] if clamp else chunks
+
+        rng = np.random.default_rng(0)
+        layouts = [[(0, 0)], [(0, 15), (15, 0)], [(15, 15), (14, 15)]] + [[tuple(chunk) for chunk in rng.integers(0, 16, (4, 2))] for _ in range(20)]
+        imageArray = np.broadcast_to(np.zeros((1, 1, 3), dtype=np.uint8), (4000, 4000, 3))
+        for windowPlanning in ["centred", "cover", "adaptive"]:
+            for chunks in layouts:
+                mock_classification.side_effect = classify(chunks, 4000, 4000)
+                _, windows = segmentationWindows("image.jpg", imageArray=imageArray, windowPlanning=windowPlanning)
+                sizes = windowSizes(windows)
+                # Every chunk of interest is whole inside one of the windows
+                for row, col in chunks:
+                    inside = ((windows[:, 0] <= col * 256) & (windows[:, 0] + sizes >= min(col * 256 + 256, 4000)) &
+                              (windows[:, 1] <= row * 256) & (windows[:, 1] + sizes >= min(row * 256 + 256, 4000)))
+                    self.assertTrue(inside.any(), (windowPlanning, chunks, (row, col)))
+                # The rows and columns the boxes are deduplicated by are still the clamped ones
+                bounds = getFilteringBounds(4000, 4000, 256, 1024)
+                for row, col in windows[:, 2:4].tolist():
+                    self.assertEqual(clampRowCol(row, col, *bounds), (row, col))
+
+        # The chunk at the corner gets a small window at the corner, rather than one around the clamped chunk
+        mock_classification.side_effect = classify([(0, 0)], 4000, 4000)
+        _, windows = segmentationWindows("image.jpg", imageArray=imageArray, windowPlanning="adaptive")
+        np.testing.assert_array_equal(windows, [[0, 0, 1, 1, 512]])
+
+    @patch('imageSegmentation.boundBoxSegmentation.classificationSegmentation')
+    def test_boundBoxSegmentationJGW_adaptive_crops(self, mock_classification):
+        mock_classification.return_value = [(1, 1), (4, 4), (4, 5)]
+        with tempfile.TemporaryDirectory() as extractDir:
+            makeJGWInput(extractDir, 1, 2048)
+            image = np.asarray(Image.open(os.path.join(extractDir, "image0.jpg")))
+            result = boundBoxSegmentationJGW(extractDir=extractDir, windowPlanning="adaptive")
+
+        self.assertEqual([item[1].size for item in result], [(512, 512), (768, 768)])
+        for _, cropped, _, _, topLeftXGeo, topLeftYGeo, _, _ in result:
+            topX, topY = round((topLeftXGeo - 530000) / 0.25), round((180000 - topLeftYGeo) / 0.25)
+            np.testing.assert_array_equal(np.asarray(cropped), image[topY:topY + cropped.size[1], topX:topX + cropped.size[0]])
+
+    def test_unknown_windowPlanning(self):
+        with self.assertRaises(ValueError):
+            boundBoxSegmentationJGW(extractDir="test/backendTests/testInput/BBSegInput", windowPlanning="grid")
+
+    @patch('imageSegmentation.boundBoxSegmentation.classificationSegmentation')
+    def test_boundBoxSegmentationJGW_decodes_each_image_once(self, mock_classification):
+        mock_classification.return_value = [(1, 1), (5, 5)]
+        with tempfile.TemporaryDirectory() as extractDir:
+            makeJGWInput(extractDir, 2, 1536)
+            with patch('PIL.ImageFile.ImageFile.load', autospec=True, side_effect=ImageFile.ImageFile.load) as mock_load:
+                result = boundBoxSegmentationJGW(extractDir=extractDir)
+
+        self.assertEqual(len(result), 4)
+        self.assertEqual(mock_load.call_count, 2)
+        # The classification is given the decoded image rather than opening the file again
+        for call in mock_classification.call_args_list:
+            self.assertEqual(call.kwargs["imageArray"].shape, (1536, 1536, 3))
+
+    @patch('imageSegmentation.boundBoxSegmentation.classificationSegmentation')
+    @patch('imageSegmentation.boundBoxSegmentation.coarseClassification')
+    def test_boundBoxSegmentationJGW_coarse_to_fine(self, mock_coarse, mock_classification):
+        mock_classification.return_value = [(1, 1)]
+        with tempfile.TemporaryDirectory() as extractDir:
+            makeJGWInput(extractDir, 1, 1536)
+            # Nothing is found by the coarse pass, so the image is never decoded in full or classified
+            mock_coarse.return_value = np.zeros((6, 6), dtype=bool)
+            with patch('PIL.ImageFile.ImageFile.load', autospec=True, side_effect=ImageFile.ImageFile.load) as mock_load:
+                result = boundBoxSegmentationJGW(extractDir=extractDir, classificationCoarseFactor=4)
+            self.assertEqual(result, [])
+            self.assertEqual(mock_load.call_count, 0)
+            mock_classification.assert_not_called()
+
+            # Otherwise only the chunks found by the coarse pass are classified
+            tileMask = np.zeros((6, 6), dtype=bool)
+            tileMask[0:2, 0:2] = True
+            mock_coarse.return_value = tileMask
+            result = boundBoxSegmentationJGW(extractDir=extractDir, classificationCoarseFactor=4)
+        self.assertEqual(len(result), 1)
+        self.assertEqual(mock_coarse.call_args.args[1:5], (1536, 1536, 256, 4))
+        self.assertIs(mock_classification.call_args.kwargs["tileMask"], tileMask)
+        self.assertIsNone(mock_classification.call_args.kwargs["coarseFactor"])
+
+    def test_boundBoxSegmentationJGW_processes_matches_serial(self):
+        with tempfile.TemporaryDirectory() as extractDir:
+            makeJGWInput(extractDir, 3, 1536)
+            serial = boundBoxSegmentationJGW(extractDir=extractDir)
+            # The worker processes load their own classifier, so the real one is used in both
+            sharedBefore = set(os.listdir("/dev/shm"))
+            with patch('imageSegmentation.boundBoxSegmentation.loadImageArray') as mock_load:
+                parallel = boundBoxSegmentationJGW(extractDir=extractDir, processes=2)
+            # The images are only decoded by the workers, and the shared memory they were sent back in is removed
+            mock_load.assert_not_called()
+            self.assertEqual(set(os.listdir("/dev/shm")) - sharedBefore, set())
+
+        self.assertEqual([item[:1] + item[2:] for item in parallel], [item[:1] + item[2:] for item in serial])
+        for parallelItem, serialItem in zip(parallel, serial):
+            self.assertEqual(parallelItem[1].tobytes(), serialItem[1].tobytes())
+
+    @patch('imageSegmentation.boundBoxSegmentation.classificationSegmentation')
+    def test_shared_segmented_images(self, mock_classification):
+        mock_classification.return_value = [(1, 1), (4, 4), (4, 5)]
+        with tempfile.TemporaryDirectory() as extractDir:
+            makeJGWInput(extractDir, 1, 2048)
+            expected = boundBoxSegmentationJGW(extractDir=extractDir, windowPlanning="adaptive")
+            inputFileName, sharedCrops = shareSegmentedImagesJGW("image0.jpg", extractDir=extractDir, windowPlanning="adaptive")
+            shared = list(cropSharedImageJGW(inputFileName, sharedCrops))
+
+            # The block is removed even when the segmented images are not all consumed
+            _, sharedCrops = shareSegmentedImagesJGW("image0.jpg", extractDir=extractDir, windowPlanning="adaptive")
+            segmented = cropSharedImageJGW(inputFileName, sharedCrops)
+            next(segmented)
+            segmented.close()
+            self.assertFalse(os.path.exists(os.path.join("/dev/shm", sharedCrops[0])))
+
+        self.assertEqual([item[:1] + item[2:] for item in shared], [item[:1] + item[2:] for item in expected])
+        for sharedItem, expectedItem in zip(shared, expected):
+            self.assertEqual(sharedItem[1].size, expectedItem[1].size)
+            self.assertEqual(sharedItem[1].tobytes(), expectedItem[1].tobytes())
+        # An image without segmented images has no block
+        self.assertEqual(list(cropSharedImageJGW("image0.jpg", None)), [])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -1,10 +1,15 @@
 import unittest
+from unittest.mock import patch
+from osgeo import gdal
+from PIL import Image
+import numpy as np
 import os
 import sys
+import tempfile
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
 
-from imageSegmentation.classificationSegmentation import classificationSegmentation
+from imageSegmentation.classificationSegmentation import classificationSegmentation, coarseToFineMask, clampRowCol, getFilteringBounds
 
 class TestClassificationSegmentation(unittest.TestCase):
 
@@ -35,5 +40,103 @@ class TestClassificationSegmentation(unittest.TestCase):
         expected = []
         self.assertEqual(result, expected)
 
+    def test_classificationSegmentation_prescreen(self):
+        counts = {}
+        result = classificationSegmentation("test/backendTests/testInput/blank.png", 0.35, 256, 1024, prescreen=True, counts=counts)
+
+        # Every chunk of the blank image is skipped, so none are classified
+        self.assertEqual(result, [])
+        self.assertEqual(counts, {"tiles": 4, "skipped": 4, "classified": 0, "positive": 0, "decodedPixels": 512 * 512})
+
+        # The image with something in it is classified as before
+        counts = {}
+        result = classificationSegmentation("test/backendTests/testInput/512x512.jpg", 0.35, 256, 1024, prescreen=True, counts=counts)
+        self.assertEqual(result, classificationSegmentation("test/backendTests/testInput/512x512.jpg", 0.35, 256, 1024))
+        self.assertEqual(counts["skipped"] + counts["classified"], counts["tiles"])
+
+    def test_classificationSegmentation_unclamped(self):
+        inputFileName = "test/backendTests/testInput/512x512.jpg"
+        clamped = classificationSegmentation(inputFileName, 0.35, 256, 1024)
+        unclamped = classificationSegmentation(inputFileName, 0.35, 256, 1024, clamp=False)
+
+        # The same chunks are found, but where they are rather than where a centred 1024 pixel window fits
+        bounds = getFilteringBounds(512, 512, 256, 1024)
+        self.assertEqual([clampRowCol(row, col, *bounds) for row, col in unclamped], clamped)
+        self.assertTrue(all(0 <= row < 2 and 0 <= col < 2 for row, col in unclamped))
+
+    def test_coarseToFineMask(self):
+        # Each chunk of the copy covers 4 by 4 chunks of the image
+        mask = coarseToFineMask([[0, 1]], 2048, 2048, 256, 4)
+        expected = np.zeros((8, 8), dtype=bool)
+        expected[0:4, 4:8] = True
+        np.testing.assert_array_equal(mask, expected)
+
+        # The shifted last chunk of the copy also covers the shifted last chunk of the image
+        mask = coarseToFineMask([[1, 2]], 2100, 2048, 256, 4)
+        self.assertEqual(mask.shape, (8, 9))
+        self.assertEqual(np.argwhere(mask.any(axis=0)).ravel().tolist(), [4, 5, 6, 7, 8])
+        self.assertEqual(np.argwhere(mask.any(axis=1)).ravel().tolist(), [4, 5, 6, 7])
+        self.assertFalse(coarseToFineMask(np.empty((0, 2), dtype=int), 2048, 2048, 256, 4).any())
+
+    def test_classificationSegmentation_coarse_to_fine(self):
+        inputFileName = "test/backendTests/testInput/512x512.jpg"
+        expected = classificationSegmentation(inputFileName, 0.35, 256, 1024)
+
+        # Every chunk passes the coarse pass, so the result is the same as without it
+        counts = {}
+        result = classificationSegmentation(inputFileName, 0.35, 256, 1024, counts=counts, coarseFactor=2, coarseThreshold=0.0)
+        self.assertEqual(result, expected)
+        self.assertEqual(counts["classified"], 4)
+        self.assertEqual(counts["decodedPixels"], 256 * 256 + 512 * 512)
+
+        # No chunk passes the coarse pass, so the image is only decoded at half the size
+        counts = {}
+        result = classificationSegmentation(inputFileName, 0.35, 256, 1024, counts=counts, coarseFactor=2, coarseThreshold=1.0)
+        self.assertEqual(result, [])
+        self.assertEqual(counts["classified"], 0)
+        self.assertEqual(counts["decodedPixels"], 256 * 256)
+
+    def test_classificationSegmentation_coarse_to_fine_tif_without_overviews(self):
+        imageArray = np.asarray(Image.open("test/backendTests/testInput/512x512.jpg").convert("RGB"))
+        with tempfile.TemporaryDirectory() as directory:
+            inputFileName = os.path.join(directory, "image.tif")
+            dataset = gdal.GetDriverByName("GTiff").Create(inputFileName, 512, 512, 3, gdal.GDT_Byte, options=["TILED=YES"])
+            for band in range(3):
+                dataset.GetRasterBand(band + 1).WriteArray(imageArray[..., band])
+            dataset = None
+            expected = classificationSegmentation(inputFileName, 0.35, 256, 1024)
+
+            # The smaller copy is averaged from every pixel of the image, as it is for a JPEG image
+            counts = {}
+            result = classificationSegmentation(inputFileName, 0.35, 256, 1024, counts=counts, coarseFactor=2, coarseThreshold=0.0)
+            self.assertEqual(result, expected)
+            self.assertEqual(counts["classified"], 4)
+            self.assertEqual(counts["decodedPixels"], 512 * 512 + 512 * 512)
+
+            # Without overviews the copy is read from the full resolution blocks, but nothing more is
+            counts = {}
+            result = classificationSegmentation(inputFileName, 0.35, 256, 1024, counts=counts, coarseFactor=2, coarseThreshold=1.0)
+            self.assertEqual(result, [])
+            self.assertEqual(counts["decodedPixels"], 512 * 512)
+
+    @patch('imageSegmentation.classificationSegmentation.imageRegionOfInterestMask')
+    def test_classificationSegmentation_regionOfInterest(self, mock_region):
+        inputFileName = "test/backendTests/testInput/512x512.jpg"
+        regionMask = np.zeros((2, 2), dtype=bool)
+        regionMask[1, 0] = True
+        mock_region.return_value = regionMask
+
+        counts = {}
+        result = classificationSegmentation(inputFileName, 0.35, 256, 1024, counts=counts, regionOfInterest="roads.gpkg")
+        self.assertEqual(mock_region.call_args.args[:5], (inputFileName, "roads.gpkg", 512, 512, 256))
+        self.assertEqual(counts["classified"], 1)
+        self.assertLessEqual(len(result), 1)
+
+        # Nothing is near a road, so the image is never decoded
+        mock_region.return_value = np.zeros((2, 2), dtype=bool)
+        counts = {}
+        self.assertEqual(classificationSegmentation(inputFileName, 0.35, 256, 1024, counts=counts, regionOfInterest="roads.gpkg"), [])
+        self.assertEqual((counts["classified"], counts["decodedPixels"]), (0, 0))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,93 @@
+import unittest
+import sys
+import os
+import json
+import tempfile
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from utils.detectionSet import DetectionSet
+from utils.filterOutput import removeDuplicateBoxesRC, removeDuplicateDetections, combineChunksToBaseName
+from utils.saveToOutput import saveToOutput
+
+box = [(0, 0), (1, 0), (1, 1), (0, 1)]
+otherBox = [(5, 5), (6, 5), (6, 6), (5, 6)]
+
+class TestDetectionSet(unittest.TestCase):
+
+    def makeDetections(self):
+        detections = DetectionSet()
+        detections.add("image1", 1, 1, [box, otherBox], [0.9, 0.5])
+        detections.add("image2", 1, 1, [box], [0.7])
+        detections.add("image1", 1, 2, [box], [0.8])
+        detections.add("image1", 1, 3, np.empty((0, 4, 2)), [])
+        return detections
+
+    def test_columns(self):
+        detections = self.makeDetections()
+
+        self.assertEqual(len(detections), 4)
+        self.assertEqual(detections.imageNames, ["image1", "image2"])
+        self.assertEqual(detections.corners.shape, (4, 4, 2))
+        self.assertEqual(detections.corners.dtype, np.float64)
+        self.assertEqual(detections.conf.dtype, np.float32)
+        for column in (detections.imageIds, detections.rows, detections.cols):
+            self.assertEqual(column.dtype, np.int32)
+        np.testing.assert_array_equal(detections.imageIds, [0, 0, 1, 0])
+
+    def test_imageView_is_zero_copy(self):
+        detections = self.makeDetections()
+
+        corners, conf, rows, cols = detections.imageView(0)
+
+        # Sorting by image keeps the order the detections of each image were added in
+        np.testing.assert_array_equal(conf, np.float32([0.9, 0.5, 0.8]))
+        np.testing.assert_array_equal(cols, [1, 1, 2])
+        self.assertTrue(np.shares_memory(corners, detections.corners))
+        self.assertTrue(np.shares_memory(conf, detections.conf))
+
+    def test_remove(self):
+        detections = self.makeDetections()
+        detections.remove(detections.conf < 0.75)
+
+        self.assertEqual(detections.toImageDetections(), {"image1": [[box, box], [np.float32(0.9).item(), np.float32(0.8).item()]]})
+
+    def test_toRowColDict(self):
+        detections = self.makeDetections()
+        expected = {
+            "image1__r1__c1": [[box, otherBox], [np.float32(0.9).item(), np.float32(0.5).item()]],
+            "image1__r1__c2": [[box], [np.float32(0.8).item()]],
+            "image2__r1__c1": [[box], [np.float32(0.7).item()]],
+        }
+        self.assertEqual(detections.toRowColDict(), expected)
+
+    def test_removeDuplicateDetections_matches_dictionary(self):
+        detections = self.makeDetections()
+        imageDetectionsRowCol = detections.toRowColDict()
+
+        removeDuplicateDetections(detections)
+        removeDuplicateBoxesRC(imageDetectionsRowCol)
+
+        self.assertEqual(detections.toImageDetections(), combineChunksToBaseName(imageDetectionsRowCol))
+        self.assertEqual(len(detections), 3)
+
+    def test_saveToOutput(self):
+        detections = self.makeDetections()
+        with tempfile.TemporaryDirectory() as outputFolder:
+            saveToOutput("0", outputFolder, detections)
+            with open(os.path.join(outputFolder, "output.json")) as file:
+                fromDetectionSet = json.load(file)
+            saveToOutput("0", outputFolder, detections.toImageDetections())
+            with open(os.path.join(outputFolder, "output.json")) as file:
+                fromDictionary = json.load(file)
+
+            saveToOutput("1", outputFolder, detections)
+            with open(os.path.join(outputFolder, "image2.txt")) as file:
+                lines = file.read().splitlines()
+
+        self.assertEqual(fromDetectionSet, fromDictionary)
+        self.assertEqual([entry["image"] for entry in fromDetectionSet], ["image1", "image2"])
+        self.assertEqual(lines, [f"0.0,0.0 1.0,0.0 1.0,1.0 0.0,1.0 {np.float32(0.7).item()}"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+import numpy as np
+import os
+import sys
+import torch
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from classificationScreening.engine import ClassifierEngine
+
+class MeanClassifier(torch.nn.Module):
+    """Scores each image by the mean of its pixels, so the scores show how the input was scaled"""
+    def forward(self, images):
+        return images.mean(dim=(1, 2, 3)).unsqueeze(1)
+
+class TestClassifierEngine(unittest.TestCase):
+
+    def test_uint8_input(self):
+        for compileMode in [None, "trace"]:
+            engine = ClassifierEngine(model=MeanClassifier(), compile_mode=compileMode, tile_size=8, warmup_batch_size=2)
+            images = np.full((2, 3, 8, 8), 255, dtype=np.uint8)
+            images[1] = 0
+
+            # The images are scaled to [0, 1] inside the model, before the sigmoid
+            np.testing.assert_allclose(engine.infer(images)[:, 0], torch.sigmoid(torch.tensor([1.0, 0.0])).numpy(), rtol=1e-6)
+            # A single image is batched
+            self.assertEqual(engine.infer(images[0]).shape, (1, 1))
+            self.assertEqual(engine.array_batch_infer(images, threshold=0.6).tolist(), [True, False])
+
+    def test_rejects_other_types(self):
+        engine = ClassifierEngine(model=MeanClassifier(), compile_mode=None, tile_size=8, warmup_batch_size=2)
+        # Floats would lose precision, and values outside [0, 255] would wrap around, if they were cast to uint8
+        for images in [np.full((1, 3, 8, 8), 0.5, dtype=np.float32), torch.full((1, 3, 8, 8), 300, dtype=torch.int16)]:
+            with self.assertRaises(ValueError):
+                engine.infer(images)
+
+if __name__ == '__main__':
+    unittest.main()
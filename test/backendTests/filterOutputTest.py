@@ -1,6 +1,7 @@
 import unittest
 import sys
 import os
+import numpy as np
 from tqdm import tqdm
 
 
@@ -10,6 +11,7 @@ from utils.filterOutput import (
     checkBoxIntersection,
     extractBaseNameAndCoords,
     removeDuplicateBoxesRC,
+    scaledIous,
 )
 
 class TestImageDetectionFunctions(unittest.TestCase):
@@ -64,6 +66,26 @@ class TestImageDetectionFunctions(unittest.TestCase):
         box2 = [(1, 1), (3, 1), (3, 3), (1, 3)]  # Area = 4
         self.assertFalse(checkBoxIntersection(box1, box2))
 
+    def test_scaledIous(self):
+        boxes1 = np.array([
+            [(0, 0), (1, 0), (1, 1), (0, 1)],  # Identical boxes
+            [(0, 0), (2, 0), (2, 2), (0, 2)],  # A box inside a larger box
+            [(0, 0), (2, 0), (2, 2), (0, 2)],  # Half overlapping boxes
+            [(0, 0), (1, 0), (1, 1), (0, 1)],  # Far apart boxes, skipped by their bounding circles
+            [(0, 0), (0, 0), (0, 0), (0, 0)],  # A box without area
+        ], dtype=np.float64)
+        boxes2 = np.array([
+            [(0, 0), (1, 0), (1, 1), (0, 1)],
+            [(0, 0), (1, 0), (1, 1), (0, 1)],
+            [(1, 0), (3, 0), (3, 2), (1, 2)],
+            [(5, 5), (6, 5), (6, 6), (5, 6)],
+            [(0, 0), (1, 0), (1, 1), (0, 1)],
+        ], dtype=np.float64)
+
+        result = scaledIous(boxes1, boxes2)
+
+        np.testing.assert_allclose(result, [1, 1, 1 / 3, 0, 0])
+        self.assertEqual(scaledIous(np.empty((0, 4, 2)), np.empty((0, 4, 2))).shape, (0,))
 
     def test_removeDuplicateBoxesRC(self):
         # Test filtering boxes across neighboring chunks
@@ -90,5 +112,26 @@ class TestImageDetectionFunctions(unittest.TestCase):
         }
         self.assertEqual(imageDetectionsRowCol, expected)
 
+    def test_removeDuplicateBoxesRC_ties_and_distant_chunks(self):
+        box = [(0, 0), (1, 0), (1, 1), (0, 1)]
+        otherBox = [(5, 5), (6, 5), (6, 6), (5, 6)]
+        imageDetectionsRowCol = {
+            # With equal confidences, the box of the chunk being filtered is removed
+            "image1__r1__c1": [[box, otherBox], [0.8, 0.5]],
+            "image1__r2__c1": [[box], [0.8]],
+            # Too far from the other chunks to overlap them, so its box is kept
+            "image1__r1__c20": [[box], [0.9]],
+            # Boxes from different images are never duplicates
+            "image2__r1__c1": [[box], [0.9]],
+        }
+        removeDuplicateBoxesRC(imageDetectionsRowCol, boundBoxChunkSize=1024, classificationChunkSize=256)
+        expected = {
+            "image1__r1__c1": [[otherBox], [0.5]],
+            "image1__r2__c1": [[box], [0.8]],
+            "image1__r1__c20": [[box], [0.9]],
+            "image2__r1__c1": [[box], [0.9]],
+        }
+        self.assertEqual(imageDetectionsRowCol, expected)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
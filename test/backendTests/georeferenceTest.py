@@ -1,10 +1,14 @@
 import unittest
 import sys
 import os
+import tempfile
+import threading
+import numpy as np
 from osgeo import gdal, osr
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
 from georeference.georeference import georeferenceTIF, georefereceJGW, BNGtoLatLong
+from georeference import georeference
 
 class TestGeoreferencingFunctions(unittest.TestCase):
 
@@ -117,5 +121,70 @@ class TestGeoreferencingFunctions(unittest.TestCase):
         # Clean up the dummy file
         os.remove('dummy.tif')
 
+    def test_pixelToGeo(self):
+        # A geotransform with rotation terms, so that both pixel axes affect both coordinates
+        geotransform = (100, 10, 2, 200, 3, -10)
+        pixelCorners = np.array([[[0, 0], [1, 0], [1, 1], [0, 1]],
+                                 [[2, 2], [3, 2], [3, 3], [2, 3]]], dtype=np.float64)
+
+        result = georeference.pixelToGeo(pixelCorners, geotransform)
+
+        x, y = pixelCorners[..., 0], pixelCorners[..., 1]
+        expected = np.stack([100 + x * 10 + y * 2, 200 + x * 3 + y * -10], axis=-1)
+        self.assertEqual(result.shape, (2, 4, 2))
+        np.testing.assert_allclose(result, expected)
+
+    def test_georeferenceCorners(self):
+        pixelCorners = np.array([[[0, 0], [1, 0], [1, 1], [0, 1]],
+                                 [[2, 2], [3, 2], [3, 3], [2, 3]]], dtype=np.float64)
+        geotransform = georeference.jgwGeotransform(10, -10, 530000, 180000)
+
+        result = georeference.georeferenceCorners(pixelCorners, geotransform, 27700)
+
+        # Every box matches the scalar functions
+        self.assertEqual(result.shape, (2, 4, 2))
+        for box, latLongs in zip(pixelCorners, result):
+            listOfPoints = georefereceJGW(*box.ravel(), 10, -10, 530000, 180000)
+            np.testing.assert_allclose(latLongs, BNGtoLatLong(listOfPoints))
+
+        # No boxes gives no coordinates
+        self.assertEqual(georeference.georeferenceCorners(np.empty((0, 4, 2)), geotransform, 27700).shape, (0, 4, 2))
+
+    def test_transformer_cache(self):
+        georeference.clearTransformerCache()
+        transform = georeference.getTransformer(27700)
+        self.assertIs(georeference.getTransformer(27700), transform)
+
+        # The same projection given as WKT is cached separately, under the WKT itself
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(27700)
+        wkt = srs.ExportToWkt()
+        wktTransform = georeference.getTransformer(wkt)
+        self.assertIs(georeference.getTransformer(wkt), wktTransform)
+        self.assertEqual(wktTransform.TransformPoint(530000, 180000), transform.TransformPoint(530000, 180000))
+
+        # Each thread builds its own transformation
+        otherThread = []
+        thread = threading.Thread(target=lambda: otherThread.append(georeference.getTransformer(27700)))
+        thread.start()
+        thread.join()
+        self.assertIsNot(otherThread[0], transform)
+
+    def test_transformer_cache_eviction(self):
+        georeference.clearTransformerCache()
+        first = georeference.getTransformer(27700)
+        for epsg in range(32601, 32601 + georeference.transformerCacheSize):
+            georeference.getTransformer(epsg)
+        self.assertIsNot(georeference.getTransformer(27700), first)
+
+    def test_readJGWGeotransform(self):
+        with tempfile.TemporaryDirectory() as directory:
+            jgwPath = os.path.join(directory, "image.jgw")
+            with open(jgwPath, "w") as jgwFile:
+                jgwFile.write("0.25\n0.01\n0.02\n-0.25\n530000.0\n180000.0\n")
+
+            # The rotation terms are kept, in GDAL's order
+            self.assertEqual(georeference.readJGWGeotransform(jgwPath), (530000.0, 0.25, 0.02, 180000.0, 0.01, -0.25))
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
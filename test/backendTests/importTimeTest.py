@@ -0,0 +1,47 @@
+import unittest
+import subprocess
+import os
+import sys
+
+repositoryRoot = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+
+# The budget can be raised on slow machines through the environment
+importTimeBudget = float(os.environ.get("SIGHTLINKS_IMPORT_BUDGET", "1.0"))
+heavyModules = ["torch", "torchvision", "ultralytics", "osgeo", "matplotlib", "shapely"]
+
+def runInFreshInterpreter(code):
+    """Runs the code in a new python process from the repository root and returns what it printed"""
+    result = subprocess.run([sys.executable, "-c", code], cwd=repositoryRoot, capture_output=True, text=True, check=True)
+    return result.stdout.strip().splitlines()
+
+class TestImportTime(unittest.TestCase):
+
+    def test_import_main_within_budget(self):
+        output = runInFreshInterpreter(
+            "import time\n"
+            "start = time.perf_counter()\n"
+            "import main\n"
+            "print(time.perf_counter() - start)\n"
+        )
+        importTime = float(output[-1])
+        self.assertLess(importTime, importTimeBudget, f"import main took {importTime:.2f}s, the budget is {importTimeBudget:.2f}s")
+
+    def test_import_main_does_not_load_heavy_libraries(self):
+        output = runInFreshInterpreter(
+            "import sys\n"
+            "import main\n"
+            f"print([name for name in {heavyModules!r} if name in sys.modules])\n"
+        )
+        self.assertEqual(output[-1], "[]")
+
+    def test_import_classify_does_not_load_the_model(self):
+        output = runInFreshInterpreter(
+            "import sys\n"
+            "from classificationScreening import classify\n"
+            "from models import registry\n"
+            "print(registry.isModelLoaded('mobileNet'), 'matplotlib' in sys.modules)\n"
+        )
+        self.assertEqual(output[-1], "False False")
+
+if __name__ == '__main__':
+    unittest.main()
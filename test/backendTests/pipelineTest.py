@@ -0,0 +1,89 @@
+import unittest
+import os
+import sys
+import random
+import threading
+import time
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from utils.pipeline import Stage, runPipeline
+
+class TestPipeline(unittest.TestCase):
+
+    def test_output_order_with_many_workers(self):
+        rng = random.Random(0)
+        delays = [rng.random() * 0.01 for _ in range(40)]
+        def split(item):
+            # Items finish out of order, and each one becomes two
+            time.sleep(delays[item])
+            return [item, item + 0.5]
+        def double(item):
+            time.sleep(delays[int(item)] / 2)
+            return [item * 2]
+
+        output = list(runPipeline(range(40), [Stage("split", split, workers=4), Stage("double", double, workers=3)]))
+
+        self.assertEqual(output, [value * 2 for item in range(40) for value in (item, item + 0.5)])
+
+    def test_batches_keep_order(self):
+        stages = [
+            Stage("drop", lambda item: [item] if item % 3 else [], workers=2),
+            Stage("batch", lambda batch: [tuple(batch)], workers=2, batchSize=4),
+        ]
+
+        output = list(runPipeline(range(20), stages))
+
+        kept = [item for item in range(20) if item % 3]
+        self.assertEqual(output, [tuple(kept[i:i + 4]) for i in range(0, len(kept), 4)])
+
+    def test_stages_overlap(self):
+        def wait(item):
+            time.sleep(0.02)
+            return [item]
+        stages = [Stage(str(i), wait) for i in range(3)]
+
+        start = time.perf_counter()
+        output = list(runPipeline(range(20), stages))
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(output, list(range(20)))
+        # Run one after another the stages would take 3 * 20 * 0.02 = 1.2 seconds
+        self.assertLess(elapsed, 0.9)
+
+    def test_backpressure_bounds_items_in_flight(self):
+        started = []
+        def source(item):
+            started.append(item)
+            return [item]
+
+        output = runPipeline(range(1000), [Stage("source", source, queueSize=2), Stage("sink", lambda item: [item], queueSize=2)], outputQueueSize=2)
+        self.assertEqual(next(output), 0)
+        time.sleep(0.3)
+
+        # Nothing is consumed, so only the items that fit in the queues have been started
+        self.assertLess(len(started), 20)
+        output.close()
+
+    def test_error_is_raised_and_threads_stop(self):
+        def fail(item):
+            if item == 5:
+                raise ValueError("bad item")
+            return [item]
+        threadsBefore = threading.active_count()
+
+        with self.assertRaises(RuntimeError) as context:
+            list(runPipeline(range(100), [Stage("fail", fail, workers=2), Stage("pass", lambda item: [item])]))
+
+        self.assertIsInstance(context.exception.__cause__, ValueError)
+        self.assertIn("fail", str(context.exception))
+        time.sleep(0.5)
+        self.assertEqual(threading.active_count(), threadsBefore)
+
+    def test_stage_needs_a_worker(self):
+        with self.assertRaises(ValueError):
+            Stage("none", lambda item: [item], workers=0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -12,7 +12,19 @@ from tqdm import tqdm
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
 
 # Import the functions to be tested
-from orientedBoundingBox.predictOBB import predictionJGW, predictionTIF
+from orientedBoundingBox.predictOBB import predictionJGW, predictionTIF, pipelinedPrediction, exportedModelPath, loadDetectionModel
+from imageSegmentation.boundBoxSegmentation import boundBoxSegmentationTIF
+from models import registry
+sys.path.append(os.path.dirname(__file__))
+from rasterWindowTest import ArrayDataset
+
+class GeoArrayDataset(ArrayDataset):
+    """An ArrayDataset with the georeferencing data of a GeoTIFF"""
+    def GetGeoTransform(self):
+        return (530000, 0.25, 0, 180000, 0, -0.25)
+
+    def GetProjection(self):
+        return "EPSG:27700"
 
 class TestPredictionFunctions(unittest.TestCase):
 
@@ -20,6 +32,8 @@ class TestPredictionFunctions(unittest.TestCase):
         # Create a temporary directory for testing
         self.temp_dir = tempfile.TemporaryDirectory()
         self.output_folder = self.temp_dir.name
+        # The mocked YOLO models must not be reused between tests
+        registry.modelCache.clear()
 
     def tearDown(self):
         # Clean up the temporary directory
@@ -30,15 +44,78 @@ class TestPredictionFunctions(unittest.TestCase):
         mock_model = MagicMock()
         mock_result = MagicMock()
         mock_result.cpu.return_value = mock_result
-        mock_result.obb.conf = [torch.tensor(0.9), torch.tensor(0.8)]  # Confidence scores
-        mock_result.obb.xyxyxyxy = [
-            torch.tensor([[0, 0], [1, 0], [1, 1], [0, 1]]),
-            torch.tensor([[0.5, 0.5], [1.5, 0.5], [1.5, 1.5], [0.5, 1.5]]),
-        ]
+        mock_result.obb.conf = torch.tensor([0.9, 0.8])  # Confidence scores
+        mock_result.obb.xyxyxyxy = torch.tensor([
+            [[0, 0], [1, 0], [1, 1], [0, 1]],
+            [[0.5, 0.5], [1.5, 0.5], [1.5, 1.5], [0.5, 1.5]],
+        ])
         mock_model.return_value = [mock_result]  # Mock the __call__ method
         return mock_model
 
 
+    def test_exportedModelPath(self):
+        self.assertEqual(exportedModelPath("models/yolo-n.pt", "torch"), "models/yolo-n.pt")
+        self.assertEqual(exportedModelPath("models/yolo-n.pt", "onnx"), "models/yolo-n.onnx")
+        self.assertEqual(exportedModelPath("models/yolo-n.pt", "openvino"), "models/yolo-n_openvino_model")
+
+    def mock_files(self, modifiedTimes):
+        # Only the files in modifiedTimes exist, and were last modified at the given times
+        return (patch('os.path.exists', side_effect=lambda path: path in modifiedTimes),
+                patch('os.path.getmtime', side_effect=lambda path: modifiedTimes[path]))
+
+    @patch('orientedBoundingBox.predictOBB.YOLO')  # Mock the YOLO class
+    def test_loadDetectionModel_exports_once(self, mock_yolo):
+        for backend, exportPath in [("onnx", "models/yolo-n.onnx"), ("openvino", "models/yolo-n_openvino_model")]:
+            mock_yolo.reset_mock()
+            mock_yolo.return_value.export.return_value = exportPath
+            mockExists, mockModified = self.mock_files({"models/yolo-n.pt": 100})
+            with mockExists, mockModified:
+                loadDetectionModel("n", backend)
+            # Without an export, the .pt model is exported with dynamic axes, then the export is loaded
+            self.assertEqual(mock_yolo.call_args_list[0].args, ("models/yolo-n.pt",))
+            mock_yolo.return_value.export.assert_called_once_with(format=backend, dynamic=True)
+            self.assertEqual(mock_yolo.call_args_list[1].args, (exportPath,))
+            self.assertEqual(mock_yolo.call_args_list[1].kwargs, {"task": "obb"})
+
+            # An export newer than the .pt file is loaded as it is
+            registry.modelCache.clear()
+            mock_yolo.reset_mock()
+            mockExists, mockModified = self.mock_files({"models/yolo-n.pt": 100, exportPath: 200})
+            with mockExists, mockModified:
+                loadDetectionModel("n", backend)
+            mock_yolo.return_value.export.assert_not_called()
+            mock_yolo.assert_called_once_with(exportPath, task="obb")
+
+    @patch('orientedBoundingBox.predictOBB.YOLO')  # Mock the YOLO class
+    def test_loadDetectionModel_exports_again_when_changed(self, mock_yolo):
+        mock_yolo.return_value.export.return_value = "models/yolo-n.onnx"
+        # The .pt file was changed after it was exported
+        mockExists, mockModified = self.mock_files({"models/yolo-n.pt": 300, "models/yolo-n.onnx": 200})
+        with mockExists, mockModified:
+            loadDetectionModel("n", "onnx")
+        mock_yolo.return_value.export.assert_called_once_with(format="onnx", dynamic=True)
+
+    @patch('orientedBoundingBox.predictOBB.YOLO')  # Mock the YOLO class
+    def test_loadDetectionModel_cache_key(self, mock_yolo):
+        mockExists, mockModified = self.mock_files({"models/yolo-n.pt": 100, "models/yolo-n.onnx": 200, "models/yolo-n_openvino_model": 200})
+        with mockExists, mockModified:
+            onnxModel = loadDetectionModel("n", "onnx")
+            self.assertIs(loadDetectionModel("n", "onnx"), onnxModel)
+            loadDetectionModel("n", "openvino")
+        # Each backend is cached on its own, under the .pt file and the time it was modified
+        self.assertEqual(mock_yolo.call_count, 2)
+        self.assertEqual(registry.modelCache.keys(), [("yolo-n-onnx", "models/yolo-n.pt", 100), ("yolo-n-openvino", "models/yolo-n.pt", 100)])
+
+        # Changing the .pt file loads the model again, and drops the old version
+        mockExists, mockModified = self.mock_files({"models/yolo-n.pt": 300, "models/yolo-n.onnx": 400})
+        with mockExists, mockModified:
+            loadDetectionModel("n", "onnx")
+        self.assertEqual(mock_yolo.call_count, 3)
+        self.assertEqual(registry.modelCache.keys(), [("yolo-n-openvino", "models/yolo-n.pt", 100), ("yolo-n-onnx", "models/yolo-n.pt", 300)])
+
+        with self.assertRaises(ValueError):
+            loadDetectionModel("n", "tensorrt")
+
     @patch('orientedBoundingBox.predictOBB.YOLO')  # Mock the YOLO class
     def test_predictionJGW(self, mock_yolo):
         # Mock the YOLO instance
@@ -59,17 +136,19 @@ class TestPredictionFunctions(unittest.TestCase):
         self.assertEqual(len(result["image1"][1]), 2)  # Two confidence scores
 
     @patch('orientedBoundingBox.predictOBB.YOLO')  # Mock the YOLO class
-    @patch('orientedBoundingBox.predictOBB.georeferenceTIF')
-    def test_predictionTIF(self, mock_georef_tif, mock_yolo):
+    @patch('orientedBoundingBox.predictOBB.geoToLatLong')
+    def test_predictionTIF(self, mock_geo_to_lat_long, mock_yolo):
         mock_model = self.mock_yolo_model()
         mock_yolo.return_value = mock_model
 
-        # Mock georeferenceTIF to return a valid list of points
-        mock_georef_tif.return_value = [(0, 0), (1, 0), (1, 1), (0, 1)]
+        # Mock geoToLatLong to return valid points for both boxes
+        mock_geo_to_lat_long.return_value = np.array([[(0, 0), (1, 0), (1, 1), (0, 1)]] * 2, dtype=np.float64)
 
         # Mock input data
         mock_gdal_image = MagicMock()
         mock_gdal_image.ReadAsArray.return_value = np.random.randint(0, 256, (3, 256, 256), dtype=np.uint8)
+        mock_gdal_image.GetGeoTransform.return_value = (530000, 0.1, 0, 180000, 0, -0.1)
+        mock_gdal_image.GetProjection.return_value = "EPSG:27700"
         imageAndDatas = [
             ("image1", mock_gdal_image, 1, 1)
         ]
@@ -82,6 +161,209 @@ class TestPredictionFunctions(unittest.TestCase):
         self.assertEqual(len(result["image1"][0]), 2)  # Two bounding boxes
         self.assertEqual(len(result["image1"][1]), 2)  # Two confidence scores
 
+    @patch('orientedBoundingBox.predictOBB.YOLO')  # Mock the YOLO class
+    def test_predictionJGW_batches(self, mock_yolo):
+        # Each crop gets a single box, with a confidence that tells which crop it came from
+        def batch_results(images, **kwargs):
+            results = []
+            for image in images:
+                mock_result = MagicMock()
+                mock_result.cpu.return_value = mock_result
+                mock_result.obb.conf = torch.tensor([image.getpixel((0, 0))[0] / 100])
+                mock_result.obb.xyxyxyxy = torch.tensor([[[0, 0], [1, 0], [1, 1], [0, 1]]], dtype=torch.float32)
+                results.append(mock_result)
+            return results
+        mock_model = MagicMock(side_effect=batch_results)
+        mock_yolo.return_value = mock_model
+
+        # Crops far enough apart that none of their boxes are duplicates
+        imageAndDatas = [
+            ("image1", Image.new('RGB', (256, 256), (50 + i, 0, 0)), 0.1, -0.1, 530000 + i * 1000, 180000, 1, i * 10)
+            for i in range(5)
+        ]
+
+        result = predictionJGW(imageAndDatas, saveLabeledImage=False, outputFolder=self.output_folder, batchSize=2)
+
+        self.assertEqual(mock_model.call_count, 3)  # Batches of 2, 2 and 1
+        self.assertEqual([len(call.args[0]) for call in mock_model.call_args_list], [2, 2, 1])
+        self.assertEqual(len(result["image1"][0]), 5)
+        self.assertEqual([round(conf, 2) for conf in result["image1"][1]], [0.5, 0.51, 0.52, 0.53, 0.54])
+
+    @patch('orientedBoundingBox.predictOBB.YOLO')  # Mock the YOLO class
+    def test_predictionJGW_adaptive_crops(self, mock_yolo):
+        def batch_results(images, **kwargs):
+            results = []
+            for image in images:
+                mock_result = MagicMock()
+                mock_result.cpu.return_value = mock_result
+                mock_result.obb.conf = torch.tensor([image.getpixel((0, 0))[0] / 100])
+                mock_result.obb.xyxyxyxy = torch.tensor([[[0, 0], [1, 0], [1, 1], [0, 1]]], dtype=torch.float32)
+                results.append(mock_result)
+            return results
+        mock_model = MagicMock(side_effect=batch_results)
+        mock_model.overrides = {"imgsz": 1024}
+        mock_yolo.return_value = mock_model
+
+        # Segmented images of two sizes, one after the other
+        sizes = [512, 1024, 512, 768, 512, 1024]
+        imageAndDatas = [
+            ("image1", Image.new('RGB', (size, size), (50 + i, 0, 0)), 0.1, -0.1, 530000 + i * 1000, 180000, 1, i * 10)
+            for i, size in enumerate(sizes)
+        ]
+
+        result = predictionJGW(imageAndDatas, saveLabeledImage=False, outputFolder=self.output_folder, batchSize=2, adaptiveCrops=True)
+
+        # Full batches are run as soon as they fill up, and the rest once the segmented images run out
+        batches = [([image.size[0] for image in call.args[0]], call.kwargs.get("imgsz")) for call in mock_model.call_args_list]
+        self.assertEqual(batches, [([512, 512], 512), ([1024, 1024], None), ([768], 768), ([512], 512)])
+        self.assertEqual(sorted(round(conf, 2) for conf in result["image1"][1]), [0.5, 0.51, 0.52, 0.53, 0.54, 0.55])
+
+        # The pipeline batches in order, then runs each size of a batch on its own
+        mock_model.reset_mock()
+        pipelined = pipelinedPrediction(["image1"], lambda inputFileName: iter(imageAndDatas), inputType="0", saveLabeledImage=False,
+                                        outputFolder=self.output_folder, batchSize=2, adaptiveCrops=True)
+        batches = [([image.size[0] for image in call.args[0]], call.kwargs.get("imgsz")) for call in mock_model.call_args_list]
+        self.assertEqual(batches, [([512], 512), ([1024], None), ([512], 512), ([768], 768), ([512], 512), ([1024], None)])
+        self.assertEqual(sorted(pipelined["image1"][1]), sorted(result["image1"][1]))
+
+    @patch('orientedBoundingBox.predictOBB.YOLO')  # Mock the YOLO class
+    @patch('orientedBoundingBox.predictOBB.geoToLatLong', new=lambda geoCorners, sourceCRS: geoCorners)
+    @patch('imageSegmentation.boundBoxSegmentation.classificationSegmentation')
+    @patch('imageSegmentation.boundBoxSegmentation.gdal')
+    def test_predictionTIF_adaptive_crops(self, mock_gdal, mock_classification, mock_yolo):
+        # A TIF image segmented into windows of two sizes, which are read from the same raster one after the other
+        bands = np.random.default_rng(0).integers(0, 256, (3, 2048, 2048), dtype=np.uint8)
+        mock_gdal.Open.return_value = GeoArrayDataset(bands)
+        mock_classification.return_value = [(1, 1), (4, 4), (4, 5)]
+
+        images = []
+        def batch_results(batch, **kwargs):
+            results = []
+            for image in batch:
+                images.append(np.asarray(image))
+                mock_result = MagicMock()
+                mock_result.cpu.return_value = mock_result
+                mock_result.obb.conf = torch.tensor([0.9])
+                mock_result.obb.xyxyxyxy = torch.tensor([[[100, 200], [140, 200], [140, 220], [100, 220]]], dtype=torch.float32)
+                results.append(mock_result)
+            return results
+        mock_model = MagicMock(side_effect=batch_results)
+        mock_model.overrides = {"imgsz": 1024}
+        mock_yolo.return_value = mock_model
+
+        with tempfile.TemporaryDirectory() as extractDir:
+            open(os.path.join(extractDir, "image1.tif"), "w").close()
+            imageAndDatas = boundBoxSegmentationTIF(extractDir=extractDir, windowPlanning="adaptive")
+            windows = [(cropped.xOffset, cropped.yOffset, cropped.RasterXSize) for _, cropped, _, _ in imageAndDatas]
+            result = predictionTIF(imageAndDatas, saveLabeledImage=False, outputFolder=self.output_folder, adaptiveCrops=True)
+
+        # Each segmented image is read at its own size from its own part of the raster
+        self.assertEqual([size for _, _, size in windows], [512, 768])
+        self.assertEqual([image.shape for image in images], [(512, 512, 3), (768, 768, 3)])
+        for image, (topX, topY, size) in zip(images, windows):
+            np.testing.assert_array_equal(image, np.moveaxis(bands[:, topY:topY + size, topX:topX + size], 0, -1))
+
+        # Each box is georeferenced from the top left corner of its own segmented image
+        expected = [[(530000 + (topX + x) * 0.25, 180000 - (topY + y) * 0.25) for x, y in [(100, 200), (140, 200), (140, 220), (100, 220)]]
+                    for topX, topY, _ in windows]
+        np.testing.assert_allclose(sorted(np.asarray(result["image1"][0]).tolist()), sorted(expected))
+
+    @patch('orientedBoundingBox.predictOBB.YOLO')  # Mock the YOLO class
+    def test_predictionJGW_failed_batch(self, mock_yolo):
+        # The first batch fails, the second gives two boxes
+        mock_model = self.mock_yolo_model()
+        mock_model.side_effect = [RuntimeError("out of memory"), mock_model.return_value]
+        mock_yolo.return_value = mock_model
+        imageAndDatas = [
+            ("image1", Image.new('RGB', (256, 256)), 0.1, -0.1, 530000, 180000, 1, 1),
+            ("image2", Image.new('RGB', (256, 256)), 0.1, -0.1, 530000, 180000, 1, 1),
+        ]
+
+        with patch('builtins.print') as mock_print:
+            result = predictionJGW(imageAndDatas, saveLabeledImage=False, outputFolder=self.output_folder, batchSize=1)
+
+        # Only the names of the failed batch are reported
+        self.assertEqual(mock_print.call_args_list[0].args[0], "Error processing ['image1']: out of memory")
+        self.assertNotIn("image1", result)
+        self.assertEqual(len(result["image2"][0]), 2)
+
+    @patch('orientedBoundingBox.predictOBB.YOLO')  # Mock the YOLO class
+    def test_predictionJGW_generator_input(self, mock_yolo):
+        mock_yolo.return_value = self.mock_yolo_model()
+        imageAndDatas = [
+            ("image1", Image.new('RGB', (256, 256)), 0.1, -0.1, 530000 + i * 1000, 180000, 1, i * 10)
+            for i in range(3)
+        ]
+
+        fromList = predictionJGW(imageAndDatas, saveLabeledImage=False, outputFolder=self.output_folder, batchSize=1)
+        # The segmentation streams its crops as a generator, which has no length
+        fromGenerator = predictionJGW((imageAndData for imageAndData in imageAndDatas), saveLabeledImage=False, outputFolder=self.output_folder, batchSize=1)
+
+        self.assertEqual(fromGenerator, fromList)
+
+    @patch('orientedBoundingBox.predictOBB.YOLO')  # Mock the YOLO class
+    def test_pipelinedPrediction_matches_predictionJGW(self, mock_yolo):
+        # Each crop gets a single box, with a confidence that tells which crop it came from
+        def batch_results(images, **kwargs):
+            results = []
+            for image in images:
+                mock_result = MagicMock()
+                mock_result.cpu.return_value = mock_result
+                mock_result.obb.conf = torch.tensor([image.getpixel((0, 0))[0] / 100])
+                mock_result.obb.xyxyxyxy = torch.tensor([[[0, 0], [1, 0], [1, 1], [0, 1]]], dtype=torch.float32)
+                results.append(mock_result)
+            return results
+        mock_yolo.return_value = MagicMock(side_effect=batch_results)
+
+        # Three segmented images from each of four input images, far enough apart that none of their boxes are duplicates
+        def segmentImage(inputFileName):
+            i = int(inputFileName[-1])
+            for j in range(3):
+                yield (inputFileName, Image.new('RGB', (256, 256), (10 * i + j, 0, 0)), 0.1, -0.1, 530000 + j * 1000, 180000 + i * 1000, 1, j * 10)
+        inputFileNames = [f"image{i}" for i in range(4)]
+
+        expected = predictionJGW([imageAndData for inputFileName in inputFileNames for imageAndData in segmentImage(inputFileName)],
+                                 saveLabeledImage=False, outputFolder=self.output_folder, batchSize=5)
+        result = pipelinedPrediction(inputFileNames, segmentImage, inputType="0", saveLabeledImage=False, outputFolder=self.output_folder,
+                                     batchSize=5, workers={"segmentation": 3, "preparation": 2, "georeference": 2})
+
+        self.assertEqual(result, expected)
+        self.assertEqual([len(result[inputFileName][1]) for inputFileName in inputFileNames], [3, 3, 3, 3])
+
+    @patch('orientedBoundingBox.predictOBB.YOLO')  # Mock the YOLO class
+    def test_predictionJGW_projected_dedupe(self, mock_yolo):
+        # The same crosswalk seen by two neighbouring crops, 256 pixels apart
+        def batch_results(images, **kwargs):
+            results = []
+            for image in images:
+                offset = 256 * image.getpixel((0, 0))[1]
+                mock_result = MagicMock()
+                mock_result.cpu.return_value = mock_result
+                mock_result.obb.conf = torch.tensor([0.9 if offset == 0 else 0.8])
+                mock_result.obb.xyxyxyxy = torch.tensor([[[300, 100], [340, 100], [340, 120], [300, 120]]], dtype=torch.float32) - torch.tensor([offset, 0])
+                results.append(mock_result)
+            return results
+        mock_yolo.return_value = MagicMock(side_effect=batch_results)
+
+        imageAndDatas = [
+            ("image1", Image.new('RGB', (1024, 1024), (0, 0, 0)), 0.1, -0.1, 530000, 180000, 1, 1),
+            ("image1", Image.new('RGB', (1024, 1024), (0, 1, 0)), 0.1, -0.1, 530025.6, 180000, 1, 2),
+        ]
+
+        from georeference import georeference
+        with patch('georeference.georeference.geoToLatLong', wraps=georeference.geoToLatLong) as mock_geo_to_lat_long:
+            projected = predictionJGW(imageAndDatas, outputFolder=self.output_folder, batchSize=2, dedupeSpace="projected")
+        # Only the box that survived the filter is converted to latitude and longitude
+        self.assertEqual(sum(len(call.args[0]) for call in mock_geo_to_lat_long.call_args_list), 1)
+
+        latLong = predictionJGW(imageAndDatas, outputFolder=self.output_folder, batchSize=2)
+        self.assertEqual(len(projected["image1"][0]), 1)
+        self.assertEqual(projected["image1"][1], latLong["image1"][1])
+        np.testing.assert_allclose(projected["image1"][0], latLong["image1"][0])
+
+        with self.assertRaises(ValueError):
+            predictionJGW(imageAndDatas, outputFolder=self.output_folder, dedupeSpace="degrees")
+
     @patch('orientedBoundingBox.predictOBB.YOLO')  # Mock the YOLO class
     def test_predictionJGW_empty_input(self, mock_yolo):
         # Mock the YOLO instance
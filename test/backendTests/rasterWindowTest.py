@@ -0,0 +1,159 @@
+import unittest
+from osgeo import gdal
+import numpy as np
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from imageSegmentation.rasterWindow import RasterWindow, DownsampledRaster
+from orientedBoundingBox.predictOBB import detectionImageTIF
+
+class ArrayDataset:
+    """Reads windows of a numpy array like a GDAL dataset, and records every read"""
+    def __init__(self, bands):
+        self.bands = bands
+        self.RasterCount = 1 if bands.ndim == 2 else bands.shape[0]
+        self.RasterYSize, self.RasterXSize = bands.shape[-2:]
+        self.reads = []
+
+    def GetDescription(self):
+        return "array"
+
+    def ReadAsArray(self, xoff=0, yoff=0, xsize=None, ysize=None, buf_obj=None):
+        if xoff < 0 or yoff < 0 or xoff + xsize > self.RasterXSize or yoff + ysize > self.RasterYSize:
+            raise RuntimeError("Access window out of range")
+        self.reads.append((xoff, yoff, xsize, ysize))
+        window = self.bands[..., yoff:yoff + ysize, xoff:xoff + xsize]
+        if buf_obj is None:
+            return window.copy()
+        if buf_obj.shape[-2:] != window.shape[-2:]:
+            # GDAL resamples the window into a buffer of another size
+            rows, cols = np.arange(buf_obj.shape[-2]) * ysize // buf_obj.shape[-2], np.arange(buf_obj.shape[-1]) * xsize // buf_obj.shape[-1]
+            window = window[..., rows[:, np.newaxis], cols]
+        buf_obj[...] = window
+        return buf_obj
+
+class ArrayBand:
+    """The size, block size and overviews of a band, like a GDAL band"""
+    def __init__(self, xSize, ySize, blockSize, overviews=()):
+        self.XSize, self.YSize = xSize, ySize
+        self.blockSize = blockSize
+        self.overviews = list(overviews)
+
+    def GetBlockSize(self):
+        return list(self.blockSize)
+
+    def GetOverviewCount(self):
+        return len(self.overviews)
+
+    def GetOverview(self, index):
+        return self.overviews[index]
+
+class OverviewDataset(ArrayDataset):
+    """An ArrayDataset with overviews of the given sizes, which can also read a window into a smaller buffer, by nearest neighbour or averaging"""
+    def __init__(self, bands, overviewSizes=(), blockSize=(256, 256)):
+        super().__init__(bands)
+        self.band = ArrayBand(self.RasterXSize, self.RasterYSize, blockSize, [ArrayBand(x, y, blockSize) for x, y in overviewSizes])
+
+    def GetRasterBand(self, index):
+        return self.band
+
+    def ReadAsArray(self, xoff=0, yoff=0, xsize=None, ysize=None, buf_obj=None, buf_xsize=None, buf_ysize=None, resample_alg=None):
+        window = super().ReadAsArray(xoff, yoff, xsize, ysize, buf_obj)
+        if buf_xsize is None:
+            return window
+        rows, cols = np.arange(buf_ysize) * ysize // buf_ysize, np.arange(buf_xsize) * xsize // buf_xsize
+        if resample_alg != gdal.GRIORA_Average:
+            return window[..., rows[:, np.newaxis], cols]
+        sums = np.add.reduceat(np.add.reduceat(window.astype(np.float64), rows, axis=-2), cols, axis=-1)
+        counts = np.diff(np.append(rows, ysize))[:, np.newaxis] * np.diff(np.append(cols, xsize))
+        return np.floor(sums / counts + 0.5).astype(window.dtype)
+
+def blockAverage(bands, factor):
+    """Averages each factor by factor block of the bands, rounding halves up like GDAL"""
+    blocks = bands.reshape(bands.shape[0], bands.shape[1] // factor, factor, bands.shape[2] // factor, factor)
+    return np.floor(blocks.mean(axis=(2, 4)) + 0.5).astype(bands.dtype)
+
+class TestRasterWindow(unittest.TestCase):
+
+    def setUp(self):
+        self.bands = np.random.default_rng(0).integers(0, 256, (3, 300, 400), dtype=np.uint8)
+        self.geoTransform = (530000, 0.25, 0, 180000, 0, -0.25)
+
+    def test_window_matches_array(self):
+        dataset = ArrayDataset(self.bands)
+        window = RasterWindow(dataset, 100, 50, 128, self.geoTransform, "WKT")
+
+        np.testing.assert_array_equal(window.ReadAsArray(), self.bands[:, 50:178, 100:228])
+        self.assertEqual(dataset.reads, [(100, 50, 128, 128)])
+        self.assertEqual((window.RasterXSize, window.RasterYSize, window.RasterCount), (128, 128, 3))
+        self.assertEqual(window.GetGeoTransform(), (530025, 0.25, 0, 179987.5, 0, -0.25))
+        self.assertEqual(window.GetProjection(), "WKT")
+
+    def test_window_past_the_edge_is_padded(self):
+        # A raster smaller than the window, as cropWindows places it for images smaller than a segmented image
+        window = RasterWindow(ArrayDataset(self.bands), -50, -100, 512, self.geoTransform, "WKT")
+
+        expected = np.zeros((3, 512, 512), dtype=np.uint8)
+        expected[:, 100:400, 50:450] = self.bands
+        np.testing.assert_array_equal(window.ReadAsArray(), expected)
+        buffer = np.full((3, 512, 512), 7, dtype=np.uint8)
+        self.assertIs(window.ReadAsArray(buf_obj=buffer), buffer)
+        np.testing.assert_array_equal(buffer, expected)
+
+    def test_readIntoBuffer_reuses_the_buffer(self):
+        dataset = ArrayDataset(self.bands)
+        first = RasterWindow(dataset, 0, 0, 128, self.geoTransform, "WKT")
+        second = RasterWindow(dataset, 200, 100, 128, self.geoTransform, "WKT", first.lock, first.buffers)
+
+        firstPixels = first.readIntoBuffer()
+        np.testing.assert_array_equal(firstPixels, self.bands[:, :128, :128])
+        secondPixels = second.readIntoBuffer()
+        self.assertIs(secondPixels, firstPixels)
+        np.testing.assert_array_equal(secondPixels, self.bands[:, 100:228, 200:328])
+
+    def test_readIntoBuffer_windows_of_different_sizes(self):
+        bands = np.random.default_rng(1).integers(0, 256, (3, 1200, 1300), dtype=np.uint8)
+        for windowBands in [bands, bands[0]]:
+            dataset = ArrayDataset(windowBands)
+            first = RasterWindow(dataset, 0, 0, 512, self.geoTransform, "WKT")
+            # Inside the raster, and past its bottom right corner
+            for xOffset, yOffset, size in [(100, 50, 1024), (700, 300, 512), (800, 600, 1024), (0, 0, 768)]:
+                window = RasterWindow(dataset, xOffset, yOffset, size, self.geoTransform, "WKT", first.lock, first.buffers)
+                expected = window.ReadAsArray()
+                first.readIntoBuffer()
+                np.testing.assert_array_equal(window.readIntoBuffer(), expected)
+
+    def test_detectionImageTIF_copies_the_buffer(self):
+        for bands in [self.bands, self.bands[0]]:
+            dataset = ArrayDataset(bands)
+            first = RasterWindow(dataset, 0, 0, 128, self.geoTransform, "WKT")
+            second = RasterWindow(dataset, 200, 100, 128, self.geoTransform, "WKT", first.lock, first.buffers)
+
+            firstImage = detectionImageTIF(("base", first, 0, 0))
+            detectionImageTIF(("base", second, 0, 1))
+
+            # The first image is unchanged by reading the second into the same buffer
+            expected = bands[..., :128, :128]
+            np.testing.assert_array_equal(np.asarray(firstImage), np.moveaxis(expected, 0, -1) if expected.ndim == 3 else expected)
+
+    def test_downsampled_raster(self):
+        dataset = OverviewDataset(self.bands, overviewSizes=[(200, 150), (100, 75), (50, 37)])
+        raster = DownsampledRaster(dataset, 4)
+
+        self.assertEqual((raster.RasterXSize, raster.RasterYSize, raster.RasterCount), (100, 75, 3))
+        # Each pixel is the average of the 4 by 4 pixels under it, rather than the top left one
+        np.testing.assert_array_equal(raster.ReadAsArray(), blockAverage(self.bands, 4))
+        self.assertEqual(dataset.reads, [(0, 0, 400, 300)])
+        # Read from the overview of the same size, so only a sixteenth of the pixels are decoded
+        self.assertEqual(raster.decodedPixels, 100 * 75)
+        self.assertEqual(raster.GetRasterBand(1).GetBlockSize(), (256, 256))
+
+        # Without overviews every pixel under the window is decoded
+        raster = DownsampledRaster(OverviewDataset(self.bands), 4)
+        np.testing.assert_array_equal(raster.ReadAsArray(10, 5, 20, 10), blockAverage(self.bands[:, 20:60, 40:120], 4))
+        self.assertEqual(raster.decodedPixels, 80 * 40)
+        self.assertEqual(raster.GetBlockSize(), (64, 64))
+
+if __name__ == '__main__':
+    unittest.main()
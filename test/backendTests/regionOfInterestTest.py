@@ -0,0 +1,58 @@
+import unittest
+import json
+import numpy as np
+import os
+import sys
+import tempfile
+from osgeo import osr
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from imageSegmentation.regionOfInterest import regionOfInterestMask, imageRegionOfInterestMask
+
+def writeRoads(path, bngLines):
+    """Writes lines given in British National Grid to a GeoJSON file, in WGS84 as GeoJSON expects"""
+    bng, wgs84 = osr.SpatialReference(), osr.SpatialReference()
+    bng.ImportFromEPSG(27700)
+    wgs84.ImportFromEPSG(4326)
+    for reference in (bng, wgs84):
+        reference.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    toWGS84 = osr.CoordinateTransformation(bng, wgs84)
+    features = [{"type": "Feature", "properties": {}, "geometry": {"type": "LineString", "coordinates": [list(toWGS84.TransformPoint(x, y)[:2]) for x, y in line]}} for line in bngLines]
+    with open(path, "w") as roadsFile:
+        json.dump({"type": "FeatureCollection", "features": features}, roadsFile)
+
+class TestRegionOfInterest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.roadsPath = os.path.join(self.directory.name, "roads.geojson")
+        # A road running across the image along row 300, and one far away from it
+        writeRoads(self.roadsPath, [[(530000, 179925), (530512, 179925)], [(600000, 100000), (600100, 100000)]])
+        self.geotransform = (530000.0, 0.25, 0.0, 180000.0, 0.0, -0.25)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_regionOfInterestMask(self):
+        # 5 metres is 20 pixels, so only the second row of chunks is reached
+        tileMask = regionOfInterestMask(self.roadsPath, self.geotransform, 27700, 2048, 2048, 256, bufferDistance=5)
+        expected = np.zeros((8, 8), dtype=bool)
+        expected[1] = True
+        np.testing.assert_array_equal(tileMask, expected)
+
+        # 20 metres is 80 pixels, which reaches into the first row as well
+        tileMask = regionOfInterestMask(self.roadsPath, self.geotransform, 27700, 2048, 2048, 256, bufferDistance=20)
+        expected[0] = True
+        np.testing.assert_array_equal(tileMask, expected)
+
+    def test_imageRegionOfInterestMask_from_jgw(self):
+        imagePath = os.path.join(self.directory.name, "image.jpg")
+        with open(os.path.join(self.directory.name, "image.jgw"), "w") as jgwFile:
+            jgwFile.write("0.25\n0\n0\n-0.25\n530000\n180000\n")
+
+        tileMask = imageRegionOfInterestMask(imagePath, self.roadsPath, 2048, 2048, 256)
+        np.testing.assert_array_equal(tileMask, regionOfInterestMask(self.roadsPath, self.geotransform, 27700, 2048, 2048, 256))
+        self.assertFalse(tileMask[4:].any())
+
+if __name__ == '__main__':
+    unittest.main()
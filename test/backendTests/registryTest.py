@@ -0,0 +1,121 @@
+import unittest
+import os
+import sys
+import tempfile
+import threading
+import time
+import torch
+
+# Add the parent directory to sys.path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from models.registry import ModelCache, cacheKey, estimateModelBytes, getCachedModel, modelCache
+
+class TestModelCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        modelCache.clear()
+
+    def tearDown(self):
+        modelCache.clear()
+        self.temp_dir.cleanup()
+
+    def test_get_loads_once(self):
+        cache = ModelCache()
+        loads = []
+        def loader():
+            loads.append(1)
+            return object()
+
+        first = cache.get(("model", None, None), loader)
+        second = cache.get(("model", None, None), loader)
+
+        self.assertIs(first, second)
+        self.assertEqual(len(loads), 1)
+
+    def test_get_loads_once_across_threads(self):
+        cache = ModelCache()
+        loads = []
+        def loader():
+            loads.append(1)
+            time.sleep(0.05)
+            return object()
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get(("model", None, None), loader))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(loads), 1)
+        self.assertTrue(all(result is results[0] for result in results))
+
+    def test_memory_limit_evicts_least_recently_used(self):
+        # Each linear layer uses (10 * 10 + 10) * 4 = 440 bytes
+        cache = ModelCache(memoryLimit=1000)
+        cache.get(("a", None, None), lambda: torch.nn.Linear(10, 10))
+        cache.get(("b", None, None), lambda: torch.nn.Linear(10, 10))
+        cache.get(("a", None, None), lambda: torch.nn.Linear(10, 10))
+        cache.get(("c", None, None), lambda: torch.nn.Linear(10, 10))
+
+        self.assertEqual(cache.keys(), [("a", None, None), ("c", None, None)])
+        self.assertEqual(cache.memoryUsage(), 880)
+
+    def test_estimate_looks_through_wrappers(self):
+        class Wrapper:
+            def __init__(self):
+                self.model = torch.nn.Linear(10, 10)
+
+        self.assertEqual(estimateModelBytes(Wrapper()), 440)
+        self.assertEqual(estimateModelBytes(object()), 0)
+
+    def test_estimate_from_weights_on_disk(self):
+        weightsPath = os.path.join(self.temp_dir.name, "weights.pt")
+        with open(weightsPath, "wb") as weightsFile:
+            weightsFile.write(bytes(600))
+        # A frozen TorchScript module keeps its weights as constants rather than parameters
+        frozen = torch.jit.freeze(torch.jit.script(torch.nn.Linear(10, 10).eval()))
+        self.assertEqual(estimateModelBytes(frozen), 0)
+        self.assertEqual(estimateModelBytes(frozen, weightsPath), 600)
+        self.assertEqual(estimateModelBytes(object(), weightsPath), 600)
+        # The parameters are used when there are any
+        self.assertEqual(estimateModelBytes(torch.nn.Linear(10, 10), weightsPath), 440)
+
+        # An OpenVINO export is a directory of files
+        exportPath = os.path.join(self.temp_dir.name, "weights_openvino_model")
+        os.makedirs(exportPath)
+        for fileName, size in [("model.xml", 100), ("model.bin", 900)]:
+            with open(os.path.join(exportPath, fileName), "wb") as exportFile:
+                exportFile.write(bytes(size))
+        self.assertEqual(estimateModelBytes(object(), exportPath), 1000)
+        self.assertEqual(estimateModelBytes(object(), os.path.join(self.temp_dir.name, "missing.onnx")), 0)
+
+    def test_memory_limit_counts_models_without_parameters(self):
+        weightsPath = os.path.join(self.temp_dir.name, "weights.onnx")
+        with open(weightsPath, "wb") as weightsFile:
+            weightsFile.write(bytes(600))
+        cache = ModelCache(memoryLimit=1000)
+        cache.get(("a", weightsPath, None), object)
+        cache.get(("b", weightsPath, None), object)
+
+        self.assertEqual(cache.keys(), [("b", weightsPath, None)])
+        self.assertEqual(cache.memoryUsage(), 600)
+
+    def test_changed_weights_are_loaded_again(self):
+        weightsPath = os.path.join(self.temp_dir.name, "weights.pt")
+        open(weightsPath, "w").close()
+        os.utime(weightsPath, (1000, 1000))
+
+        first = getCachedModel("model", weightsPath, object)
+        self.assertIs(getCachedModel("model", weightsPath, object), first)
+
+        os.utime(weightsPath, (2000, 2000))
+        second = getCachedModel("model", weightsPath, object)
+
+        self.assertIsNot(first, second)
+        self.assertEqual(modelCache.keys(), [cacheKey("model", weightsPath)])
+
+if __name__ == "__main__":
+    unittest.main()
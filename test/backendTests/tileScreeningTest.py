@@ -0,0 +1,62 @@
+import unittest
+import numpy as np
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from imageSegmentation.tileScreening import tileStatistics, screenTiles, iterScreenedTileBatches
+from imageSegmentation.tiling import iterTileBatches
+
+def stripedTile(size=256):
+    """A tile of grey road with white stripes across it, like a crossing"""
+    tile = np.full((3, size, size), 90, dtype=np.uint8)
+    for left in range(40, 200, 32):
+        tile[:, 80:180, left:left + 16] = 240
+    return tile
+
+class TestTileScreening(unittest.TestCase):
+
+    def test_tileStatistics(self):
+        blank = np.zeros((1, 3, 256, 256), dtype=np.uint8)
+        std, edgeDensity, nodataFraction = tileStatistics(np.concatenate([blank, stripedTile()[None]]))
+
+        np.testing.assert_allclose(std[0], 0)
+        self.assertGreater(std[1], 10)
+        self.assertEqual(edgeDensity[0], 0)
+        self.assertGreater(edgeDensity[1], 0.002)
+        self.assertEqual(nodataFraction.tolist(), [1.0, 0.0])
+
+    def test_screenTiles(self):
+        rng = np.random.default_rng(0)
+        water = np.clip(rng.normal(60, 1, (3, 256, 256)), 0, 255).astype(np.uint8)
+        white = np.full((3, 256, 256), 255, dtype=np.uint8)
+        # A nodata border with a little of the image at its edge
+        border = np.zeros((3, 256, 256), dtype=np.uint8)
+        border[:, :, 255] = rng.integers(0, 256, (3, 256))
+        noisy = rng.integers(0, 256, (3, 256, 256), dtype=np.uint8)
+        tiles = np.stack([water, white, border, stripedTile(), noisy])
+
+        self.assertEqual(screenTiles(tiles).tolist(), [False, False, False, True, True])
+        # Everything is kept with thresholds that skip nothing
+        self.assertTrue(screenTiles(tiles, minStd=0, minEdgeDensity=0, maxNodataFraction=1).all())
+
+    def test_iterScreenedTileBatches_keeps_full_batches(self):
+        imageArray = np.zeros((1024, 1280, 3), dtype=np.uint8)
+        # Tiles of interest along the diagonal, the rest are blank
+        for i in range(4):
+            imageArray[i * 256:(i + 1) * 256, i * 256:(i + 1) * 256] = np.moveaxis(stripedTile(), 0, -1)
+            imageArray[i * 256:(i + 1) * 256, (i + 1) * 256:(i + 2) * 256] = np.moveaxis(stripedTile(), 0, -1)
+        counts = {}
+
+        batches = list(iterScreenedTileBatches(iterTileBatches(imageArray, 256, 3), 3, counts=counts))
+
+        self.assertEqual([len(rowCols) for rowCols, _ in batches], [3, 3, 2])
+        rowCols = np.concatenate([rowCols for rowCols, _ in batches]).tolist()
+        self.assertEqual(rowCols, [[0, 0], [0, 1], [1, 1], [1, 2], [2, 2], [2, 3], [3, 3], [3, 4]])
+        for batchRowCols, tiles in batches:
+            for (row, col), tile in zip(batchRowCols.tolist(), tiles):
+                np.testing.assert_array_equal(tile, np.moveaxis(imageArray[row * 256:(row + 1) * 256, col * 256:(col + 1) * 256], -1, 0))
+        self.assertEqual(counts, {"tiles": 20, "skipped": 12})
+
+if __name__ == '__main__':
+    unittest.main()
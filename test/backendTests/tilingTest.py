@@ -0,0 +1,177 @@
+import unittest
+import numpy as np
+from PIL import Image
+import os
+import sys
+import tempfile
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from imageSegmentation.tiling import loadImageArray, loadReducedImageArray, reduceArray, cropArray, tileOrigins, tileView, iterTileBatches, iterRasterTileBatches, rasterToRGB, cellsToTileMask
+
+class ArrayRaster:
+    """Reads windows of a numpy array like a GDAL dataset with the given block size, and records the size of every read"""
+    def __init__(self, bands, blockSize):
+        self.bands = bands
+        self.RasterYSize, self.RasterXSize = bands.shape[-2:]
+        self.blockSize = blockSize
+        self.reads = []
+
+    def GetRasterBand(self, index):
+        return self
+
+    def GetBlockSize(self):
+        return list(self.blockSize)
+
+    def ReadAsArray(self, xoff=0, yoff=0, xsize=None, ysize=None):
+        xsize = self.RasterXSize if xsize is None else xsize
+        ysize = self.RasterYSize if ysize is None else ysize
+        self.reads.append(xsize * ysize)
+        return self.bands[..., yoff:yoff + ysize, xoff:xoff + xsize].copy()
+
+class TestTiling(unittest.TestCase):
+
+    def test_tileOrigins(self):
+        # The last tile is shifted back so that it ends on the edge of the image
+        self.assertEqual(tileOrigins(700, 256).tolist(), [0, 256, 444])
+        self.assertEqual(tileOrigins(512, 256).tolist(), [0, 256])
+
+    def test_tileView_is_a_view(self):
+        imageArray = np.zeros((300, 300, 3), dtype=np.uint8)
+        windows = tileView(imageArray, 256)
+        self.assertEqual(windows.shape, (45, 45, 3, 256, 256))
+        self.assertTrue(np.shares_memory(windows, imageArray))
+
+    def test_iterTileBatches_matches_PIL_crop(self):
+        imageArray = np.random.randint(0, 256, (700, 600, 3), dtype=np.uint8)
+        image = Image.fromarray(imageArray)
+        chunkSize = 256
+
+        batches = list(iterTileBatches(imageArray, chunkSize, batchSize=4))
+        self.assertEqual([len(rowCols) for rowCols, _ in batches], [4, 4, 1])
+
+        for rowCols, tiles in batches:
+            for (row, col), tile in zip(rowCols.tolist(), tiles):
+                # The same box as the one that was cropped with PIL before
+                top = min(row * chunkSize, 700 - chunkSize)
+                left = min(col * chunkSize, 600 - chunkSize)
+                expected = np.asarray(image.crop((left, top, left + chunkSize, top + chunkSize)))
+                np.testing.assert_array_equal(np.moveaxis(tile, 0, -1), expected)
+
+    def test_iterTileBatches_small_image(self):
+        imageArray = np.full((100, 300, 3), 255, dtype=np.uint8)
+        image = Image.fromarray(imageArray)
+
+        (rowCols, tiles), = list(iterTileBatches(imageArray, 256, batchSize=32))
+        self.assertEqual(rowCols.tolist(), [[0, 0], [0, 1]])
+        expected = np.asarray(image.crop((0, -156, 256, 100)))
+        np.testing.assert_array_equal(np.moveaxis(tiles[0], 0, -1), expected)
+
+    def test_iterRasterTileBatches_matches_decoded_image(self):
+        bands = np.random.default_rng(0).integers(0, 256, (3, 1500, 1300), dtype=np.uint8)
+        expected = list(iterTileBatches(np.moveaxis(bands, 0, -1), 256, batchSize=7))
+
+        # Tiled like a GeoTIFF, in strips, and with blocks that do not line up with the tiles
+        for blockSize in [(256, 256), (1300, 1), (512, 512), (300, 200)]:
+            raster = ArrayRaster(bands, blockSize)
+            batches = list(iterRasterTileBatches(raster, 256, batchSize=7, maxWindowPixels=4 * 256 * 256))
+
+            self.assertEqual([len(rowCols) for rowCols, _ in batches], [len(rowCols) for rowCols, _ in expected])
+            for (rowCols, tiles), (expectedRowCols, expectedTiles) in zip(batches, expected):
+                np.testing.assert_array_equal(rowCols, expectedRowCols)
+                np.testing.assert_array_equal(tiles, expectedTiles)
+            # The whole raster is never read at once
+            self.assertLessEqual(max(raster.reads), 4 * 256 * 256)
+
+    def test_tileMask_only_reads_the_tiles_in_it(self):
+        bands = np.random.default_rng(0).integers(0, 256, (3, 1500, 1300), dtype=np.uint8)
+        tileMask = np.zeros((6, 6), dtype=bool)
+        tileMask[0, 1] = tileMask[5, 4] = tileMask[5, 5] = True
+        everyTile = {tuple(rowCol): tile for rowCols, tiles in iterTileBatches(np.moveaxis(bands, 0, -1), 256, batchSize=7) for rowCol, tile in zip(rowCols.tolist(), tiles)}
+
+        masked = list(iterTileBatches(np.moveaxis(bands, 0, -1), 256, batchSize=7, tileMask=tileMask))
+        raster = ArrayRaster(bands, (256, 256))
+        counts = {}
+        rasterMasked = list(iterRasterTileBatches(raster, 256, batchSize=7, maxWindowPixels=4 * 256 * 256, tileMask=tileMask, counts=counts))
+
+        for batches in [masked, rasterMasked]:
+            rowCols = np.concatenate([rowCols for rowCols, _ in batches])
+            self.assertEqual(rowCols.tolist(), [[0, 1], [5, 4], [5, 5]])
+            for rowCol, tile in zip(rowCols.tolist(), np.concatenate([tiles for _, tiles in batches])):
+                np.testing.assert_array_equal(tile, everyTile[tuple(rowCol)])
+        # Only the windows around the tiles are read, including the shifted last row and column
+        self.assertEqual(raster.reads, [256 * 256, 256 * (1300 - 1024)])
+        self.assertEqual(counts["decodedPixels"], sum(raster.reads))
+        self.assertEqual(list(iterRasterTileBatches(raster, 256, batchSize=7, tileMask=np.zeros((6, 6), dtype=bool))), [])
+
+    def test_loadReducedImageArray(self):
+        rows, cols = np.mgrid[0:800, 0:1000]
+        imageArray = np.stack([rows % 256, cols % 256, (rows + cols) % 256], axis=-1).astype(np.uint8)
+        with tempfile.TemporaryDirectory() as directory:
+            for name in ["image.jpg", "image.png"]:
+                imagePath = os.path.join(directory, name)
+                Image.fromarray(imageArray).save(imagePath)
+                reduced, decodedPixels = loadReducedImageArray(imagePath, 4)
+
+                self.assertEqual(reduced.shape, (200, 250, 3))
+                # A JPEG is decoded at a quarter of the size, a PNG can only be decoded in full
+                self.assertEqual(decodedPixels, 200 * 250 if name.endswith(".jpg") else 800 * 1000)
+                self.assertLess(np.abs(reduced.astype(int) - reduceArray(imageArray, 4)).mean(), 8)
+
+    def test_reduceArray(self):
+        imageArray = np.random.default_rng(0).integers(0, 256, (30, 21, 3), dtype=np.uint8)
+        reduced = reduceArray(imageArray, 4)
+
+        self.assertEqual(reduced.shape, (7, 5, 3))
+        np.testing.assert_array_equal(reduced[1, 2], np.round(imageArray[4:8, 8:12].mean(axis=(0, 1))))
+
+    def test_loadImageArray(self):
+        imageArray = np.random.default_rng(0).integers(0, 256, (300, 200, 3), dtype=np.uint8)
+        with tempfile.TemporaryDirectory() as directory:
+            imagePath = os.path.join(directory, "image.png")
+            Image.fromarray(imageArray).save(imagePath)
+            Image.fromarray(imageArray[..., 0]).save(os.path.join(directory, "gray.png"))
+
+            loaded = loadImageArray(imagePath)
+            gray = loadImageArray(os.path.join(directory, "gray.png"))
+
+        np.testing.assert_array_equal(loaded, imageArray)
+        # Images in any other mode are converted to three channels
+        np.testing.assert_array_equal(gray, np.repeat(imageArray[..., :1], 3, axis=-1))
+
+    def test_cropArray_matches_PIL_crop(self):
+        imageArray = np.random.default_rng(0).integers(0, 256, (300, 200, 3), dtype=np.uint8)
+        image = Image.fromarray(imageArray)
+
+        # Inside the image, past its bottom right corner, and larger than the whole image
+        for left, top, size in [(10, 20, 100), (150, 250, 100), (-412, -362, 1024)]:
+            cropped = cropArray(imageArray, left, top, size)
+            self.assertEqual(cropped.size, (size, size))
+            np.testing.assert_array_equal(np.asarray(cropped), np.asarray(image.crop((left, top, left + size, top + size))))
+
+    def test_cellsToTileMask(self):
+        cells = np.zeros((6, 6), dtype=bool)
+        cells[0, 4] = True
+        cells[2, 5] = True
+        tileMask = cellsToTileMask(cells, 1300, 1500, 256)
+
+        # The shifted last column starts at 1044, so it straddles the cells at 1024 and 1280
+        expected = np.zeros((6, 6), dtype=bool)
+        expected[0, 4:6] = True
+        expected[2, 5] = True
+        np.testing.assert_array_equal(tileMask, expected)
+        # An image smaller than a tile has a single tile and a single cell
+        np.testing.assert_array_equal(cellsToTileMask(np.ones((1, 1), dtype=bool), 100, 1500, 256), np.ones((6, 1), dtype=bool))
+
+    def test_rasterToRGB(self):
+        grey = np.arange(6, dtype=np.uint8).reshape(2, 3)
+        self.assertEqual(rasterToRGB(grey).shape, (2, 3, 3))
+        np.testing.assert_array_equal(rasterToRGB(grey)[..., 2], grey)
+        # An alpha band is dropped
+        rgba = np.stack([grey, grey + 1, grey + 2, grey + 3])
+        np.testing.assert_array_equal(rasterToRGB(rgba), np.moveaxis(rgba[:3], 0, -1))
+        # Values above 255 are not wrapped around into 8 bits
+        with self.assertRaises(ValueError):
+            rasterToRGB(grey.astype(np.uint16) * 300)
+
+if __name__ == '__main__':
+    unittest.main()
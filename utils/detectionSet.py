@@ -0,0 +1,202 @@
+import numpy as np
+
+
+class DetectionSet:
+    """
+    A columnar store of oriented bounding box detections, kept in NumPy arrays instead of a dictionary of lists keyed by
+    '{baseName}__r{row}__c{col}' strings. Each detection has its four corners, its confidence, and the image, row and
+    column of the chunk it was found in. Image names are interned, so each detection only stores the index of its
+    image in imageNames. The corners are usually latitude and longitude, but they can also be kept in the CRS of their
+    image, which is then stored in imageCRS.
+
+    Detections are added a chunk at a time and joined into the arrays the next time they are read. Detections can be
+    removed with a boolean mask, and the detections of each image can be read as views of the arrays without copying.
+    """
+    def __init__(self):
+        self.imageNames = []
+        self.imageCRS = []
+        self.imageIndex = {}
+        self._corners = np.empty((0, 4, 2), dtype=np.float64)
+        self._conf = np.empty(0, dtype=np.float32)
+        self._imageIds = np.empty(0, dtype=np.int32)
+        self._rows = np.empty(0, dtype=np.int32)
+        self._cols = np.empty(0, dtype=np.int32)
+        self.pending = []
+        # The index of the first detection of each image, only valid while the detections are sorted by image
+        self.imageStarts = None
+
+    def internImage(self, baseName, crs=None):
+        """
+        Gives the index of an image in imageNames, adding it if it is new.
+
+        Args:
+            baseName (str): The name of the image.
+            crs (int or str): The EPSG code or the WKT of the CRS the image's corners are in, None for latitude and longitude.
+
+        Returns:
+            int: The index of the image.
+        """
+        imageId = self.imageIndex.get(baseName)
+        if imageId is None:
+            imageId = self.imageIndex[baseName] = len(self.imageNames)
+            self.imageNames.append(baseName)
+            self.imageCRS.append(crs)
+        return imageId
+
+    def add(self, baseName, row, col, corners, conf, crs=None):
+        """
+        Adds the detections of one chunk.
+
+        Args:
+            baseName (str): The name of the image the chunk was taken from.
+            row (int): The row of the chunk.
+            col (int): The column of the chunk.
+            corners (numpy array): The corners of the boxes, of shape (N, 4, 2).
+            conf (numpy array): The confidence of each box, of shape (N,).
+            crs (int or str): The EPSG code or the WKT of the CRS the corners are in, None for latitude and longitude.
+                Every chunk of an image must use the same CRS.
+        """
+        corners = np.asarray(corners, dtype=np.float64).reshape(-1, 4, 2)
+        if len(corners) == 0:
+            return
+        imageId = self.internImage(baseName, crs)
+        self.pending.append((corners, np.asarray(conf, dtype=np.float32).reshape(-1), imageId, row, col))
+        self.imageStarts = None
+
+    def consolidate(self):
+        """Joins the detections added since the last read into the arrays"""
+        if not self.pending:
+            return
+        counts = [len(corners) for corners, *_ in self.pending]
+        self._corners = np.concatenate([self._corners] + [corners for corners, *_ in self.pending])
+        self._conf = np.concatenate([self._conf] + [conf for _, conf, *_ in self.pending])
+        self._imageIds = np.concatenate([self._imageIds, np.repeat(np.array([imageId for _, _, imageId, _, _ in self.pending], dtype=np.int32), counts)])
+        self._rows = np.concatenate([self._rows, np.repeat(np.array([row for *_, row, _ in self.pending], dtype=np.int32), counts)])
+        self._cols = np.concatenate([self._cols, np.repeat(np.array([col for *_, col in self.pending], dtype=np.int32), counts)])
+        self.pending = []
+
+    @property
+    def corners(self):
+        """numpy array: The corners of every box, of shape (N, 4, 2)"""
+        self.consolidate()
+        return self._corners
+
+    @property
+    def conf(self):
+        """numpy array: The confidence of every box, of shape (N,)"""
+        self.consolidate()
+        return self._conf
+
+    @property
+    def imageIds(self):
+        """numpy array: The index in imageNames of the image of every box, of shape (N,)"""
+        self.consolidate()
+        return self._imageIds
+
+    @property
+    def rows(self):
+        """numpy array: The row of the chunk of every box, of shape (N,)"""
+        self.consolidate()
+        return self._rows
+
+    @property
+    def cols(self):
+        """numpy array: The column of the chunk of every box, of shape (N,)"""
+        self.consolidate()
+        return self._cols
+
+    def __len__(self):
+        return len(self.conf)
+
+    def keep(self, mask):
+        """
+        Keeps only the detections where mask is True, removing the others.
+
+        Args:
+            mask (numpy array): A boolean array with one value per detection.
+        """
+        mask = np.asarray(mask, dtype=bool)
+        self.consolidate()
+        self._corners = self._corners[mask]
+        self._conf = self._conf[mask]
+        self._imageIds = self._imageIds[mask]
+        self._rows = self._rows[mask]
+        self._cols = self._cols[mask]
+        self.imageStarts = None
+
+    def remove(self, mask):
+        """
+        Removes the detections where mask is True.
+
+        Args:
+            mask (numpy array): A boolean array with one value per detection.
+        """
+        self.keep(~np.asarray(mask, dtype=bool))
+
+    def sortByImage(self):
+        """
+        Groups the detections of each image together, keeping the order they were added in within each image, so that
+        they can be read with imageView.
+        """
+        imageIds = self.imageIds
+        if self.imageStarts is not None:
+            return
+        if np.any(imageIds[1:] < imageIds[:-1]):
+            order = np.argsort(imageIds, kind="stable")
+            self._corners = self._corners[order]
+            self._conf = self._conf[order]
+            self._imageIds = self._imageIds[order]
+            self._rows = self._rows[order]
+            self._cols = self._cols[order]
+        self.imageStarts = np.searchsorted(self._imageIds, np.arange(len(self.imageNames) + 1))
+
+    def imageView(self, imageId):
+        """
+        Gives the detections of one image as views of the arrays, without copying them.
+
+        Args:
+            imageId (int): The index of the image in imageNames.
+
+        Returns:
+            tuple: The corners, confidences, rows and columns of the image's detections.
+        """
+        self.sortByImage()
+        start, end = self.imageStarts[imageId], self.imageStarts[imageId + 1]
+        return self._corners[start:end], self._conf[start:end], self._rows[start:end], self._cols[start:end]
+
+    def images(self):
+        """
+        Yields the name and the detections of every image with at least one detection, in the order the images were first added.
+
+        Yields:
+            tuple: The name of the image, and its corners, confidences, rows and columns as views of the arrays.
+        """
+        self.sortByImage()
+        for imageId, baseName in enumerate(self.imageNames):
+            if self.imageStarts[imageId] < self.imageStarts[imageId + 1]:
+                yield (baseName, *self.imageView(imageId))
+
+    def toRowColDict(self):
+        """
+        Converts the detections to the dictionary used before the DetectionSet, with a key for every chunk.
+
+        Returns:
+            dict: A dictionary where the '{baseName}__r{row}__c{col}' key of each chunk stores its list of boxes and list of confidences.
+        """
+        imageDetectionsRowCol = {}
+        for baseName, corners, conf, rows, cols in self.images():
+            for box, confidence, row, col in zip(corners.tolist(), conf.tolist(), rows.tolist(), cols.tolist()):
+                chunk = imageDetectionsRowCol.setdefault(f"{baseName}__r{row}__c{col}", [[], []])
+                chunk[0].append([tuple(corner) for corner in box])
+                chunk[1].append(confidence)
+        return imageDetectionsRowCol
+
+    def toImageDetections(self):
+        """
+        Converts the detections to a dictionary with a key for every image.
+
+        Returns:
+            dict: A dictionary where the name of each image stores its list of boxes and list of confidences.
+        """
+        return {baseName: [[[tuple(corner) for corner in box] for box in corners.tolist()], conf.tolist()]
+                for baseName, corners, conf, _, _ in self.images()}
@@ -1,6 +1,7 @@
 import math
 import re
-from shapely.geometry import Polygon
+import numpy as np
+import shapely
 from tqdm import tqdm
 
 def combineChunksToBaseName(imageDetectionsRowCol):
@@ -27,10 +28,77 @@ def combineChunksToBaseName(imageDetectionsRowCol):
 
 
 
+def boundingCircles(boxes):
+    """
+    Calculate a circle around each box, centred on the mean of its corners and reaching its furthest corner.
+
+    Args:
+        boxes (numpy array): The corners of the boxes, of shape (N, 4, 2).
+
+    Returns:
+        tuple: The centres of the circles, of shape (N, 2), and their radii, of shape (N,).
+    """
+    centres = boxes.mean(axis=1)
+    radii = np.sqrt(((boxes - centres[:, np.newaxis]) ** 2).sum(axis=2)).max(axis=1)
+    return centres, radii
+
+
+
+def scaledIous(boxes1, boxes2):
+    """
+    Calculate the scaled Intersection over Union (IoU) of many pairs of bounding boxes at once, using the vectorized shapely
+    intersection and area operations. The IoU is scaled by the ratio of the larger to the smaller area, so a box lying inside a larger box
+    still counts as overlapping it. Pairs whose bounding circles do not touch cannot overlap, so they are given 0 without
+    being passed to GEOS.
+    
+    Args:
+        boxes1 (numpy array): The first box of each pair, of shape (N, 4, 2).
+        boxes2 (numpy array): The second box of each pair, of shape (N, 4, 2).
+
+    Returns:
+        numpy array: The scaled IoU of each pair, of shape (N,). Pairs with a box without area, or which GEOS cannot
+        intersect, are given 0.
+    """
+    boxes1 = np.asarray(boxes1, dtype=np.float64).reshape(-1, 4, 2)
+    boxes2 = np.asarray(boxes2, dtype=np.float64).reshape(-1, 4, 2)
+    result = np.zeros(len(boxes1), dtype=np.float64)
+
+    centres1, radii1 = boundingCircles(boxes1)
+    centres2, radii2 = boundingCircles(boxes2)
+    mayOverlap = np.sqrt(((centres1 - centres2) ** 2).sum(axis=1)) < radii1 + radii2
+    if not mayOverlap.any():
+        return result
+
+    polygons1 = shapely.polygons(boxes1[mayOverlap])
+    polygons2 = shapely.polygons(boxes2[mayOverlap])
+    area1, area2 = shapely.area(polygons1), shapely.area(polygons2)
+    intersectionArea = np.zeros(len(polygons1), dtype=np.float64)
+    unionArea = np.zeros(len(polygons1), dtype=np.float64)
+
+    # GEOS can fail on self intersecting boxes, so those pairs are intersected one at a time
+    isValid = shapely.is_valid(polygons1) & shapely.is_valid(polygons2)
+    intersectionArea[isValid] = shapely.area(shapely.intersection(polygons1[isValid], polygons2[isValid]))
+    # For valid polygons the union does not need its own overlay
+    unionArea[isValid] = area1[isValid] + area2[isValid] - intersectionArea[isValid]
+    for i in np.flatnonzero(~isValid):
+        try:
+            intersectionArea[i] = polygons1[i].intersection(polygons2[i]).area
+            unionArea[i] = polygons1[i].union(polygons2[i]).area
+        except shapely.errors.GEOSException:
+            unionArea[i] = 0
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        iou = np.where(unionArea > 0, intersectionArea / unionArea, 0)
+        scaled = iou * (np.maximum(area1, area2) / np.minimum(area1, area2))
+    result[mayOverlap] = np.where(np.minimum(area1, area2) > 0, scaled, 0)
+    return result
+
+
+
 def checkBoxIntersection(box1, box2, threshold=0.6):
     """
     Calculate Intersection over Union (IoU) between two bounding boxes and check if their intersection 
-    exceeds a threshold.
+    exceeds a threshold. It is a wrapper around scaledIous for a single pair.
     
     Args:
         box1 (list): The first bounding box defined by four corners.
@@ -40,17 +108,7 @@ def checkBoxIntersection(box1, box2, threshold=0.6):
     Returns:
         bool: True if the IoU exceeds the threshold, otherwise False.
     """
-    poly1 = Polygon(box1)
-    poly2 = Polygon(box2)
-    try:
-        intersectionArea = poly1.intersection(poly2).area
-        unionArea = poly1.union(poly2).area
-        iou = intersectionArea / unionArea if unionArea > 0 else 0
-
-        scaledIou = iou * (max(poly1.area, poly2.area) / min(poly1.area, poly2.area))
-        return scaledIou > threshold
-    except:
-        return False  # Return False if the intersection computation fails
+    return bool(scaledIous([box1], [box2])[0] > threshold)
     
 
     
@@ -78,10 +136,124 @@ def extractBaseNameAndCoords(baseNameWithRowCol):
     
     
 
-def removeDuplicateBoxesRC(imageDetectionsRowCol, boundBoxChunkSize, classificationChunkSize):
+def neighbourCheckArea(boundBoxChunkSize, classificationChunkSize):
+    """
+    Gives how many rows and columns apart two chunks can be while still overlapping, as chunks further apart than
+    this can never contain the same crosswalk.
+
+    Args:
+        boundBoxChunkSize (int): The size of each side of the bounding box image.
+        classificationChunkSize (int): The size of each side of the classification image.
+
+    Returns:
+        int: The largest difference in row or column that is checked for duplicates.
+    """
+    if (boundBoxChunkSize / classificationChunkSize) % 2 == 1:
+        return boundBoxChunkSize // classificationChunkSize
+    return math.ceil(boundBoxChunkSize / classificationChunkSize) + 1
+
+
+
+def duplicateBoxMask(corners, confidences, chunkIds, rows, cols, checkArea, threshold=0.7):
+    """
+    Find the duplicate bounding boxes between the chunks of a single image. All of the boxes in the image are put into one
+    STRtree, so only pairs of boxes whose envelopes intersect are compared, instead of every pair of boxes in
+    neighbouring chunks. Chunks are processed in order of their ids, and their neighbours in order of row then column,
+    the box with the lower confidence being removed from each duplicate pair, or the box of the chunk being processed if
+    both have the same confidence.
+
+    Args:
+        corners (numpy array): The corners of every box in the image, of shape (N, 4, 2).
+        confidences (numpy array): The confidence of every box, of shape (N,).
+        chunkIds (numpy array): The id of the chunk of every box, of shape (N,).
+        rows (numpy array): The row of the chunk of every box, of shape (N,).
+        cols (numpy array): The column of the chunk of every box, of shape (N,).
+        checkArea (int): The largest difference in row or column between two chunks whose boxes are compared.
+        threshold (float): The scaled IoU above which two boxes are duplicates.
+
+    Returns:
+        numpy array: A boolean array which is True for every box that is kept.
+    """
+    corners = np.asarray(corners, dtype=np.float64)
+    chunkIds, rows, cols = np.asarray(chunkIds), np.asarray(rows), np.asarray(cols)
+    isKept = np.ones(len(corners), dtype=bool)
+    if len(corners) == 0:
+        return isKept
+    confidences = np.asarray(confidences).tolist()
+
+    # Every pair of boxes whose envelopes intersect, boxes whose envelopes do not intersect cannot overlap
+    polygons = shapely.polygons(corners)
+    boxA, boxB = shapely.STRtree(polygons).query(polygons)
+    dRow = rows[boxB] - rows[boxA]
+    dCol = cols[boxB] - cols[boxA]
+    isNeighbour = (chunkIds[boxA] != chunkIds[boxB]) & (np.abs(dRow) <= checkArea) & (np.abs(dCol) <= checkArea)
+    boxA, boxB, dRow, dCol = boxA[isNeighbour], boxB[isNeighbour], dRow[isNeighbour], dCol[isNeighbour]
+
+    # The scaled IoU is symmetric, so it is only calculated once for each pair and then looked up for both orders
+    pairKeys = np.minimum(boxA, boxB).astype(np.int64) * len(corners) + np.maximum(boxA, boxB)
+    isFirst = boxA < boxB
+    isDuplicateFirst = scaledIous(corners[boxA[isFirst]], corners[boxB[isFirst]]) > threshold
+    isDuplicate = np.isin(pairKeys, pairKeys[isFirst][isDuplicateFirst])
+    boxA, boxB, dRow, dCol = boxA[isDuplicate], boxB[isDuplicate], dRow[isDuplicate], dCol[isDuplicate]
+
+    # The same order the chunks, their neighbours and their boxes were compared in by the neighbour scan
+    order = np.lexsort((boxB, boxA, dCol, dRow, chunkIds[boxA]))
+
+    matchedGroup = None
+    for a, b in zip(boxA[order].tolist(), boxB[order].tolist()):
+        # Each box removes at most one box from each neighbouring chunk
+        group = (a, chunkIds[b])
+        if group == matchedGroup or not isKept[a] or not isKept[b]:
+            continue
+        matchedGroup = group
+        if confidences[a] <= confidences[b]:
+            isKept[a] = False
+        else:
+            isKept[b] = False
+    return isKept
+
+
+
+def removeDuplicateBoxesInImage(imageDetectionsRowCol, chunks, checkArea, threshold=0.7):
+    """
+    Remove duplicate bounding boxes between the chunks of a single image with duplicateBoxMask, processing the chunks
+    in the order they are given.
+
+    Args:
+        imageDetectionsRowCol (dict): Dictionary with chunked detection results, where each chunk 
+                                      contains bounding boxes and corresponding confidence scores.
+        chunks (list): The (key, row, column) of every chunk of the image in imageDetectionsRowCol.
+        checkArea (int): The largest difference in row or column between two chunks whose boxes are compared.
+        threshold (float): The scaled IoU above which two boxes are duplicates.
+
+    This function directly modifies the `imageDetectionsRowCol` dictionary by removing duplicate boxes.
+    """
+    boxes, confidences, chunkIds = [], [], []
+    for chunkId, (key, _, _) in enumerate(chunks):
+        allPointsList, allConfidenceList = imageDetectionsRowCol[key]
+        boxes.extend(allPointsList)
+        confidences.extend(allConfidenceList)
+        chunkIds.extend([chunkId] * len(allPointsList))
+    if not boxes:
+        return
+
+    chunkIds = np.asarray(chunkIds)
+    rows = np.array([row for _, row, _ in chunks])[chunkIds]
+    cols = np.array([col for _, _, col in chunks])[chunkIds]
+    isKept = duplicateBoxMask(boxes, confidences, chunkIds, rows, cols, checkArea, threshold)
+
+    for chunkId, (key, _, _) in enumerate(chunks):
+        chunkIsKept = isKept[chunkIds == chunkId]
+        imageDetectionsRowCol[key][0] = [box for box, kept in zip(imageDetectionsRowCol[key][0], chunkIsKept) if kept]
+        imageDetectionsRowCol[key][1] = [conf for conf, kept in zip(imageDetectionsRowCol[key][1], chunkIsKept) if kept]
+
+
+
+def removeDuplicateBoxesRC(imageDetectionsRowCol, boundBoxChunkSize=1024, classificationChunkSize=256):
     """
     Remove duplicate bounding boxes that overlap with neighboring chunks in an 11x11 grid. This is chosen because this is the
-    max difference in row and column where an overlap in the image segmented could occur.
+    max difference in row and column where an overlap in the image segmented could occur. Each image is filtered on its own
+    with removeDuplicateBoxesInImage.
     
     Args:
         imageDetectionsRowCol (dict): Dictionary with chunked detection results, where each chunk 
@@ -91,52 +263,42 @@ def removeDuplicateBoxesRC(imageDetectionsRowCol, boundBoxChunkSize, classificat
     
     This function directly modifies the `imageDetectionsRowCol` dictionary by removing duplicate boxes.
     """
-    if (boundBoxChunkSize / classificationChunkSize) % 2 == 1:
-        checkArea = boundBoxChunkSize // classificationChunkSize
-    else:
-        checkArea = math.ceil(boundBoxChunkSize / classificationChunkSize) + 1
+    checkArea = neighbourCheckArea(boundBoxChunkSize, classificationChunkSize)
+    chunksByBaseName = {}
+    for key in imageDetectionsRowCol:
+        baseName, row, col = extractBaseNameAndCoords(key)
+        chunksByBaseName.setdefault(baseName, []).append((key, row, col))
+
     with tqdm(total=len(imageDetectionsRowCol), desc="Filtering crosswalks") as pbar:
-        for currentKeyToFilter in imageDetectionsRowCol:
-            allPointsList, allConfidenceList = imageDetectionsRowCol[currentKeyToFilter]
-            toRemove = set()
-            baseName, row, col = extractBaseNameAndCoords(currentKeyToFilter)
-            toRemoveNeighboringMap = {}
-
-            for dRow in range(-checkArea, checkArea + 1):  # Check 11x11 grid, with the current image being in the center.
-                for dCol in range(-checkArea, checkArea + 1):
-                    if dRow == 0 and dCol == 0: # If it is currently checking itself, skip to the next neighbor.
-                        continue
-
-                    newRow, newCol = row + dRow, col + dCol
-                    neighboringChunk = f"{baseName}__r{newRow}__c{newCol}"
-                    if neighboringChunk not in imageDetectionsRowCol:
-                        continue
-                    neighboringBoxes, neighboringConf = imageDetectionsRowCol[neighboringChunk]
-                    toRemoveNeighboring = set()
-
-                    for i, boxA in enumerate(allPointsList):
-                        if i in toRemove:
-                            continue
-                        for j, boxB in enumerate(neighboringBoxes):
-                            if j in toRemoveNeighboring:
-                                continue
-
-                            if checkBoxIntersection(boxA, boxB, threshold=0.7):
-                                if allConfidenceList[i] <= neighboringConf[j]:
-                                    toRemove.add(i)
-                                    break
-                                else:
-                                    toRemoveNeighboring.add(j)
-                                    break
-                    if toRemoveNeighboring:
-                        toRemoveNeighboringMap[neighboringChunk] = toRemoveNeighboringMap.get(neighboringChunk, set()).union(toRemoveNeighboring)
-
-            for chunk, indices in toRemoveNeighboringMap.items():
-                imageDetectionsRowCol[chunk][0] = [box for i, box in enumerate(imageDetectionsRowCol[chunk][0]) if i not in indices]
-                imageDetectionsRowCol[chunk][1] = [conf for i, conf in enumerate(imageDetectionsRowCol[chunk][1]) if i not in indices]
-
-            imageDetectionsRowCol[currentKeyToFilter][0] = [box for i, box in enumerate(allPointsList) if i not in toRemove]
-            imageDetectionsRowCol[currentKeyToFilter][1] = [conf for i, conf in enumerate(allConfidenceList) if i not in toRemove]
+        for chunks in chunksByBaseName.values():
+            removeDuplicateBoxesInImage(imageDetectionsRowCol, chunks, checkArea)
+            pbar.update(len(chunks))
 
-            pbar.update(1)
 
+
+def removeDuplicateDetections(detections, boundBoxChunkSize=1024, classificationChunkSize=256, threshold=0.7):
+    """
+    Remove duplicate bounding boxes from a DetectionSet, in the same way as removeDuplicateBoxesRC. The chunks of each
+    image are processed in the order their first box was added.
+
+    Args:
+        detections (DetectionSet): The detections of every image.
+        boundBoxChunkSize (int): The size of each side of the bounding box image.
+        classificationChunkSize (int): The size of each side of the classification image.
+        threshold (float): The scaled IoU above which two boxes are duplicates.
+
+    This function directly modifies `detections` by removing duplicate boxes.
+    """
+    checkArea = neighbourCheckArea(boundBoxChunkSize, classificationChunkSize)
+    detections.sortByImage()
+    isKept = np.ones(len(detections), dtype=bool)
+    start = 0
+    with tqdm(total=int(np.count_nonzero(np.diff(detections.imageStarts))), desc="Filtering crosswalks") as pbar:
+        for _, corners, conf, rows, cols in detections.images():
+            # Chunks are numbered in the order their first box appears
+            _, firstIndex, inverse = np.unique(np.stack([rows, cols], axis=1), axis=0, return_index=True, return_inverse=True)
+            chunkIds = np.argsort(np.argsort(firstIndex))[inverse.reshape(-1)]
+            isKept[start:start + len(conf)] = duplicateBoxMask(corners, conf, chunkIds, rows, cols, checkArea, threshold)
+            start += len(conf)
+            pbar.update(1)
+    detections.keep(isKept)
@@ -0,0 +1,223 @@
+import queue
+import threading
+
+
+class Stage:
+    """
+    One step of a pipeline. The function of a stage takes one item and returns an iterable of any number of items
+    for the next stage, so a stage can drop items, pass them on, or split them into several, such as the segmentation
+    which makes many segmented images from one input image.
+
+    Each stage runs on its own worker threads, and takes its items from a bounded queue fed by the stage before it.
+    The models used by the stages run in PyTorch, GDAL and NumPy, which release the GIL, so the stages overlap on
+    multi-core machines even though they are threads.
+    """
+    def __init__(self, name, function, workers=1, batchSize=None, queueSize=8):
+        """
+        Args:
+            name (str): The name of the stage, used in error messages.
+            function (callable): Takes one item and returns an iterable of items for the next stage.
+            workers (int): The number of threads running the function at once.
+            batchSize (int): If given, the items from the stage before are grouped into lists of up to batchSize items
+                in order, and the function is given one list at a time.
+            queueSize (int): The largest number of items waiting for this stage. When the queue is full the stage
+                before it waits, so a slow stage holds back the ones before it instead of letting items pile up.
+        """
+        if workers < 1:
+            raise ValueError(f"Stage {name} needs at least one worker, not {workers}")
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.batchSize = batchSize
+        self.queueSize = queueSize
+
+
+class StageRunner:
+    """
+    Runs the workers of one stage. Workers can finish their items in any order, so each item carries a sequence number,
+    and finished items are only passed on once every item before them has been, which keeps the output of the pipeline
+    in the same order as its input no matter how many workers each stage has.
+    """
+    # How often blocked threads check whether the pipeline has been stopped, in seconds
+    pollInterval = 0.1
+
+    def __init__(self, stage, inputQueue, outputQueue, nextBatchSize, nextWorkers, stopEvent, errors):
+        """
+        Args:
+            stage (Stage): The stage to run.
+            inputQueue (queue.Queue): The queue of (sequence number, item) pairs for this stage.
+            outputQueue (queue.Queue): The queue of the next stage, or the output queue of the pipeline.
+            nextBatchSize (int): The batchSize of the next stage, None if it takes single items.
+            nextWorkers (int): The number of threads reading the output queue, each is sent None once this stage is done.
+            stopEvent (threading.Event): Set when the pipeline is stopped.
+            errors (list): The (stage name, exception) of every failed stage.
+        """
+        self.stage = stage
+        self.inputQueue = inputQueue
+        self.outputQueue = outputQueue
+        self.nextBatchSize = nextBatchSize
+        self.nextWorkers = nextWorkers
+        self.stopEvent = stopEvent
+        self.errors = errors
+        self.condition = threading.Condition()
+        # Finished items waiting for the items before them, by sequence number
+        self.pending = {}
+        self.nextSeq = 0
+        self.outSeq = 0
+        self.batch = []
+        self.runningWorkers = stage.workers
+        # A worker only starts an item this far ahead of the oldest unfinished one, which bounds the pending items
+        self.window = stage.workers + stage.queueSize
+        self.threads = [threading.Thread(target=self.work, name=f"{stage.name}-{i}", daemon=True) for i in range(stage.workers)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, item):
+        """Puts an item on the output queue, waiting while it is full unless the pipeline is stopped"""
+        return putUnlessStopped(self.outputQueue, item, self.stopEvent)
+
+    def emit(self, item):
+        """
+        Passes a finished item on, grouping items into batches if the next stage takes them.
+
+        Returns:
+            bool: False if the pipeline was stopped before the item could be passed on.
+        """
+        if self.nextBatchSize is not None:
+            self.batch.append(item)
+            if len(self.batch) < self.nextBatchSize:
+                return True
+            item, self.batch = self.batch, []
+        if not self.put((self.outSeq, item)):
+            return False
+        self.outSeq += 1
+        return True
+
+    def work(self):
+        try:
+            while not self.stopEvent.is_set():
+                try:
+                    entry = self.inputQueue.get(timeout=self.pollInterval)
+                except queue.Empty:
+                    continue
+                if entry is None:
+                    break
+                seq, item = entry
+                with self.condition:
+                    while seq >= self.nextSeq + self.window and not self.stopEvent.is_set():
+                        self.condition.wait(self.pollInterval)
+                results = list(self.stage.function(item))
+                with self.condition:
+                    self.pending[seq] = results
+                    # Items are passed on under the lock, so they leave in the same order they came in
+                    while self.nextSeq in self.pending:
+                        for result in self.pending.pop(self.nextSeq):
+                            if not self.emit(result):
+                                return
+                        self.nextSeq += 1
+                    self.condition.notify_all()
+        except Exception as e:
+            self.errors.append((self.stage.name, e))
+            self.stopEvent.set()
+            return
+        finally:
+            with self.condition:
+                self.runningWorkers -= 1
+                lastWorker = self.runningWorkers == 0
+        # The last worker to finish passes on the final partial batch and ends the next stage
+        if lastWorker:
+            if self.batch and not self.put((self.outSeq, self.batch)):
+                return
+            for _ in range(self.nextWorkers):
+                if not self.put(None):
+                    return
+
+
+def putUnlessStopped(itemQueue, item, stopEvent):
+    """
+    Puts an item on a bounded queue, waiting while it is full.
+
+    Returns:
+        bool: False if the pipeline was stopped before the item could be put on the queue.
+    """
+    while not stopEvent.is_set():
+        try:
+            itemQueue.put(item, timeout=StageRunner.pollInterval)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def runPipeline(items, stages, outputQueueSize=8):
+    """
+    Runs items through a list of stages, with every stage working at the same time on different items. Each stage
+    takes items from a bounded queue, so the stages before a slow stage wait for it rather than filling memory, and
+    the time taken overall approaches that of the slowest stage rather than the sum of all of them.
+
+    The items come out in the order they would have if each stage had been run on all of the items one after another.
+    If a stage raises an exception, the pipeline is stopped and the exception is raised here.
+
+    Args:
+        items (iterable): The items given to the first stage.
+        stages (list): The Stage of each step, in order.
+        outputQueueSize (int): The largest number of finished items waiting to be consumed.
+
+    Yields:
+        item: The items returned by the last stage, in order.
+    """
+    stopEvent = threading.Event()
+    errors = []
+    queues = [queue.Queue(maxsize=stage.queueSize) for stage in stages] + [queue.Queue(maxsize=outputQueueSize)]
+    runners = []
+    for i, stage in enumerate(stages):
+        if i + 1 < len(stages):
+            nextBatchSize, nextWorkers = stages[i + 1].batchSize, stages[i + 1].workers
+        else:
+            nextBatchSize, nextWorkers = None, 1
+        runners.append(StageRunner(stage, queues[i], queues[i + 1], nextBatchSize, nextWorkers, stopEvent, errors))
+
+    def feed():
+        try:
+            firstBatchSize = stages[0].batchSize
+            batch = []
+            seq = 0
+            for item in items:
+                if firstBatchSize is not None:
+                    batch.append(item)
+                    if len(batch) < firstBatchSize:
+                        continue
+                    item, batch = batch, []
+                if not putUnlessStopped(queues[0], (seq, item), stopEvent):
+                    return
+                seq += 1
+            if batch and not putUnlessStopped(queues[0], (seq, batch), stopEvent):
+                return
+            for _ in range(stages[0].workers):
+                putUnlessStopped(queues[0], None, stopEvent)
+        except Exception as e:
+            errors.append(("input", e))
+            stopEvent.set()
+
+    feeder = threading.Thread(target=feed, name="pipeline-input", daemon=True)
+    feeder.start()
+    for runner in runners:
+        runner.start()
+
+    try:
+        while not errors:
+            try:
+                entry = queues[-1].get(timeout=StageRunner.pollInterval)
+            except queue.Empty:
+                continue
+            if entry is None:
+                break
+            yield entry[1]
+        if errors:
+            stageName, error = errors[0]
+            raise RuntimeError(f"Pipeline stage {stageName} failed: {error}") from error
+    finally:
+        # Stops every thread if the consumer stops early or a stage fails
+        stopEvent.set()
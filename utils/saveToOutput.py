@@ -1,5 +1,6 @@
 import json
 import os
+from utils.detectionSet import DetectionSet
 
 def saveTXTOutput(outputFolder, imageName, coordinates, confidences=None):
     """Save coordinates and optional confidence scores to a TXT file with one bounding box per line"""
@@ -14,17 +15,28 @@ def saveTXTOutput(outputFolder, imageName, coordinates, confidences=None):
                 line += f" {confidences[i]}"
             file.write(line + "\n")
 
+def detectionItems(imageDetections):
+    """Yield the name, boxes and confidences of each image, from either a DetectionSet or a dictionary of image names to boxes and confidences"""
+    if isinstance(imageDetections, DetectionSet):
+        for baseName, corners, conf, _, _ in imageDetections.images():
+            yield baseName, corners.tolist(), conf.tolist()
+    else:
+        for baseName, coordAndConf in imageDetections.items():
+            yield baseName, coordAndConf[0], coordAndConf[1]
+
 def saveToOutput(outputType, outputFolder, imageDetections):
-    """Save the image detection results as either JSON or multiple TXT files"""
+    """Save the image detection results, given as a DetectionSet or a dictionary, as either JSON or multiple TXT files"""
+    numOfImages = 0
     if outputType == "0":
         # Save as JSON
         jsonOutput = []
-        for baseName, coordAndConf in imageDetections.items():
+        for baseName, coordinates, confidences in detectionItems(imageDetections):
             jsonOutput.append({
                 "image": f"{baseName}",
-                "coordinates": coordAndConf[0],
-                "confidence": coordAndConf[1]
+                "coordinates": coordinates,
+                "confidence": confidences
             })
+            numOfImages += 1
         
         jsonPath = os.path.join(outputFolder, "output.json")
         with open(jsonPath, 'w') as file:
@@ -32,8 +44,9 @@ def saveToOutput(outputType, outputFolder, imageDetections):
         print(f"\nJSON output saved to: {jsonPath}")
     else:
         # Save as TXT files
-        for baseName, coordAndConf in imageDetections.items():
-            saveTXTOutput(outputFolder, baseName, coordAndConf[0], coordAndConf[1])
+        for baseName, coordinates, confidences in detectionItems(imageDetections):
+            saveTXTOutput(outputFolder, baseName, coordinates, confidences)
+            numOfImages += 1
         print(f"\nTXT files saved to: {outputFolder}")
     
-    print(f"Processed {len(imageDetections)} original images")
\ No newline at end of file
+    print(f"Processed {numOfImages} original images")
\ No newline at end of file